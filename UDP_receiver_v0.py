@@ -1,13 +1,49 @@
+import sys
+import time
+import signal
 import socket
+import udp_capture
+import udp_seq
 
 UDP_IP = "0.0.0.0"  # Listen on all interfaces
-UDP_PORT = 5005      # Ensure this matches the sender
+RECORD_FILE = sys.argv[1] if len(sys.argv) > 1 else None  # Optional .pcap capture to append to
+UDP_PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 5005  # Ensure this matches the sender
+
+def stop_on_sigterm(signum, frame):
+    """Treat SIGTERM like Ctrl+C so the capture file is closed cleanly."""
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, stop_on_sigterm)
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sock.bind((UDP_IP, UDP_PORT))
 
 print(f"Listening on UDP port {UDP_PORT}...")
+recorder = None
+if RECORD_FILE:
+    recorder = udp_capture.CaptureWriter(RECORD_FILE, (UDP_IP, UDP_PORT))
+    print(f"Recording to {RECORD_FILE}")
+
+streams = udp_seq.StreamTracker()  # Loss/reorder/duplicate tracking for sequence-stamped senders
 
-while True:
-    data, addr = sock.recvfrom(1024)
-    print(f"Received raw message: {data} from {addr}")
+try:
+    while True:
+        data, addr = sock.recvfrom(65535)
+        timestamp_ns = time.time_ns()
+        if recorder:
+            recorder.write(data, addr, timestamp_ns)
+        streams.add(data, addr, timestamp_ns)
+        print(f"Received raw message: {data} from {addr}")
+except KeyboardInterrupt:
+    pass
+finally:
+    if recorder:
+        recorder.close()
+        print(f"Recorded {recorder.count} packets to {RECORD_FILE}")
+    if streams.streams:
+        report = streams.report()
+        for sender, stats in report.items():
+            print(f"{sender}: {stats['unique']}/{stats['expected']} received, {stats['lost']} lost, "
+                  f"{stats['reordered']} reordered, {stats['duplicates']} duplicates")
+        report_path = (RECORD_FILE.rsplit(".", 1)[0] if RECORD_FILE else time.strftime("%Y%m%d_%H%M%S_receiver")) + "_loss.json"
+        print(f"Loss report: {udp_seq.write_report(report, report_path)}")
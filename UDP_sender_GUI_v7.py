@@ -3,19 +3,50 @@ import os
 import time
 import socket
 import threading
+import collections
 import subprocess
+import zipfile
 import sys
 import pyvisa
+import udp_blobs
+import udp_capture
+import udp_checksum
+import udp_clock
+import udp_control
+import udp_expect
+import udp_journal
+import udp_kstamp
+import udp_lint
+import udp_metrics
+import udp_plan
+import udp_queue
+import udp_rate
+import udp_retention
+import udp_seq
+import udp_soak
+import udp_template
+import udp_trace
+import udp_txproc
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QTextEdit, QListWidget, QTabWidget, QSizePolicy,
-    QLabel, QHBoxLayout, QMessageBox, QSplitter, QMenu, QLineEdit, QFormLayout, QProgressBar
+    QLabel, QHBoxLayout, QMessageBox, QSplitter, QMenu, QLineEdit, QFormLayout, QProgressBar, QCheckBox,
+    QListWidgetItem
 )
-from PyQt6.QtGui import QPixmap
+from PyQt6.QtGui import QPixmap, QTextCursor, QColor
 from PyQt6.QtCore import QThread, pyqtSignal, QDateTime, Qt, QTimer
 
 # Configure default directories
 UDP_COMMANDS_DIR = "./commands"  # Folder storing command files
 RESULTS_DIR = "./results"   # Folder to save oscilloscope images and logs
+METRICS_PORT = udp_metrics.DEFAULT_METRICS_PORT  # Local /metrics endpoint (0 disables it)
+TX_CPU = None  # CPU core for the separate transmit process (None = no pinning; Linux only)
+TX_POLL_INTERVAL = 0.005  # Seconds between status ring polls while the transmit process runs
+PACING = {}  # Adaptive pacing bounds and tuning, keys as udp_config.json "pacing", e.g. {"min_delay": 0.001, "max_delay": 1.0}; see udp_rate.py
+SOAK_POLICY = None  # Overrides for udp_soak.DEFAULT_POLICY, e.g. {"max_captures": 500}
+LOG_PANE_MAX_LINES = 20000  # Older lines scroll out of the log pane (the run log keeps everything)
+KERNEL_TIMESTAMPS = False  # Record kernel send/receive times in the run log and summary (Linux); see udp_kstamp.py
+CONTROL_PORT = 0  # Local control API for automation, e.g. udp_control.DEFAULT_CONTROL_PORT (0 = off); see udp_control.py
+RETENTION_POLICY = None  # e.g. {"max_age_days": 90, "keep_per_script": 50, "max_total_mb": 2048}; see udp_retention.py
 
 # Ensure the directories exist
 os.makedirs(UDP_COMMANDS_DIR, exist_ok=True)
@@ -44,91 +75,414 @@ class PingThread(QThread):
         self.ping_result.emit(connected)
 
 class UdpSenderThread(QThread):
-    log_signal = pyqtSignal(str)
+    log_signal = pyqtSignal(object, str)  # (this thread, line): queued deliveries keep the sender alive and known
 
-    def __init__(self, filename, server_address, scope_ip, parent=None):
+    def __init__(self, filename, server_address, scope_ip, profile=False, sequence=False, adaptive=False, isolated=False, soak=False, resume=None,
+                 clock=None, start_at=None, job=None, parent=None):
         super().__init__(parent)
         self.filename = filename
         self.server_address = server_address
         self.scope_ip = scope_ip  # Store oscilloscope IP
+        self.metrics = udp_metrics.RunMetrics(os.path.basename(filename), job)
+        self.pending_logs = 0  # Log records emitted but not yet shown by the GUI
+        # Span tracing (and a sampling profile) is only collected for profiled runs
+        self.tracer = udp_trace.Tracer(sample_interval=udp_trace.DEFAULT_SAMPLE_INTERVAL) if profile and not soak else udp_trace.NULL_TRACER
+        # Sequence stamps let the receiving side report loss, reordering and duplicates
+        self.stamper = udp_seq.SequenceStamper("trailer") if sequence else None
+        # Adaptive pacing replaces the fixed 1 s delay with a rate driven by DUT replies
+        self.pacer = udp_rate.pacer_from_config(PACING, 1.0) if adaptive else None
+        # Send from a separate process so GUI work cannot disturb packet timing
+        self.isolated = isolated
+        self.tx_summary = None
+        # Soak runs loop the file until stopped, with bounded logs, captures and memory
+        self.soak = soak
+        self.soak_policy = udp_soak.soak_policy(SOAK_POLICY)
+        self.capture_window = udp_soak.CaptureWindow(RESULTS_DIR, self.soak_policy["max_captures"]) if soak else None
+        self.stop_event = threading.Event()
+        # A journal of the run position lets an interrupted run continue where it stopped
+        self.resume = resume  # Journal record of the interrupted run to continue, or None
+        self.journal = None
+        self.passes = 0
+        self.captures = 0
+        # Synchronized runs wait for a common start and stamp their log with the reference clock
+        self.clock = clock  # udp_clock.SyncedClock, or None
+        self.start_at = start_at  # Start deadline in reference time
+
+    def emit_log(self, text):
+        """Emit a log line to the GUI and track how many are still queued."""
+        self.pending_logs += 1
+        self.metrics.set_log_queue_depth(self.pending_logs)
+        with self.tracer.span("log.emit", "log"):
+            self.log_signal.emit(self, text)
+
+    def log_shown(self):
+        """Called by the GUI once it has displayed an emitted log line."""
+        self.pending_logs = max(0, self.pending_logs - 1)
+        udp_metrics.LOG_QUEUE_DEPTH.set(self.pending_logs)
+
+    def write_log(self, log_file, text):
+        """Emit a log line and append it to the run log file."""
+        self.emit_log(text)
+        with self.tracer.span("log.write", "write"):
+            log_file.write(f"{self.clock.stamp()} {text}\n" if self.clock is not None else text + "\n")
 
     def capture_scopeshot(self, scopeshot_folder):
-        """Capture a screenshot from the oscilloscope and save it to the scopeshot folder."""
+        """Capture a screenshot from the oscilloscope and save it to the scopeshot folder; returns True if it was saved."""
         oscilloscope_resource = f"TCPIP0::{self.scope_ip}::INSTR"  # Use passed IP
+        start = time.perf_counter()
 
         try:
-            rm = pyvisa.ResourceManager()
-            oscilloscope = rm.open_resource(oscilloscope_resource)
-            oscilloscope.write(":DISPlay:DATA? PNG")  # SCPI Command to request screenshot data
-            image_data = oscilloscope.read_raw()  # Read the raw image data
+            with self.tracer.span("visa.open", "capture"):
+                rm = pyvisa.ResourceManager()
+                oscilloscope = rm.open_resource(oscilloscope_resource)
+            with self.tracer.span("visa.read", "capture"):
+                oscilloscope.write(":DISPlay:DATA? PNG")  # SCPI Command to request screenshot data
+                image_data = oscilloscope.read_raw()  # Read the raw image data
 
             # Generate a filename with timestamp including milliseconds
             timestamp = QDateTime.currentDateTime().toString("yyyyMMdd_HHmmss_zzz")
             image_path = os.path.join(scopeshot_folder, f"{timestamp}_scopeshot.png")
 
-            with open(image_path, "wb") as img_file:
-                img_file.write(image_data)
+            # Identical screens are stored once and linked into the run folder
+            with self.tracer.span("capture.write", "write", size=len(image_data)):
+                os.makedirs(scopeshot_folder, exist_ok=True)
+                digest, new = udp_blobs.BlobStore(RESULTS_DIR).store(image_data, image_path)
+                if self.capture_window is not None:
+                    self.capture_window.add(image_path)
 
-            self.log_signal.emit(f"Scopeshot saved: {image_path}")
+            self.metrics.record_capture(time.perf_counter() - start)
+            self.captures += 1
+            self.emit_log(f"Scopeshot saved: {image_path}" + ("" if new else f" (same image as an earlier capture, {digest[:12]})"))
+            return True
 
         except Exception as e:
-            self.log_signal.emit(f"Scopeshot error: {e}")
+            self.metrics.record_error("capture")
+            self.emit_log(f"Scopeshot error: {e}")
+            return False
+
+    def sleep_until(self, due):
+        """Sleep out the fixed delay after a command and record how late it ended."""
+        with self.tracer.span("pace.sleep", "pace"):
+            time.sleep(max(0.0, due - time.perf_counter()))
+        self.metrics.record_pacing(time.perf_counter() - due)
+
+    def send_pass(self, plan, sock, log_file, scopeshot_folder, receiver, loops, payloads, resume=None):
+        """Send every op of a plan once (from a journal position when resuming); soak runs call this until stopped."""
+        due = None  # End of the 1 s delay after the last command; a following wait replaces it
+        for op, line, source, line_no in loops.iterate(plan["ops"], resume):
+            if self.stop_event.is_set():
+                self.write_log(log_file, "Stopped by user.")
+                break
+            self.journal.record(loops.position(), packets=self.metrics.packets, captures=self.captures, passes=self.passes)
+            if due is not None and op not in udp_plan.WAIT_OPS:
+                self.sleep_until(due)
+            due = None
+
+            # Handle #EXPECT / #WAIT_QUIET (block only until the board answers or goes quiet)
+            if op in udp_plan.WAIT_OPS:
+                with self.tracer.span(op, "wait"):
+                    if op == "expect":
+                        result = receiver.expect(line["pattern"], line["timeout"])
+                        passed = result[0] is not None
+                    else:
+                        result = receiver.wait_quiet(line["quiet"], line["timeout"])
+                        passed = result[0]
+                self.metrics.record_expect(passed)
+                if not passed:
+                    loops.expectation_failed()
+                self.write_log(log_file, udp_expect.describe(op, line, result))
+                continue
+
+            # Handle Packet Templates (generated and sent in bulk)
+            if op == "template":
+                self.write_log(log_file, f"Sending template: {line.count} packets of {line.length} bytes")
+                try:
+                    sent = udp_template.send_template(sock, self.server_address, line, 1.0, metrics=self.metrics, tracer=self.tracer, stamper=self.stamper, pacer=self.pacer)
+                    self.write_log(log_file, f"Sent {sent} templated packets")
+                except Exception as e:
+                    self.metrics.record_error("send")
+                    self.write_log(log_file, f"Error sending template: {e}")
+                continue
+
+            # Handle Capture Replay
+            if op == "replay":
+                pace = "as fast as possible" if line["speed"] is None else f"at {line['speed']:g}x speed"
+                self.write_log(log_file, f"Replaying {line['path']} {pace}")
+                try:
+                    with self.tracer.span("replay", "send"):
+                        sent = udp_capture.replay_capture(line["path"], sock, self.server_address, line["speed"], metrics=self.metrics)
+                    self.write_log(log_file, f"Replayed {sent} packets")
+                except Exception as e:
+                    self.metrics.record_error("replay")
+                    self.write_log(log_file, f"Error replaying capture: {e}")
+                continue
+
+            # Handle Scopeshot Capture
+            if op == "capture":
+                if self.pacer is not None:
+                    self.pacer.finish(sock)  # Let the board answer everything before capturing
+                self.write_log(log_file, "Triggering Oscilloscope Capture...")
+                with self.tracer.span("capture", "capture"):
+                    self.capture_scopeshot(scopeshot_folder)  # ✅ Fixed incorrect argument count
+                continue  # Move to the next command
+
+            # Process Regular UDP Commands
+            try:
+                message = payloads.get(line)
+                if message is None:
+                    with self.tracer.span("parse.hex", "parse"):
+                        message = udp_checksum.encode_line(line)
+                    if loops.depth:
+                        payloads[line] = message
+                self.write_log(log_file, f"Sending: {message}")
+                if self.stamper is not None:
+                    message = self.stamper.stamp(message)
+                sent_at = time.perf_counter()
+                with self.tracer.span("send", "send", size=len(message)):
+                    sock.sendto(message, self.server_address)
+                self.metrics.record_send(len(message), time.perf_counter() - sent_at)
+                if self.pacer is not None:
+                    with self.tracer.span("pace.adaptive", "pace"):
+                        self.pacer.after_send(sock, sent_at)
+                    continue
+                due = sent_at + 1.0
+            except Exception as e:
+                self.metrics.record_error("send")
+                self.write_log(log_file, f"Error sending command: {e}")
+
+        if due is not None:
+            self.sleep_until(due)
+
+    def run_isolated(self, ops, log_file, scopeshot_folder, start=0):
+        """Run the plan from op start in the transmit process; turn its status events into log lines, metrics and captures.
+
+        Returns True if every op was sent.
+        """
+        ops = list(ops)[start:]
+        tx = udp_txproc.TransmitProcess(ops, self.server_address, 1.0, "trailer" if self.stamper else None,
+                                        PACING if self.pacer is not None else None, TX_CPU)
+        self.write_log(log_file, f"Transmitting {len(ops)} commands from a separate process")
+        tx.start()
+        done = False
+        try:
+            while not done and not self.stop_event.is_set():
+                events = tx.events()
+                if not events:
+                    if not tx.process.is_alive():
+                        events = tx.events()  # Anything written just before it exited
+                        if not events:
+                            self.metrics.record_error("run")
+                            self.write_log(log_file, f"Transmit process exited unexpectedly (code {tx.process.exitcode})")
+                            break
+                    else:
+                        time.sleep(TX_POLL_INTERVAL)
+                        continue
+                for kind, index, a, b, c in events:
+                    op, line, source, line_no = ops[index] if index < len(ops) else (None, None, None, None)
+                    if kind in (udp_txproc.EV_SENT, udp_txproc.EV_TEMPLATE, udp_txproc.EV_REPLAY, udp_txproc.EV_ERROR):
+                        # Op index is over and the child is on the next one: journal that op as started, as send_pass does
+                        self.journal.record([[0, start + index + 1]], packets=self.metrics.packets, captures=self.captures)
+                    if kind == udp_txproc.EV_SENT:
+                        self.write_log(log_file, f"Sending: {udp_checksum.encode_line(line)}")
+                        self.metrics.record_send(a, b / 1e9)
+                    elif kind == udp_txproc.EV_PACED:
+                        self.metrics.record_pacing(a / 1e9)
+                    elif kind == udp_txproc.EV_CAPTURE:
+                        self.journal.record([[0, start + index]], packets=self.metrics.packets, captures=self.captures)
+                        self.write_log(log_file, "Triggering Oscilloscope Capture...")
+                        with self.tracer.span("capture", "capture"):
+                            self.capture_scopeshot(scopeshot_folder)
+                        self.journal.record([[0, start + index + 1]], packets=self.metrics.packets, captures=self.captures)
+                        tx.resume()
+                    elif kind == udp_txproc.EV_TEMPLATE:
+                        self.metrics.record_batch(a, b)
+                        self.write_log(log_file, f"Sent {a} templated packets ({line.count} in template)")
+                    elif kind == udp_txproc.EV_REPLAY:
+                        self.metrics.record_batch(a, 0)
+                        self.write_log(log_file, f"Replayed {a} packets from {line['path']}")
+                    elif kind == udp_txproc.EV_ERROR:
+                        self.metrics.record_error("send")
+                        self.write_log(log_file, f"Error sending {source}:{line_no}: {tx.error_message(index) or os.strerror(a)}")
+                    elif kind == udp_txproc.EV_RATE:
+                        self.write_log(log_file, f"Rate: {a / 1000.0:.1f} pps at {b / 1e9:.3f}s")
+                    elif kind == udp_txproc.EV_DONE:
+                        done = True
+        finally:
+            if not done:
+                tx.stop()
+            self.tx_summary = tx.finish() or {}
+        if self.tx_summary.get("pin_error"):
+            self.write_log(log_file, self.tx_summary["pin_error"])
+        if self.tx_summary.get("overflowed"):
+            self.write_log(log_file, f"{self.tx_summary['overflowed']} status records were dropped (ring full)")
+        return done
 
     def run(self):
         """Send UDP commands from the selected file and log to a file."""
-        timestamp = QDateTime.currentDateTime().toString("yyyyMMdd_HHmmss_zzz")
-        scopeshot_name = os.path.splitext(os.path.basename(self.filename))[0]  # Remove .txt
-        log_filename = os.path.join(RESULTS_DIR, f"{timestamp}_{scopeshot_name}.txt")  # ✅ Fixed missing .txt extension
-        scopeshot_folder = os.path.join(RESULTS_DIR, f"{timestamp}_{scopeshot_name}")
-        os.makedirs(scopeshot_folder, exist_ok=True)  # Ensure the scopeshot folder exists
+        if self.resume is not None:
+            # Continue in the log and scopeshot folder of the interrupted run
+            log_filename = self.resume["log"]
+            scopeshot_folder = self.resume.get("scopeshots") or udp_journal.scopeshot_folder(log_filename)
+        else:
+            timestamp = QDateTime.currentDateTime().toString("yyyyMMdd_HHmmss_zzz")
+            scopeshot_name = os.path.splitext(os.path.basename(self.filename))[0]  # Remove .txt
+            log_filename = os.path.join(RESULTS_DIR, f"{timestamp}_{scopeshot_name}.txt")  # ✅ Fixed missing .txt extension
+            scopeshot_folder = os.path.join(RESULTS_DIR, f"{timestamp}_{scopeshot_name}")  # Created on the first capture
 
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            with open(self.filename, 'r') as f, open(log_filename, 'w') as log_file:
-                for line in f:
-                    line = line.strip()
-
-                    # Skip empty lines
-                    if not line:
-                        continue
-
-                    # Handle Scopeshot Capture
-                    if line.startswith("#SCOPE CAPTURE"):
-                        log_entry = "Triggering Oscilloscope Capture...\n"
-                        self.log_signal.emit(log_entry.strip())
-                        log_file.write(log_entry)
-                        self.capture_scopeshot(scopeshot_folder)  # ✅ Fixed incorrect argument count
-                        continue  # Move to the next command
-
-                    # Process Regular UDP Commands
-                    line = line.split('#')[0].strip()  # Remove inline comments
-                    if not line:
-                        continue
+            if self.soak:
+                policy = self.soak_policy
+                log_file = udp_soak.RotatingLog(log_filename, policy["max_log_bytes"], policy["rotate_seconds"], policy["keep_logs"],
+                                                append=self.resume is not None)
+                checkpoint = udp_soak.Checkpoint(log_filename.rsplit(".", 1)[0] + "_soak.json", policy["checkpoint_seconds"])
+            else:
+                log_file = open(log_filename, 'a' if self.resume is not None else 'w')
+            with log_file:
+                # Resolve the file (and any nested CMD_ lists) before sending anything
+                self.tracer.start_sampling()
+                try:
+                    with self.tracer.span("plan.load", "parse"):
+                        plan = udp_plan.open_plan(self.filename, UDP_COMMANDS_DIR)
+                except udp_plan.PlanError as e:
+                    for problem in e.problems:
+                        self.write_log(log_file, f"Plan error: {problem}")
+                    self.metrics.record_error("plan")
+                    self.write_log(log_file, "Nothing was sent.")
+                    return
+                if plan.get("streaming"):
+                    self.write_log(log_file, f"Streaming {plan['bytes'] / 1e6:.1f} MB of commands; lines are checked as they are read")
+
+                if self.pacer is not None:
+                    self.pacer.on_change = lambda elapsed, rate, reason: self.write_log(
+                        log_file, f"Rate: {rate:.1f} pps at {elapsed:.3f}s ({reason})")
+
+                resume_at = None
+                fingerprint = udp_journal.plan_fingerprint(plan)
+                if self.resume is not None and self.resume.get("fingerprint") == fingerprint:
+                    self.write_log(log_file, f"Resuming: {udp_journal.describe(self.resume)}")
+                    resume_at = self.resume["pos"]
+                    self.passes = self.resume.get("passes", 0)
+                    self.captures = self.resume.get("captures", 0)
+                    self.metrics.packets = self.resume.get("packets", 0)  # Journal records count the whole run
+                    self.journal = udp_journal.resume_journal(self.resume)
+                else:
+                    if self.resume is not None:
+                        self.write_log(log_file, "Command files changed since the interrupted run; starting from the beginning")
+                        udp_journal.discard(self.resume)
+                    self.journal = udp_journal.RunJournal(udp_journal.journal_path(log_filename), {
+                        "script": self.filename, "fingerprint": fingerprint, "log": log_filename, "scopeshots": scopeshot_folder})
+
+                if self.clock is not None:
+                    lateness = self.clock.wait_until(self.start_at, self.stop_event)
+                    if self.stop_event.is_set():
+                        self.metrics.cancelled = True
+                        if resume_at is None:
+                            self.journal.finish()  # Nothing was sent: nothing to resume
+                        self.write_log(log_file, "Stopped by user before the synchronized start; nothing was sent.")
+                        return
+                    self.write_log(log_file, f"Synchronized start ({self.clock.describe()}, {lateness * 1e6:.1f} us after the deadline)")
+
+                if self.isolated and self.soak:
+                    self.write_log(log_file, "Soak runs send from the GUI process")
+                elif self.isolated and not plan.get("streaming"):
+                    if any(op in udp_plan.WAIT_OPS or op == "loop" for op, *_ in plan["ops"]):
+                        self.write_log(log_file, "#EXPECT, #WAIT_QUIET and loops run in the engine; sending from the GUI process instead")
+                    else:
+                        if KERNEL_TIMESTAMPS:
+                            self.write_log(log_file, "Kernel timestamps are not recorded when sending from a separate process")
+                        if self.run_isolated(plan["ops"], log_file, scopeshot_folder, resume_at[0][1] if resume_at else 0):
+                            self.journal.finish()
+                            self.write_log(log_file, "UDP Transmission Completed.")
+                        elif self.stop_event.is_set():
+                            self.write_log(log_file, "UDP Transmission stopped by user.")
+                        else:
+                            self.write_log(log_file, "UDP Transmission did not complete.")
+                        return
+
+                if KERNEL_TIMESTAMPS:
                     try:
-                        message = bytes.fromhex(line)
-                        log_entry = f"Sending: {message}\n"
-                        self.log_signal.emit(log_entry.strip())
-                        log_file.write(log_entry)
-                        sock.sendto(message, self.server_address)
-                        time.sleep(1.0)
-                    except Exception as e:
-                        log_entry = f"Error sending command: {e}\n"
-                        self.log_signal.emit(log_entry.strip())
-                        log_file.write(log_entry)
-
-                log_entry = "UDP Transmission Completed.\n"
-                self.log_signal.emit(log_entry.strip())
-                log_file.write(log_entry)
+                        # Wire stamps go to the run log only; one per packet would flood the log pane
+                        sock = udp_kstamp.StampedSocket(sock, self.metrics, lambda text: log_file.write(text + "\n"),
+                                                        self.clock.offset if self.clock is not None else 0.0)
+                    except OSError as e:
+                        self.write_log(log_file, f"Kernel timestamps unavailable: {e}")
+                if self.pacer is not None:
+                    self.pacer.inbox = collections.deque(maxlen=4096)
+                receiver = udp_expect.Receiver(sock, self.pacer.inbox if self.pacer is not None else None)
+                loops = udp_plan.LoopRunner(self.metrics)
+                loops.on_done = lambda loop, iterations, seconds: self.write_log(
+                    log_file, f"Loop {loop}: {iterations} iterations in {seconds:.3f}s")
+                payloads = {}  # Loop bodies decode each hex line once
+                while True:
+                    pass_start = time.perf_counter()
+                    self.send_pass(plan, sock, log_file, scopeshot_folder, receiver, loops, payloads, resume_at)
+                    resume_at = None
+                    if not self.soak or self.stop_event.is_set():
+                        break
+                    self.passes += 1
+                    seconds = time.perf_counter() - pass_start
+                    self.metrics.record_iteration(udp_soak.PASS_LOOP, seconds)
+                    self.write_log(log_file, f"Soak pass {self.passes} finished in {seconds:.3f}s")
+                    if checkpoint.due():
+                        checkpoint.write(udp_soak.checkpoint_state(self.filename, self.passes, self.metrics, self.capture_window))
+                if self.soak:
+                    path = checkpoint.write(udp_soak.checkpoint_state(self.filename, self.passes, self.metrics, self.capture_window))
+                    self.write_log(log_file, f"Soak test stopped after {self.passes} passes; counters: {path}")
+                if not self.stop_event.is_set():
+                    self.journal.finish()  # Completed: nothing to resume
+                if self.pacer is not None:
+                    self.pacer.finish(sock)
+                    self.write_log(log_file, f"Adaptive pacing ended at {self.pacer.current_rate:.1f} pps "
+                                             f"({self.pacer.replies} replies, {self.pacer.losses} timeouts)")
+                if isinstance(sock, udp_kstamp.StampedSocket):
+                    sock.collect()
+                    self.write_log(log_file, sock.describe())
+                self.write_log(log_file, "UDP Transmission stopped by user." if self.stop_event.is_set() else "UDP Transmission Completed.")
 
         except Exception as e:
+            self.metrics.record_error("run")
             log_entry = f"UDP Error: {e}\n"
-            self.log_signal.emit(log_entry.strip())
+            self.emit_log(log_entry.strip())
             with open(log_filename, 'a') as log_file:
                 log_file.write(log_entry)
         finally:
             sock.close()
+            if self.journal is not None:
+                self.journal.close()  # Kept only if the run did not complete
+            self.metrics.finish()
+            if self.clock is not None:
+                self.clock.finish()
+                self.metrics.clock = self.clock.summary()
+            try:
+                self.metrics.write_summary(log_filename)
+            except OSError as e:
+                self.emit_log(f"Could not write run summary: {e}")
+            if self.stamper is not None:
+                try:
+                    report = (self.tx_summary or {}).get("sequence") or self.stamper.report()
+                    loss_path = udp_seq.write_report(report, log_filename.rsplit(".", 1)[0] + "_loss.json")
+                    self.emit_log(f"Sent sequence {report['first_seq']}..{report['last_seq']}; loss report: {loss_path}")
+                except OSError as e:
+                    self.emit_log(f"Could not write loss report: {e}")
+            if self.pacer is not None:
+                try:
+                    rate_summary = (self.tx_summary or {}).get("rate") or self.pacer.summary()
+                    rate_path = udp_rate.write_report(rate_summary, log_filename.rsplit(".", 1)[0] + "_rate.json")
+                    self.emit_log(f"Rate log: {rate_path}")
+                except OSError as e:
+                    self.emit_log(f"Could not write rate log: {e}")
+            if self.tracer.enabled:
+                try:
+                    self.emit_log(f"Trace saved: {self.tracer.save(log_filename)}")
+                    if self.tracer.dropped:
+                        self.emit_log(f"Trace kept the newest {len(self.tracer.events)} events; {self.tracer.dropped} older ones were dropped")
+                except OSError as e:
+                    self.emit_log(f"Could not write trace: {e}")
 
 class MainWindow(QWidget):
+    control_log = pyqtSignal(str)  # Log lines of control API runs, from the scheduler's threads
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("UDP Command Sender")
@@ -220,6 +574,23 @@ class MainWindow(QWidget):
         self.send_button.clicked.connect(self.send_selected_commands)
         button_layout.addWidget(self.send_button)
         
+        # Opt-in span tracing for the next run
+        self.profile_checkbox = QCheckBox("Profile Run")
+        button_layout.addWidget(self.profile_checkbox)
+        self.sequence_checkbox = QCheckBox("Sequence Numbers")
+        button_layout.addWidget(self.sequence_checkbox)
+        self.adaptive_checkbox = QCheckBox("Adaptive Pacing")
+        button_layout.addWidget(self.adaptive_checkbox)
+        self.isolated_checkbox = QCheckBox("Separate TX Process")
+        button_layout.addWidget(self.isolated_checkbox)
+        self.soak_checkbox = QCheckBox("Soak (Loop Until Stopped)")
+        button_layout.addWidget(self.soak_checkbox)
+
+        # Button to stop the running send (ends a soak run after the current command)
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.clicked.connect(self.stop_sending)
+        button_layout.addWidget(self.stop_button)
+        
         # Button to clear log
         self.clear_log_button = QPushButton("Clear Log")
         self.clear_log_button.clicked.connect(self.clear_log)
@@ -230,6 +601,7 @@ class MainWindow(QWidget):
         # Log Pane
         self.log_pane = QTextEdit()
         self.log_pane.setReadOnly(True)
+        self.log_pane.document().setMaximumBlockCount(LOG_PANE_MAX_LINES)
         tests_layout.addWidget(self.log_pane)
 
         # Results Tab
@@ -237,6 +609,7 @@ class MainWindow(QWidget):
         results_layout = QVBoxLayout()
         self.results_tab.setLayout(results_layout)
         self.tab_widget.addTab(self.results_tab, "Results")
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
 
         # Splitter for results sections
         self.results_splitter = QSplitter(Qt.Orientation.Horizontal)
@@ -285,72 +658,44 @@ class MainWindow(QWidget):
         self.oscilloscope_display.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         results_layout.addWidget(self.oscilloscope_display, 5)  # Increased stretch factor to maximize height
 
+        self.device_id_search.textChanged.connect(self.load_results_folders)
+        self.device_id_list.itemSelectionChanged.connect(self.display_results_files)
+        self.test_event_search.textChanged.connect(self.display_results_files)
+        self.test_event_list.itemSelectionChanged.connect(self.display_selected_result)
+        self.test_results_search.returnPressed.connect(self.search_result_text)
+
         # Load folders
         self.load_results_folders()
 
     def load_results_folders(self):
-        """Load result folders into the device ID list."""
+        """Load runs (live and archived) matching the search box into the device ID list."""
         self.device_id_list.clear()
         self.device_id_list.addItem("Device ID")  # Re-add header
-        folders = sorted(os.listdir(RESULTS_DIR))
-        for folder in folders:
-            folder_path = os.path.join(RESULTS_DIR, folder)
-            if os.path.isdir(folder_path):
-                self.device_id_list.addItem(folder)
+        for run in udp_retention.list_runs(RESULTS_DIR, self.device_id_search.text().strip()):
+            item = QListWidgetItem(run["key"] + (" (archived)" if run["archive"] else ""))
+            item.setData(Qt.ItemDataRole.UserRole, run)
+            self.device_id_list.addItem(item)
 
     def display_results_files(self):
-        """Display test events from the selected device ID."""
+        """Display test events from the selected run."""
         selected_item = self.device_id_list.currentItem()
-        if not selected_item or selected_item.text() == "Device ID":
-            self.test_event_list.clear()
-            return
-
-        folder_path = os.path.join(RESULTS_DIR, selected_item.text())
         self.test_event_list.clear()
-        self.test_event_list.addItem("Test Event")  # Header
-
-        files = sorted(os.listdir(folder_path))
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.txt')):
-                self.test_event_list.addItem(file)
-
-    def display_selected_result(self):
-        """Display the selected test result file."""
-        selected_folder = self.device_id_list.currentItem()
-        selected_file = self.test_event_list.currentItem()
-
-        if not selected_folder or not selected_file or selected_file.text() == "Test Event":
-            self.test_results_display.clear()
-            return
-
-        file_path = os.path.join(RESULTS_DIR, selected_folder.text(), selected_file.text())
-        if selected_file.text().lower().endswith(('.png', '.jpg', '.jpeg')):
-            pixmap = QPixmap(file_path)
-            self.test_results_display.clear()
-            self.test_results_display.append("[Image File]")
-        else:
-            with open(file_path, 'r') as f:
-                content = f.read()
-            self.test_results_display.setText(content)
-
-    def display_results_files(self):
-        """Display test events from the selected device ID."""
-        selected_item = self.device_id_list.currentItem()
         if not selected_item or selected_item.text() == "Device ID":
-            self.test_event_list.clear()
             return
 
-        folder_path = os.path.join(RESULTS_DIR, selected_item.text())
-        self.test_event_list.clear()
         self.test_event_list.addItem("Test Event")  # Header
-
-        files = sorted(os.listdir(folder_path))
+        search = self.test_event_search.text().strip().lower()
+        try:
+            files = udp_retention.run_files(selected_item.data(Qt.ItemDataRole.UserRole))
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            self.test_results_display.setText(f"Error reading run: {e}")
+            return
         for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.txt')):
+            if search in file.lower():
                 self.test_event_list.addItem(file)
 
     def display_selected_result(self):
-        """Display the selected test result file."""
+        """Display the selected test result file (from the results folder or an archive)."""
         selected_folder = self.device_id_list.currentItem()
         selected_file = self.test_event_list.currentItem()
 
@@ -358,15 +703,28 @@ class MainWindow(QWidget):
             self.test_results_display.clear()
             return
 
-        file_path = os.path.join(RESULTS_DIR, selected_folder.text(), selected_file.text())
+        run = selected_folder.data(Qt.ItemDataRole.UserRole)
+        try:
+            data = udp_retention.read_run_file(RESULTS_DIR, run, selected_file.text())
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            self.test_results_display.setText(f"Error reading file: {e}")
+            return
         if selected_file.text().lower().endswith(('.png', '.jpg', '.jpeg')):
-            pixmap = QPixmap(file_path)
+            pixmap = QPixmap()
+            pixmap.loadFromData(data)
+            self.oscilloscope_display.setPixmap(pixmap)
             self.test_results_display.clear()
             self.test_results_display.append("[Image File]")
         else:
-            with open(file_path, 'r') as f:
-                content = f.read()
-            self.test_results_display.setText(content)
+            self.test_results_display.setText(data.decode(errors="replace"))
+            self.search_result_text()
+
+    def search_result_text(self):
+        """Move to the first match of the results search box in the displayed file."""
+        text = self.test_results_search.text()
+        if text:
+            self.test_results_display.moveCursor(QTextCursor.MoveOperation.Start)
+            self.test_results_display.find(text)
 
     def get_scope_ip(self):
         """Retrieve the current oscilloscope IP from input field."""
@@ -427,6 +785,7 @@ class MainWindow(QWidget):
             for key, value in settings.items():
                 f.write(f"{key}={value}\n")
         
+        self.control_scope_ip = scope_ip
         QMessageBox.information(self, "Settings Saved", "Settings have been saved successfully.")
 
     def show_command_file_context_menu(self, position):
@@ -466,7 +825,7 @@ class MainWindow(QWidget):
             return
 
         folder_path = os.path.join(RESULTS_DIR, selected_folder.text())
-        image_path = os.path.join(folder_path, selected_image.text())
+        image_path = udp_blobs.resolve(RESULTS_DIR, folder_path, selected_image.text())
         
         menu = QMenu()
         open_folder_action = menu.addAction("Open File Location")
@@ -499,7 +858,8 @@ class MainWindow(QWidget):
 
         for folder in folders:
             folder_path = os.path.join(RESULTS_DIR, folder)
-            if os.path.isdir(folder_path):
+            # Only run folders: not the retention archive or other tool folders
+            if os.path.isdir(folder_path) and udp_retention.run_key(folder) == folder:
                 self.scopeshot_folder_list.addItem(folder)
 
     def display_scopeshot_images(self):
@@ -514,7 +874,7 @@ class MainWindow(QWidget):
         folder_path = os.path.join(RESULTS_DIR, selected_item.text())
         self.scopeshot_image_list.clear()
         
-        images = [file for file in sorted(os.listdir(folder_path)) if file.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        images = udp_blobs.list_captures(folder_path)
 
         # If there are no images, add a placeholder message
         if not images:
@@ -534,23 +894,31 @@ class MainWindow(QWidget):
             self.scopeshot_display.clear()
             return
 
-        image_path = os.path.join(RESULTS_DIR, selected_folder.text(), selected_image.text())
+        image_path = udp_blobs.resolve(RESULTS_DIR, os.path.join(RESULTS_DIR, selected_folder.text()), selected_image.text())
         pixmap = QPixmap(image_path)
         self.scopeshot_display.setPixmap(pixmap)
 
     def on_tab_changed(self, index):
-        """Reload log files and scopeshots when their respective tabs are selected."""
-        if self.tab_widget.tabText(index) == "Log Files":
+        """Reload results, log files and scopeshots when their respective tabs are selected."""
+        if self.tab_widget.tabText(index) == "Results":
+            self.load_results_folders()
+        elif self.tab_widget.tabText(index) == "Log Files":
             self.load_log_files()
         elif self.tab_widget.tabText(index) == "Scopeshots":
             self.load_scopeshot_folders()
 
     def load_files(self):
-        """Load command files into the file list."""
+        """Load command files into the file list, marking files that fail the linter."""
         self.file_list.clear()
-        for file in os.listdir(UDP_COMMANDS_DIR):
-            if file.endswith(".txt"):
-                self.file_list.addItem(file)
+        files = [file for file in os.listdir(UDP_COMMANDS_DIR) if file.endswith(".txt")]
+        lint = udp_lint.lint_folder(UDP_COMMANDS_DIR, files)
+        for file in files:
+            item = QListWidgetItem(file)
+            problems = lint.get(file)
+            if problems:
+                item.setForeground(QColor("red"))
+                item.setToolTip("\n".join(problems))
+            self.file_list.addItem(item)
 
     def load_log_files(self):
         """Load log files into the log file list."""
@@ -594,21 +962,101 @@ class MainWindow(QWidget):
             QMessageBox.warning(self, "Warning", "No file selected!")
             return
         filename = os.path.join(UDP_COMMANDS_DIR, selected_item.text())
+        problems = udp_lint.lint_file(filename, UDP_COMMANDS_DIR)
+        if problems:
+            self.load_files()  # Refresh the markers; the file may have changed since the list was built
+            shown = problems[:20] + ([f"... and {len(problems) - 20} more"] if len(problems) > 20 else [])
+            QMessageBox.warning(self, "Command File Rejected", "Nothing was sent:\n" + "\n".join(shown))
+            return
+        resume = None
+        for record in udp_journal.find_interrupted(RESULTS_DIR, filename):
+            answer = QMessageBox.question(
+                self, "Resume Interrupted Run",
+                f"{udp_journal.describe(record)}.\n\nResume it? (No starts a new run and discards the interrupted one.)",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel)
+            if answer == QMessageBox.StandardButton.Cancel:
+                return
+            if answer == QMessageBox.StandardButton.Yes:
+                resume = record
+                break
+            udp_journal.discard(record)
         server_address = self.get_udp_address()
         scope_ip = self.get_scope_ip()  # Get scope IP from user input
 
-        self.log_pane.append(f"Sending commands from {filename}")
-        self.udp_thread = UdpSenderThread(filename, server_address, scope_ip)  # Pass scope IP
-        self.udp_thread.log_signal.connect(self.log_pane.append)
+        self.log_pane.append(f"{'Resuming' if resume else 'Sending'} commands from {filename}")
+        self.udp_thread = UdpSenderThread(filename, server_address, scope_ip, self.profile_checkbox.isChecked(),
+                                          self.sequence_checkbox.isChecked(), self.adaptive_checkbox.isChecked(),
+                                          self.isolated_checkbox.isChecked(), self.soak_checkbox.isChecked(), resume)  # Pass scope IP
+        self.udp_thread.log_signal.connect(self.append_run_log)
         self.udp_thread.start()
+
+    def stop_sending(self):
+        """Ask the running sender thread to stop after the current command."""
+        thread = getattr(self, "udp_thread", None)
+        if thread is not None and thread.isRunning():
+            thread.stop_event.set()
+            self.log_pane.append("Stopping...")
+
+    def append_run_log(self, sender, text):
+        """Show a log line from a sender thread and release its queue slot.
+
+        The thread comes with the signal rather than from self.sender():
+        queued jobs run on the scheduler's thread and their UdpSenderThread
+        may be gone by the time the line is delivered here.
+        """
+        with sender.tracer.span("log.display", "log"):
+            self.log_pane.append(text)
+        sender.log_shown()
     
     def clear_log(self):
         """Clear the log pane."""
         self.log_pane.clear()
 
+    def start_control_server(self, port):
+        """Accept runs from the local control API; they are queued and sent one at a time.
+
+        Only jobs submitted through this API run here; batches queued with
+        udp_queue.py stay for its own runner.
+        """
+        udp_ip, udp_port = self.get_udp_address()
+        self.control_scope_ip = self.get_scope_ip()  # Read here: worker threads must not touch widgets
+        self.control_log.connect(self.log_pane.append)
+        self.job_queue = udp_queue.JobQueue(udp_queue.QUEUE_DB, origin="gui")
+        self.control, self.scheduler = udp_control.start_control(
+            self.job_queue, self.run_queued_job, {"targets": [f"{udp_ip}:{udp_port}"], "delay": 1.0}, port,
+            max_workers=1, log=self.control_log.emit)
+        if self.control is not None:
+            self.log_pane.append(f"Control API listening on http://127.0.0.1:{self.control.port}/rpc")
+
+    def run_queued_job(self, filename, udp_ip, udp_port, delay, pacing=None, clock=None, start_at=None, log=None, job=None):
+        """Send one queued job on the scheduler's thread; returns True if it ran without errors.
+
+        Runs use the window's fixed 1 s pacing unless the job asks for adaptive pacing.
+        Jobs with a clock wait for the common start_at (see udp_clock.py).
+        log receives the run's log lines (the control API's event stream).
+        """
+        synced = udp_clock.SyncedClock(clock) if clock is not None else None  # ClockError fails the job
+        thread = UdpSenderThread(filename, (udp_ip, udp_port), self.control_scope_ip, adaptive=pacing == "adaptive",
+                                 clock=synced, start_at=start_at, job=job)
+        thread.log_signal.connect(self.append_run_log)  # Queued: each pending line holds a reference to thread
+        if log is not None:
+            thread.log_signal.connect(lambda sender, text: log(text))
+        thread.run()
+        return not thread.metrics.errors and not thread.metrics.cancelled
+
 
 if __name__ == "__main__":
+    if METRICS_PORT:
+        udp_metrics.start_metrics_server(METRICS_PORT)
+    if RETENTION_POLICY:
+        # Archive old runs in the background so startup stays fast
+        threading.Thread(target=udp_retention.apply_retention, args=(RESULTS_DIR, RETENTION_POLICY), daemon=True).start()
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec())
+    if CONTROL_PORT:
+        window.start_control_server(CONTROL_PORT)
+    status = app.exec()
+    if CONTROL_PORT:
+        window.scheduler.stop(wait=False)  # Jobs still running are requeued once this process has exited
+    sys.exit(status)
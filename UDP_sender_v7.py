@@ -1,22 +1,48 @@
 import os
 import socket
+import collections
+import functools
 import json
 import time
+import threading
+from datetime import datetime
+import udp_capture
+import udp_checksum
+import udp_clock
+import udp_expect
+import udp_journal
+import udp_kstamp
+import udp_lint
+import udp_metrics
+import udp_plan
+import udp_queue
+import udp_rate
+import udp_retention
+import udp_seq
+import udp_soak
+import udp_suite
+import udp_template
+import udp_trace
 
 # Author: Nolan Manteufel
 
 CONFIG_FILE = "udp_config.json"
 COMMANDS_FOLDER = "commands"
+RESULTS_DIR = "results"
 DEFAULT_DELAY = 2  # Default delay in seconds
 
+_run_names = set()  # Run log names handed out by this process
+_run_names_lock = threading.Lock()
+
 def clear_screen():
     print(ascii_header)
     """Clear the terminal screen for a cleaner UI."""
     os.system('cls' if os.name == 'nt' else 'clear')
 
 def save_config(udp_ip, udp_port):
-    """Save UDP configuration to a JSON file."""
-    config = {"udp_ip": udp_ip, "udp_port": udp_port}
+    """Save UDP configuration to a JSON file, keeping any other saved settings."""
+    config = load_config() or {}
+    config.update({"udp_ip": udp_ip, "udp_port": udp_port})
     with open(CONFIG_FILE, "w") as file:
         json.dump(config, file)
 
@@ -39,6 +65,89 @@ def load_delay():
     config = load_config()
     return config.get("delay", DEFAULT_DELAY) if config else DEFAULT_DELAY
 
+def save_profile(enabled):
+    """Save the profiling setting to the config file."""
+    config = load_config() or {}
+    config["profile"] = enabled
+    with open(CONFIG_FILE, "w") as file:
+        json.dump(config, file)
+
+def load_profile():
+    """Return True if runs should record a span trace and sampling profile."""
+    config = load_config()
+    return bool(config.get("profile", False)) if config else False
+
+def load_sequence_mode():
+    """Return "header" or "trailer" if datagrams should carry sequence stamps, else None."""
+    config = load_config() or {}
+    mode = config.get("sequence")
+    return mode if mode in udp_seq.POSITIONS else None
+
+def new_run_stamper():
+    """Return a sequence stamper for the next run, or None when stamping is off."""
+    mode = load_sequence_mode()
+    return udp_seq.SequenceStamper(mode) if mode else None
+
+def load_pacing():
+    """Return the adaptive pacing settings from the config file, or None for a fixed delay."""
+    config = load_config() or {}
+    pacing = config.get("pacing")
+    if pacing == "adaptive":
+        return {}
+    if isinstance(pacing, dict) and pacing.get("mode") == "adaptive":
+        return pacing
+    return None
+
+def save_pacing(adaptive):
+    """Switch between fixed and adaptive pacing, keeping any saved adaptive settings."""
+    config = load_config() or {}
+    pacing = config.get("pacing")
+    settings = dict(pacing) if isinstance(pacing, dict) else {}
+    settings["mode"] = "adaptive" if adaptive else "fixed"
+    config["pacing"] = settings
+    with open(CONFIG_FILE, "w") as file:
+        json.dump(config, file)
+
+def new_run_pacer(delay, pacing=None):
+    """Return an AIMD pacer for the next run (never slower than delay), or None for fixed pacing.
+
+    pacing overrides the saved setting: "fixed", "adaptive" or a dict of adaptive settings.
+    """
+    if pacing is None:
+        settings = load_pacing()
+    elif pacing == "fixed":
+        settings = None
+    else:
+        settings = {} if pacing == "adaptive" else pacing
+    if settings is None:
+        return None
+    def report(elapsed, rate, reason):
+        print(f"Rate: {rate:.1f} pps at {elapsed:.3f}s ({reason})")
+    return udp_rate.pacer_from_config(settings, delay, on_change=report)
+
+def load_targets(udp_ip, udp_port):
+    """Load the list of suite targets from the config file, defaulting to the main target."""
+    config = load_config() or {}
+    targets = config.get("targets") or [[udp_ip, udp_port]]
+    return [udp_suite.parse_target(target, udp_port) for target in targets]
+
+def save_kernel_timestamps(enabled):
+    """Save the kernel timestamping setting to the config file."""
+    config = load_config() or {}
+    config["kernel_timestamps"] = enabled
+    with open(CONFIG_FILE, "w") as file:
+        json.dump(config, file)
+
+def load_kernel_timestamps():
+    """Return True if runs should record kernel send/receive timestamps (Linux)."""
+    config = load_config() or {}
+    return bool(config.get("kernel_timestamps", False))
+
+def load_max_workers():
+    """Load the suite worker pool size from the config file."""
+    config = load_config() or {}
+    return int(config.get("max_workers", udp_suite.DEFAULT_MAX_WORKERS))
+
 def list_files():
     """List all files in the commands directory."""
     try:
@@ -50,59 +159,461 @@ def list_files():
         print("Commands directory not found.")
         return []
 
-def send_udp_command(file_path, udp_ip, udp_port, delay):
-    
+def send_plan(plan, udp_ip, udp_port, delay, metrics=None, tracer=udp_trace.NULL_TRACER, stamper=None, pacer=None,
+              journal=None, resume=None, clock=None, log_file=None, kernel_stamps=False, log=None, passes=0):
+    """Send the commands of a resolved plan as UDP packets with adjustable delay (or adaptive pacing).
+
+    A command directly followed by #EXPECT or #WAIT_QUIET skips its delay;
+    the wait takes its place. With a journal, the position of every command
+    is recorded before it is sent (with passes, the soak passes completed);
+    resume starts at such a position. With a log_file, every message also goes there, stamped with the clock's
+    reference time. kernel_stamps records kernel send/receive times there
+    and in the metrics. log, if given, is called with every message too.
+
+    Lines go out as ASCII text, as written; templates likewise as hex text,
+    and checksums cover that text. Replays resend captured datagrams as
+    they were recorded.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if kernel_stamps:
+        try:
+            sock = udp_kstamp.StampedSocket(sock, metrics, (lambda text: log_file.write(text + "\n")) if log_file else None,
+                                            clock.offset if clock is not None else 0.0)
+        except OSError as e:
+            print(f"Kernel timestamps unavailable: {e}")
+    if pacer is not None:
+        pacer.inbox = collections.deque(maxlen=4096)
+    receiver = udp_expect.Receiver(sock, pacer.inbox if pacer is not None else None)
+    loops = udp_plan.LoopRunner(metrics)
+    now = clock.now if clock is not None else time.time
+    payloads = {}  # Lines with checksums are filled once
+
+    def say(text):
+        if log_file is not None:
+            log_file.write(f"{now():.6f} {text}\n")
+        tell(text, log)
+
+    loops.on_done = lambda loop, iterations, seconds: say(f"Loop {loop}: {iterations} iterations in {seconds:.3f}s")
+
+    def sleep_until(due):
+        with tracer.span("pace.sleep", "pace"):
+            time.sleep(max(0.0, due - time.perf_counter()))  # Dynamic delay
+        if metrics is not None:
+            metrics.record_pacing(time.perf_counter() - due)
+
+    due = None  # End of the delay after the last command, slept before the next op
+    try:
+        for op, arg, source, line_no in loops.iterate(plan["ops"], resume):
+            if journal is not None:
+                journal.record(loops.position(), packets=metrics.packets if metrics is not None else 0, passes=passes)
+            if due is not None and op not in udp_plan.WAIT_OPS:
+                sleep_until(due)
+            due = None
+            if op in udp_plan.WAIT_OPS:
+                with tracer.span(op, "wait"):
+                    if op == "expect":
+                        result = receiver.expect(arg["pattern"], arg["timeout"])
+                        passed = result[0] is not None
+                    else:
+                        result = receiver.wait_quiet(arg["quiet"], arg["timeout"])
+                        passed = result[0]
+                if metrics is not None:
+                    metrics.record_expect(passed)
+                if not passed:
+                    loops.expectation_failed()
+                say(udp_expect.describe(op, arg, result))
+                continue
+            if op == "template":
+                say(f"Sending template: {arg.count} packets of {arg.length} bytes")
+                sent = udp_template.send_template(sock, (udp_ip, udp_port), arg, delay, metrics=metrics, tracer=tracer, stamper=stamper, pacer=pacer,
+                                                  text=True)
+                say(f"Sent {sent} templated packets")
+                continue
+            if op == "replay":
+                with tracer.span("replay", "send"):
+                    send_capture(sock, arg["path"], udp_ip, udp_port, arg["speed"], metrics)
+                continue
+            if op != "send":
+                continue
+            payload = payloads.get(arg)
+            if payload is None:
+                payload = payloads[arg] = udp_checksum.encode_line(arg, text=True)
+            line = payload.decode() if "{" in arg else arg
+            if stamper is not None:
+                payload = stamper.stamp(payload)
+            sent_at = time.perf_counter()
+            with tracer.span("send", "send", size=len(payload)):
+                sock.sendto(payload, (udp_ip, udp_port))
+            if metrics is not None:
+                metrics.record_send(len(payload), time.perf_counter() - sent_at)
+            with tracer.span("log.print", "log"):
+                say(f"Sent: {line}")
+            if pacer is not None:
+                with tracer.span("pace.adaptive", "pace"):
+                    pacer.after_send(sock, sent_at)
+                continue
+            due = sent_at + delay
+        if due is not None:
+            sleep_until(due)
+        if pacer is not None:
+            pacer.finish(sock)
+        if isinstance(sock, udp_kstamp.StampedSocket):
+            sock.collect()
+            tell(sock.describe(), log)
+    finally:
+        sock.close()
+
+def new_run_metrics(file_path, job=None):
+    """Start telemetry for a run of file_path (of queue job id job, if any).
+
+    Runs of one script started in the same millisecond (parallel queue
+    jobs) are moved apart by a millisecond so their results do not collide.
+    """
+    metrics = udp_metrics.RunMetrics(os.path.basename(file_path), job)
+    with _run_names_lock:
+        while run_log_name(metrics, file_path) in _run_names:
+            metrics.started += 0.001
+        _run_names.add(run_log_name(metrics, file_path))
+    return metrics
+
+def resume_run_metrics(metrics, file_path, resume):
+    """Continue an interrupted run's telemetry: its start (so reports keep the run's key) and packet count."""
+    stamp = os.path.basename(resume["log"])[:len("yyyymmdd_hhmmss_zzz")]
+    with _run_names_lock:
+        _run_names.discard(run_log_name(metrics, file_path))
+        metrics.started = datetime.strptime(stamp, "%Y%m%d_%H%M%S_%f").timestamp()
+        _run_names.add(run_log_name(metrics, file_path))
+    metrics.packets = resume.get("packets", 0)
+
+def new_run_tracer():
+    """Return a span tracer for the next run, or the no-op tracer when profiling is off."""
+    if not load_profile():
+        return udp_trace.NULL_TRACER
+    tracer = udp_trace.Tracer(sample_interval=udp_trace.DEFAULT_SAMPLE_INTERVAL)
+    tracer.start_sampling()
+    return tracer
+
+def run_log_name(metrics, file_path):
+    """Return the results path a run's reports are named after."""
+    timestamp = datetime.fromtimestamp(metrics.started).strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(RESULTS_DIR, f"{timestamp}_{name}.txt")
+
+def ask_resume(file_path):
+    """Offer to continue an interrupted run of file_path; return its journal record or None."""
+    for record in udp_journal.find_interrupted(RESULTS_DIR, file_path):
+        if input(f"{udp_journal.describe(record)}. Resume it? (Y/N): ").strip().lower() == 'y':
+            return record
+        udp_journal.discard(record)
+    return None
+
+def open_journal(file_path, plan, metrics, resume=None):
+    """Return (journal, position to start at) for a run, continuing resume if the command files are unchanged."""
+    fingerprint = udp_journal.plan_fingerprint(plan)
+    if resume is not None:
+        if resume.get("fingerprint") == fingerprint:
+            print(f"Resuming: {udp_journal.describe(resume)}")
+            resume_run_metrics(metrics, file_path, resume)
+            return udp_journal.resume_journal(resume), resume["pos"]
+        print("Command files changed since the interrupted run; starting from the beginning")
+        udp_journal.discard(resume)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    log_name = run_log_name(metrics, file_path)
+    # The CLI does not capture, but a GUI resume of this run captures into the same folder
+    header = {"script": file_path, "fingerprint": fingerprint, "log": log_name, "scopeshots": udp_journal.scopeshot_folder(log_name)}
+    return udp_journal.RunJournal(udp_journal.journal_path(log_name), header), None
+
+def open_run_log(metrics, file_path, clock):
+    """Return the run log of a synchronized or kernel-timestamped run, or None (other runs only print)."""
+    if clock is None and not load_kernel_timestamps():
+        return None
+    return open(run_log_name(metrics, file_path), "a")
+
+def start_synchronized(clock, start_at, log_file):
+    """Wait for the common start of a synchronized run."""
+    print(f"Synchronized start: {clock.describe()}; waiting {start_at - clock.now():.3f}s")
+    lateness = clock.wait_until(start_at)
+    log_file.write(f"{clock.stamp()} Synchronized start ({clock.describe()}, {lateness * 1e6:.1f} us after the deadline)\n")
+
+def finish_synchronized(clock, metrics):
+    """Record the clock details (with the end-of-run offset) in a synchronized run's summary."""
+    clock.finish()
+    metrics.clock = clock.summary()
+
+def write_run_summary(metrics, file_path, tracer=udp_trace.NULL_TRACER, stamper=None, pacer=None):
+    """Write a run's telemetry summary (plus trace, loss and rate reports when enabled) into the results folder."""
+    tracer.stop_sampling()  # Even when the reports cannot be written
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    log_name = run_log_name(metrics, file_path)
+    try:
+        summary_path = metrics.write_summary(log_name)
+        print(f"Run summary: {summary_path}")
+        if tracer.enabled:
+            print(f"Trace saved: {tracer.save(log_name)}")
+            if tracer.dropped:
+                print(f"Trace kept the newest {len(tracer.events)} events; {tracer.dropped} older ones were dropped")
+        if stamper is not None:
+            loss_path = udp_seq.write_report(stamper.report(), log_name.rsplit(".", 1)[0] + "_loss.json")
+            print(f"Sent sequence {stamper.first}..{stamper.next - 1}; loss report: {loss_path}")
+        if pacer is not None:
+            rate_path = udp_rate.write_report(pacer.summary(), log_name.rsplit(".", 1)[0] + "_rate.json")
+            print(f"Adaptive pacing ended at {pacer.current_rate:.1f} pps ({pacer.losses} timeouts); rate log: {rate_path}")
+    except OSError as e:
+        print(f"Could not write run summary: {e}")
+
+def send_capture(sock, capture_path, udp_ip, udp_port, speed, metrics=None):
+    """Replay a recorded capture with its original timing scaled by speed (None = as fast as possible)."""
+    pace = "as fast as possible" if speed is None else f"at {speed:g}x speed"
+    print(f"Replaying {capture_path} {pace}")
+    sent = udp_capture.replay_capture(capture_path, sock, (udp_ip, udp_port), speed, metrics=metrics)
+    print(f"Replayed {sent} packets")
+
+def replay_file(udp_ip, udp_port):
+    """Ask for a capture file and a replay speed, then replay it to the target."""
     print(ascii_header)
-    """Send the contents of a selected file as UDP packets with adjustable delay."""
+    capture_path = input("Enter capture file (.pcap): ").strip()
     try:
-        with open(file_path, 'r') as file:
-            lines = [line.strip() for line in file.readlines() if not line.strip().startswith('#')]
-        
+        speed = udp_capture.parse_speed(input("Replay speed (1, 2x, 10x, FAST) [1]: ").strip() or "1")
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        
-        for line in lines:
-            if line:
-                sock.sendto(line.encode(), (udp_ip, udp_port))
-                print(f"Sent: {line}")
-                time.sleep(delay)  # Dynamic delay
-        
-        print(f"Finished sending data from {file_path} to {udp_ip}:{udp_port}")
-        sock.close()
+        try:
+            send_capture(sock, capture_path, udp_ip, udp_port, speed)
+        finally:
+            sock.close()
     except Exception as e:
-        print(f"Error sending UDP data: {e}")
+        print(f"Error replaying capture: {e}")
+
+def lint_rejects(file_path):
+    """Print lint problems for a command file; return True if it must not be sent."""
+    problems = udp_lint.lint_file(file_path, COMMANDS_FOLDER)
+    for problem in problems:
+        print(f"Error: {problem}")
+    if problems:
+        print("Nothing was sent.")
+    return bool(problems)
+
+def lint_all():
+    """Check every command file and print the problems found."""
+    print(ascii_header)
+    results = udp_lint.lint_folder(COMMANDS_FOLDER, list_files())
+    for problems in results.values():
+        for problem in problems:
+            print(problem)
+    failed = sum(1 for problems in results.values() if problems)
+    print(f"{len(results)} files checked, {failed} with problems")
+
+def tell(text, log=None):
+    """Print a run message, also passing it to log (a queued job's log, see udp_queue.Scheduler)."""
+    print(text)
+    if log is not None:
+        log(text)
+
+def report_plan_error(error, metrics, log=None):
+    """Print the problems of a plan that could not be (fully) sent."""
+    metrics.record_error("plan")
+    for problem in error.problems:
+        tell(f"Error: {problem}", log)
+    if metrics.packets:
+        tell(f"Stopped after {metrics.packets} packets.", log)  # A streamed script failed part way
+    else:
+        tell("Nothing was sent.", log)
+
+def send_udp_command(file_path, udp_ip, udp_port, delay, interactive=True, pacing=None, clock=None, start_at=None, log=None, job=None):
+    
+    print(ascii_header)
+    """Send the contents of a selected file as UDP packets with adjustable delay; returns True if it completed."""
+    if lint_rejects(file_path):
+        return False
+    ok = False
+    resume = ask_resume(file_path) if interactive else None  # Suite workers must not prompt
+    metrics = new_run_metrics(file_path, job)
+    tracer = new_run_tracer()
+    stamper = new_run_stamper()
+    pacer = new_run_pacer(delay, pacing)
+    journal = log_file = None
+    try:
+        with tracer.span("plan.load", "parse"):
+            plan = udp_plan.open_plan(file_path, COMMANDS_FOLDER)
+        journal, position = open_journal(file_path, plan, metrics, resume)
+        log_file = open_run_log(metrics, file_path, clock)
+        if clock is not None:
+            start_synchronized(clock, start_at, log_file)
+        send_plan(plan, udp_ip, udp_port, delay, metrics, tracer, stamper, pacer, journal, position, clock, log_file,
+                  load_kernel_timestamps(), log)
+        journal.finish()
+        ok = True
+        tell(f"Finished sending data from {file_path} to {udp_ip}:{udp_port}", log)
+    except udp_plan.PlanError as e:
+        report_plan_error(e, metrics, log)
+    except Exception as e:
+        metrics.record_error("send")
+        tell(f"Error sending UDP data: {e}", log)
+    finally:
+        if journal is not None:
+            journal.close()  # Kept only if the run did not complete
+        if clock is not None:
+            finish_synchronized(clock, metrics)
+        if log_file is not None:
+            log_file.close()
+        write_run_summary(metrics, file_path, tracer, stamper, pacer)  # Stops the sampling profiler on every exit path
+    return ok
 
 def send_all_files(udp_ip, udp_port, delay):
     
     print(ascii_header)
-    """Send all command files in the folder sequentially."""
+    """Send all command files in the folder, running independent files in parallel per target."""
     files = list_files()
     if not files:
         print("No command files found.")
         return
     
-    for file in files:
-        file_path = os.path.join(COMMANDS_FOLDER, file)
-        print(f"Sending file: {file}")
-        send_udp_command(file_path, udp_ip, udp_port, delay)
+    targets = load_targets(udp_ip, udp_port)
+    report = udp_suite.run_suite(files, targets, delay, functools.partial(send_udp_command, interactive=False), load_max_workers(), COMMANDS_FOLDER)
+    for job in report["jobs"]:
+        for entry in job["files"]:
+            print(f"{job['target']}  {job['job']} -> {entry['file']}: {entry['status']} in {entry['duration']:.3f}s")
+    print(f"Suite finished in {report['wall_time']:.3f}s (serial {report['serial_time']:.3f}s)")
+    print(f"Timing report: {report['report_path']}")
 
-def send_cmd_list(file_path, udp_ip, udp_port, delay):
+def send_cmd_list(file_path, udp_ip, udp_port, delay, interactive=True, pacing=None, clock=None, start_at=None, log=None, job=None):
     print(f"Processing CMD file: {file_path}")
     
     print(ascii_header)
-    """Process a CMD_* file and execute the listed command files."""
+    """Process a CMD_* file, expanding nested lists into one plan before sending anything; returns True if it completed."""
+    if lint_rejects(file_path):
+        return False
+    resume = ask_resume(file_path) if interactive else None
+    metrics = new_run_metrics(file_path, job)
+    tracer = new_run_tracer()
+    stamper = new_run_stamper()
+    pacer = new_run_pacer(delay, pacing)
+    ok = False
+    journal = log_file = None
     try:
-        with open(file_path, 'r') as file:
-            command_files = [line.strip() for line in file.readlines() if line.strip()]
-        
-        for cmd_file in command_files:
-            cmd_path = os.path.join(COMMANDS_FOLDER, cmd_file)
-            if os.path.exists(cmd_path):
-                print(f"Executing commands from {cmd_file}...")
-                send_udp_command(cmd_path, udp_ip, udp_port, delay)
-            else:
-                print(f"Warning: Command file {cmd_file} not found.")
+        with tracer.span("plan.load", "parse"):
+            plan = udp_plan.open_plan(file_path, COMMANDS_FOLDER)
+        included = [os.path.basename(path) for path in plan["deps"]]
+        if plan.get("streaming"):
+            print(f"Streaming {plan['bytes'] / 1e6:.1f} MB of commands from {len(included)} files: {', '.join(included)}")
+        else:
+            print(f"Resolved {len(plan['ops'])} commands from {len(included)} files: {', '.join(included)}")
+        journal, position = open_journal(file_path, plan, metrics, resume)
+        log_file = open_run_log(metrics, file_path, clock)
+        if clock is not None:
+            start_synchronized(clock, start_at, log_file)
+        send_plan(plan, udp_ip, udp_port, delay, metrics, tracer, stamper, pacer, journal, position, clock, log_file,
+                  load_kernel_timestamps(), log)
+        journal.finish()
+        ok = True
+        tell(f"Finished sending data from {file_path} to {udp_ip}:{udp_port}", log)
+    except udp_plan.PlanError as e:
+        report_plan_error(e, metrics, log)
     except Exception as e:
-        print(f"Error processing CMD file: {e}")
+        metrics.record_error("send")
+        tell(f"Error processing CMD file: {e}", log)
+    finally:
+        if journal is not None:
+            journal.close()  # Kept only if the run did not complete
+        if clock is not None:
+            finish_synchronized(clock, metrics)
+        if log_file is not None:
+            log_file.close()
+        write_run_summary(metrics, file_path, tracer, stamper, pacer)  # Stops the sampling profiler on every exit path
+    return ok
+
+def send_queued_job(file_path, udp_ip, udp_port, delay, pacing=None, clock=None, start_at=None, log=None, job=None):
+    """Run one job of the persistent queue without prompting; returns True if it completed.
+
+    With clock ("host:port" of a reference clock) and start_at (reference
+    time), the run waits for that common start and logs in reference time.
+    log receives the run's log lines (the control API's event stream); the
+    job id is recorded in the run summary.
+    """
+    if clock is not None:
+        clock = udp_clock.SyncedClock(clock)  # ClockError fails the job
+    send = send_cmd_list if os.path.basename(file_path).startswith("CMD_") else send_udp_command
+    return send(file_path, udp_ip, udp_port, delay, interactive=False, pacing=pacing, clock=clock, start_at=start_at, log=log, job=job)
+
+def job_queue_menu(udp_ip, udp_port, delay):
+    """Show the persistent job queue; optionally queue every command file and drain the queue."""
+    print(ascii_header)
+    queue = udp_queue.JobQueue(udp_queue.QUEUE_DB)
+    try:
+        for job in queue.jobs(("queued", "running", "failed")):
+            print(udp_queue.format_job(job))
+        print(udp_queue.format_stats(queue.stats()))
+        if input("Queue every command file on each target? (Y/N): ").strip().lower() == 'y':
+            jobs, problems = udp_suite.build_jobs(list_files(), COMMANDS_FOLDER)
+            for problem in problems:
+                print(f"Skipping broken CMD_ list: {problem}")
+            for ip, port in load_targets(udp_ip, udp_port):
+                for job in jobs:
+                    queue.submit(os.path.join(COMMANDS_FOLDER, job["name"]), f"{ip}:{port}", delay)
+            print(f"Queued {len(jobs)} scripts")
+        if input("Run the queue now? (Y/N, Ctrl+C stops): ").strip().lower() == 'y':
+            config = load_config() or {}
+            stats = udp_queue.run_until_drained(queue, send_queued_job, config.get("queue_limits"), load_max_workers())
+            print(udp_queue.format_stats(stats))
+    finally:
+        queue.close()
+
+def soak_file(file_path, udp_ip, udp_port, delay):
+    """Send a command file (or CMD_ list) over and over until Ctrl+C.
+
+    Like a GUI soak run, it logs to a rotating run log, journals its
+    position (so a stopped soak can be continued) and checkpoints its
+    counters.
+    """
+    print(ascii_header)
+    if lint_rejects(file_path):
+        return
+    policy = udp_soak.soak_policy((load_config() or {}).get("soak"))
+    resume = ask_resume(file_path)
+    metrics = new_run_metrics(file_path)
+    stamper = new_run_stamper()
+    pacer = new_run_pacer(delay)
+    checkpoint = None
+    journal = log_file = None
+    passes = 0
+    try:
+        plan = udp_plan.open_plan(file_path, COMMANDS_FOLDER)
+        journal, resume_at = open_journal(file_path, plan, metrics, resume)
+        if resume_at is not None:
+            passes = resume.get("passes", 0)
+        log_name = journal.header["log"]  # The interrupted run's log when resuming
+        log_file = udp_soak.RotatingLog(log_name, policy["max_log_bytes"], policy["rotate_seconds"], policy["keep_logs"],
+                                        append=resume_at is not None)
+        checkpoint = udp_soak.Checkpoint(log_name.rsplit(".", 1)[0] + "_soak.json", policy["checkpoint_seconds"])
+        print(f"Soak test running (log: {log_name}); press Ctrl+C to stop.")
+        while True:
+            start = time.perf_counter()
+            send_plan(plan, udp_ip, udp_port, delay, metrics, stamper=stamper, pacer=pacer, journal=journal, resume=resume_at,
+                      log_file=log_file, kernel_stamps=load_kernel_timestamps(), passes=passes)
+            resume_at = None
+            passes += 1
+            seconds = time.perf_counter() - start
+            metrics.record_iteration(udp_soak.PASS_LOOP, seconds)
+            log_file.write(f"{time.time():.6f} Soak pass {passes} finished in {seconds:.3f}s\n")
+            if checkpoint.due():
+                checkpoint.write(udp_soak.checkpoint_state(file_path, passes, metrics))
+            plan = udp_plan.open_plan(file_path, COMMANDS_FOLDER)  # Cached; edits take effect on the next pass
+    except KeyboardInterrupt:
+        print(f"Soak test stopped after {passes} passes.")
+    except udp_plan.PlanError as e:
+        report_plan_error(e, metrics)
+    except Exception as e:
+        metrics.record_error("send")
+        print(f"Error sending UDP data: {e}")
+    finally:
+        if journal is not None:
+            journal.close()  # Kept: a later soak of the file can continue from here
+        if log_file is not None:
+            log_file.close()
+    if checkpoint is not None:
+        try:
+            print(f"Soak counters: {checkpoint.write(udp_soak.checkpoint_state(file_path, passes, metrics))}")
+        except OSError as e:
+            print(f"Could not write soak counters: {e}")
+    write_run_summary(metrics, file_path, stamper=stamper, pacer=pacer)
 
 def main():
     global ascii_header
@@ -114,6 +625,14 @@ def main():
     
     config = load_config()
     delay = load_delay()
+    metrics_port = (config or {}).get("metrics_port", udp_metrics.DEFAULT_METRICS_PORT)
+    if metrics_port:
+        udp_metrics.start_metrics_server(int(metrics_port))
+    retention = (config or {}).get("retention")
+    if retention:
+        summary = udp_retention.apply_retention(RESULTS_DIR, retention)
+        if summary["archived"]:
+            print(f"Archived {summary['archived']} old runs ({summary['bytes_freed'] / 1e6:.1f} MB freed)")
     
     if config:
         print(ascii_header)
@@ -130,20 +649,34 @@ def main():
         udp_port = int(input("Enter UDP target port: "))
         save_config(udp_ip, udp_port)
     
+    lint, linted = {}, None  # Lint results and the file list they are for; redone on refresh or a new file list
     while True:
         print(ascii_header)
         print(f"Current delay: {delay} seconds")
+        print(f"Profiling: {'on' if load_profile() else 'off'}")
+        print(f"Pacing: {'adaptive' if load_pacing() is not None else 'fixed'}")
+        print(f"Kernel timestamps: {'on' if load_kernel_timestamps() else 'off'}")
         print("\nAvailable command files:")
         files = list_files()
         
         if not files:
             print("No files found.")
         else:
+            if files != linted:
+                lint, linted = udp_lint.lint_folder(COMMANDS_FOLDER, files), files
             for idx, file in enumerate(files, 1):
-                print(f"{idx}. {file}")
+                problems = lint.get(file)
+                print(f"{idx}. {file}" + (f"  [!] {len(problems)} problem(s), see L" if problems else ""))
         print("---")
         print("0. Refresh file list")
         print("A. Send all files")
+        print("D. Toggle adaptive pacing")
+        print("J. Job queue (unattended runs)")
+        print("K. Toggle kernel timestamps (Linux)")
+        print("L. Lint command files")
+        print("P. Toggle profiling")
+        print("R. Replay a capture")
+        print("S. Soak test a file (loop until Ctrl+C)")
         print("T. Change time delay")
         print("Q. Quit")
         choice = input("Select a file number to send or an option: ")
@@ -151,9 +684,35 @@ def main():
         if choice.lower() == 'q':
             break
         elif choice == '0':
+            linted = None
             continue
         elif choice.lower() == 'a':
             send_all_files(udp_ip, udp_port, delay)
+        elif choice.lower() == 'd':
+            save_pacing(load_pacing() is None)
+            continue
+        elif choice.lower() == 'j':
+            job_queue_menu(udp_ip, udp_port, delay)
+        elif choice.lower() == 'k':
+            save_kernel_timestamps(not load_kernel_timestamps())
+            continue
+        elif choice.lower() == 'l':
+            lint_all()
+            linted = None
+        elif choice.lower() == 'p':
+            save_profile(not load_profile())
+            continue
+        elif choice.lower() == 'r':
+            replay_file(udp_ip, udp_port)
+        elif choice.lower() == 's':
+            try:
+                file_idx = int(input("File number to soak test: ")) - 1
+                if 0 <= file_idx < len(files):
+                    soak_file(os.path.join(COMMANDS_FOLDER, files[file_idx]), udp_ip, udp_port, delay)
+                else:
+                    print("Invalid selection. Please enter a number from the list.")
+            except ValueError:
+                print("Invalid input. Please enter a valid number corresponding to a file.")
         elif choice.lower() == 't':
             try:
                 new_delay = float(input("Enter new delay (seconds): "))
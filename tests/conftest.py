@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import asyncio
+import threading
+import http.client
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import udp_dut_sim
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty folder with commands/ and results/, as the tools expect."""
+    (tmp_path / "commands").mkdir()
+    (tmp_path / "results").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def dut():
+    """A simulated device echoing every datagram; yields "127.0.0.1:<port>"."""
+    loop = asyncio.new_event_loop()
+    sim = udp_dut_sim.DutSimulator(port=0)
+    loop.run_until_complete(sim.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    port = sim.devices[0].transport.get_extra_info("sockname")[1]
+    yield sim, f"127.0.0.1:{port}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    sim.stop()
+    loop.close()
+
+def rpc(port, method, **params):
+    """Call a control API method over loopback HTTP; returns the JSON-RPC response."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+        connection.request("POST", "/rpc", body, {"Content-Type": "application/json"})
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
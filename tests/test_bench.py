@@ -0,0 +1,24 @@
+import udp_bench
+
+def results(**values):
+    return {"metrics": {name: udp_bench.metric(value, "x", better) for name, (value, better) in values.items()}}
+
+def test_percentile_is_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+    assert [udp_bench.percentile(values, pct) for pct in (0, 50, 99, 100)] == [1, 3, 5, 5]
+    assert udp_bench.percentile([], 50) is None
+
+def test_regressions_respect_direction_and_threshold():
+    baseline = results(pps=(1000, "higher"), p99=(100, "lower"), new_zero=(0, "lower"))
+    current = results(pps=(850, "higher"), p99=(109, "lower"), new_zero=(5, "lower"), added=(1, "higher"))
+    assert udp_bench.compare(baseline, current) == [("pps", 1000, 850, -0.15)]
+    assert [name for name, *_ in udp_bench.compare(baseline, current, threshold=0.05)] == ["pps", "p99"]
+
+def test_loopback_benchmarks_produce_their_metrics(workdir):
+    metrics = udp_bench.bench_pacing(0.001, 20)
+    metrics.update(udp_bench.bench_send_throughput((16,), 200))
+    metrics.update(udp_bench.bench_latency(20, str(workdir)))
+    assert metrics["send_template_16B_delivered"]["value"] > 0.9
+    assert metrics["pacing_error_p50_us"]["value"] is not None
+    for name, entry in metrics.items():
+        assert entry["better"] in ("higher", "lower"), name
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import udp_checksum
+
+CHECK = b"123456789"  # The standard catalogue input; values from the CRC RevEng catalogue
+VECTORS = {"crc8": 0xF4, "crc16": 0x29B1, "crc16modbus": 0x4B37, "crc32": 0xCBF43926, "sum8": 0xDD, "xor8": 0x31}
+
+@pytest.mark.parametrize("kind", sorted(VECTORS))
+def test_check_values(kind):
+    assert udp_checksum.checksum(kind, CHECK) == VECTORS[kind]
+
+@pytest.mark.parametrize("kind", sorted(VECTORS))
+def test_vectorized_rows_match_the_scalar_checksum(kind):
+    rows = np.random.default_rng(7).integers(0, 256, size=(64, 13), dtype=np.uint8)
+    rows[0] = np.frombuffer(CHECK + b"\x00" * 4, dtype=np.uint8)
+    expected = [udp_checksum.checksum(kind, bytes(row)) for row in rows]
+    assert udp_checksum.checksum_rows(kind, rows).tolist() == expected
+
+def test_binary_lines_cover_the_bytes_before_the_field():
+    assert udp_checksum.encode_line("31 32 33 34 35 36 37 38 39 {crc16}") == CHECK + b"\x29\xB1"
+    assert udp_checksum.encode_line("A5 313233343536373839 {crc32le:1}") == b"\xA5" + CHECK + bytes.fromhex("2639F4CB")
+
+def test_text_lines_cover_the_characters_sent():
+    line = "A5 01 {sum8:1}"
+    assert udp_checksum.encode_line(line, text=True) == b"A5 01 " + f"{sum(b'01 '):02X}".encode()
+
+@pytest.mark.parametrize("line", ["AA {md5}", "AA {crc16:5}", "AA {crc16:1:2}", "AA {crc8"])
+def test_bad_fields_are_rejected(line):
+    with pytest.raises(ValueError):
+        udp_checksum.encode_line(line)
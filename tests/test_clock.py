@@ -0,0 +1,49 @@
+import time
+import threading
+
+import pytest
+
+import udp_clock
+
+@pytest.fixture
+def clock_server():
+    server = udp_clock.ClockServer(host="127.0.0.1", port=0)
+    assert server.start()
+    yield server
+    server.stop()
+
+def stop_within(server, seconds):
+    stopper = threading.Thread(target=server.stop, daemon=True)
+    stopper.start()
+    stopper.join(seconds)
+    return not stopper.is_alive()
+
+def test_server_stops_promptly():
+    server = udp_clock.ClockServer(host="127.0.0.1", port=0)
+    assert server.start()
+    assert stop_within(server, 2.0)
+
+def test_server_stops_after_answering(clock_server):
+    offset, round_trip = udp_clock.measure(f"127.0.0.1:{clock_server.port}", samples=4)
+    assert abs(offset) < 0.01 and 0 <= round_trip < 0.1
+    assert stop_within(clock_server, 2.0)
+
+def test_measure_without_server_raises():
+    server = udp_clock.ClockServer(host="127.0.0.1", port=0)
+    assert server.start()
+    port = server.port
+    server.stop()
+    with pytest.raises(udp_clock.ClockError):
+        udp_clock.measure(f"127.0.0.1:{port}", samples=2, timeout=0.05)
+
+def test_synced_clock_waits_for_deadline_and_stops_early(clock_server):
+    clock = udp_clock.SyncedClock(f"127.0.0.1:{clock_server.port}", samples=4)
+    lateness = clock.wait_until(clock.now() + 0.05)
+    assert 0 <= lateness < 0.01
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    started = time.monotonic()
+    assert clock.wait_until(clock.now() + 10.0, stop) < 0
+    assert time.monotonic() - started < 2.0
+    clock.finish()
+    assert clock.summary()["end_offset"] is not None
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+
+import udp_cluster
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def agents(tmp_path):
+    """Two headless control API agents on ephemeral ports, each in its own working folder."""
+    processes, urls = [], []
+    for name in ("agent1", "agent2"):
+        folder = tmp_path / name
+        (folder / "commands").mkdir(parents=True)
+        (folder / "results").mkdir()
+        (folder / "udp_config.json").write_text(json.dumps({"metrics_port": 0}))
+        process = subprocess.Popen([sys.executable, "-u", os.path.join(ROOT, "udp_control.py"), "--port", "0"],
+                                   cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        processes.append(process)
+        for line in process.stdout:
+            if line.startswith("Control API on "):
+                urls.append((folder, line.split()[3].rsplit("/", 1)[0]))
+                break
+        else:
+            pytest.fail(f"{name} did not start")
+    yield urls
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+def test_suite_over_two_agents_merges_only_its_own_runs(workdir, dut, agents):
+    sim, target = dut
+    for name in ("one.txt", "two.txt", "three.txt"):
+        (workdir / "commands" / name).write_text("0102\n0304\n")
+    # An operator's run on the first agent during the suite, which is not the coordinator's
+    operator = (datetime.now() + timedelta(seconds=5)).strftime("%Y%m%d_%H%M%S_%f")[:-3] + "_manual"
+    (agents[0][0] / "results" / f"{operator}.txt").write_text("Sent: 0102\n")
+    (agents[0][0] / "results" / f"{operator}_summary.json").write_text(json.dumps({"run": "manual.txt", "job": None}))
+
+    report = udp_cluster.run_cluster(["one.txt", "two.txt", "three.txt"],
+                                     [udp_cluster.Agent(url, [target]) for folder, url in agents], 0.01,
+                                     commands_folder=str(workdir / "commands"), results_dir=str(workdir / "results"),
+                                     log=lambda text: None)
+
+    assert report["problems"] == []
+    assert sorted(job["state"] for job in report["jobs"]) == ["done"] * 3
+    assert {job["agent"] for job in report["jobs"]} == {url for folder, url in agents}
+    assert sim.stats()["received"] == 6
+    merged = sorted(name for name in os.listdir(workdir / "results") if name.endswith("_summary.json"))
+    assert len(merged) == 3 and not any("manual" in name for name in merged)
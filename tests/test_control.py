@@ -0,0 +1,115 @@
+import json
+import time
+import queue
+import base64
+import threading
+import http.client
+
+import pytest
+
+import udp_control
+import udp_queue
+import UDP_sender_v7 as sender
+from conftest import rpc
+
+@pytest.fixture
+def control(workdir, dut):
+    """A control API with its scheduler on an ephemeral port, sending to the simulated device."""
+    sim, target = dut
+    sender.ascii_header = ""
+    job_queue = udp_queue.JobQueue(str(workdir / "queue.sqlite"))
+    server, scheduler = udp_control.start_control(job_queue, sender.send_queued_job, {"targets": [target], "delay": 0.01},
+                                                  port=0, log=lambda text: None)
+    assert server is not None
+    yield server, sim
+    scheduler.stop()
+    server.stop()
+    job_queue.close()
+
+def stream_events(port):
+    """Subscribe to /events; returns a queue receiving (kind, data) from a reader thread."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/events")
+    response = connection.getresponse()  # Subscribed once the headers are back
+    assert response.status == 200
+    events = queue.Queue()
+
+    def read():
+        kind = None
+        try:
+            for line in response:
+                line = line.decode().rstrip("\n")
+                if line.startswith("event: "):
+                    kind = line[len("event: "):]
+                elif line.startswith("data: "):
+                    events.put((kind, json.loads(line[len("data: "):])))
+        except OSError:
+            pass
+
+    threading.Thread(target=read, daemon=True).start()
+    return events
+
+def wait_for_job(port, job_id, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = rpc(port, "status", id=job_id)["result"]
+        if job["state"] not in ("queued", "running"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_submit_runs_job_and_streams_its_log(control, workdir):
+    server, sim = control
+    (workdir / "commands" / "ping.txt").write_text("0102\n0304\n")
+    events = stream_events(server.port)
+
+    job_id = rpc(server.port, "submit", script="ping.txt")["result"]["jobs"][0]
+    job = wait_for_job(server.port, job_id)
+
+    assert job["state"] == "done"
+    assert sim.stats()["received"] == 2
+    seen = []
+    deadline = time.monotonic() + 5.0
+    while not any(kind == "job" and data["state"] == "done" for kind, data in seen) and time.monotonic() < deadline:
+        seen.append(events.get(timeout=5.0))
+    run_lines = [data["text"] for kind, data in seen if kind == "run_log" and data["id"] == job_id]
+    assert "Sent: 0102" in run_lines and "Sent: 0304" in run_lines
+    assert [data["state"] for kind, data in seen if kind == "job"] == ["started", "done"]
+
+def test_submit_batch_status_and_cancel(control, workdir):
+    server, _ = control
+    (workdir / "commands" / "later.txt").write_text("01\n")
+
+    results = rpc(server.port, "submit_batch", runs=[
+        {"script": "later.txt", "at": "2099-01-01 00:00"},
+        {"script": "missing.txt"},
+    ])["result"]
+    assert "error" in results[1]
+    job_id = results[0]["jobs"][0]
+
+    assert rpc(server.port, "status", id=job_id)["result"]["state"] == "queued"
+    assert rpc(server.port, "cancel", id=job_id)["result"] == {"cancelled": True}
+    assert rpc(server.port, "status", id=job_id)["result"]["state"] == "cancelled"
+    assert rpc(server.port, "cancel", id=job_id)["result"] == {"cancelled": False}
+    assert rpc(server.port, "status", id=9999)["error"]["code"] == udp_control.INVALID_PARAMS
+    assert rpc(server.port, "nope")["error"]["code"] == udp_control.METHOD_NOT_FOUND
+
+def test_upload_fetch_and_path_escapes(control, workdir):
+    server, _ = control
+    data = b"0A0B\n" * 1000
+    half = len(data) // 2
+    rpc(server.port, "upload", name="sub/big.txt", data=base64.b64encode(data[:half]).decode())
+    size = rpc(server.port, "upload", name="sub/big.txt", data=base64.b64encode(data[half:]).decode(), offset=half)
+    assert size["result"] == {"size": len(data)}
+    assert (workdir / "commands" / "sub" / "big.txt").read_bytes() == data
+
+    (workdir / "results" / "report.txt").write_bytes(b"results")
+    chunk = rpc(server.port, "fetch", path="report.txt")["result"]
+    assert base64.b64decode(chunk["data"]) == b"results" and chunk["eof"]
+
+    for method, params in (("upload", {"name": "../escaped.txt", "data": ""}),
+                           ("upload", {"name": str(workdir / "abs.txt"), "data": ""}),
+                           ("fetch", {"path": "../commands/sub/big.txt"})):
+        error = rpc(server.port, method, **params)["error"]
+        assert error["code"] == udp_control.INVALID_PARAMS and "outside" in error["message"]
+    assert not (workdir / "escaped.txt").exists() and not (workdir / "abs.txt").exists()
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+import udp_journal
+
+def start_journal(workdir, name):
+    log = str(workdir / "results" / f"20260101_120000_123_{name}.txt")
+    header = {"script": str(workdir / "commands" / "ping.txt"), "fingerprint": "f", "log": log, "scopeshots": None}
+    return udp_journal.RunJournal(udp_journal.journal_path(log), header)
+
+def test_runs_in_progress_are_not_offered_for_resume(workdir):
+    script = str(workdir / "commands" / "ping.txt")
+    journal = start_journal(workdir, "ping")
+    journal.record([[0, 3]], packets=3)
+    assert udp_journal.find_interrupted(str(workdir / "results"), script) == []
+
+    journal.close()  # Stopped: released for a resume
+    [record] = udp_journal.find_interrupted(str(workdir / "results"), script)
+    assert record["pos"] == [[0, 3]] and record["owner"] is None
+
+    resumed = udp_journal.resume_journal(record)
+    assert resumed.header["scopeshots"] == record["log"].rsplit(".", 1)[0]
+    resumed.record([[0, 4]], packets=4)
+    assert udp_journal.find_interrupted(str(workdir / "results"), script) == []
+    resumed.close()
+
+def test_journals_of_dead_owners_are_offered(workdir):
+    journal = start_journal(workdir, "crashed")
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    journal.header["owner"] = journal.header["owner"].rsplit(":", 1)[0] + f":{dead.pid}"
+    journal.record([[0, 1]])
+    journal.file.close()  # Crashed: never released
+    [record] = udp_journal.find_interrupted(str(workdir / "results"), str(workdir / "commands" / "ping.txt"))
+    assert record["owner"].endswith(f":{dead.pid}")
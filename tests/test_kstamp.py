@@ -0,0 +1,47 @@
+import select
+import socket
+import sys
+import time
+
+import pytest
+
+import udp_kstamp
+import udp_metrics
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="kernel timestamps need Linux")
+
+def test_ancillary_data_yields_the_stamp_and_its_send_id():
+    stamp = (socket.SOL_SOCKET, udp_kstamp.SO_TIMESTAMPING, udp_kstamp.TIMESPEC.pack(12, 345) + bytes(2 * udp_kstamp.TIMESPEC.size))
+    error = (socket.IPPROTO_IP, udp_kstamp.IP_RECVERR,
+             udp_kstamp.EXTENDED_ERR.pack(42, udp_kstamp.SO_EE_ORIGIN_TIMESTAMPING, 0, 0, 0, 0, 7))
+    assert udp_kstamp._parse([stamp, error]) == (12_000_000_345, 7)
+    assert udp_kstamp._parse([]) == (None, None)
+    assert udp_kstamp.format_ns(12_000_000_345) == "12.000000345"
+
+@linux_only
+def test_sends_and_replies_are_stamped_by_the_kernel(dut):
+    sim, target = dut
+    host, port = target.split(":")
+    metrics = udp_metrics.RunMetrics("kstamp")
+    lines = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as raw:
+        sock = udp_kstamp.StampedSocket(raw, metrics, lines.append)
+        for _ in range(5):
+            sock.sendto(b"\xAA\xBB", (host, int(port)))
+            deadline = time.monotonic() + 2
+            while True:
+                assert select.select([sock], [], [], max(0.0, deadline - time.monotonic()))[0], "no reply"
+                try:
+                    assert sock.recvfrom(64)[0] == b"\xAA\xBB"
+                    break
+                except BlockingIOError:
+                    continue  # Only a transmit stamp was queued
+        sock.collect()
+    assert sock.rx_stamps == 5
+    wire = metrics.summary()["kernel_timestamps"]
+    assert wire["rtt_seconds"]["count"] == 5
+    assert sum(" Wire RX (RTT " in line for line in lines) == 5
+    if sock.mode == "tx+rx":
+        assert sock.tx_stamps == 5 and not sock.pending
+        assert wire["send_delay_seconds"]["count"] == 5 and wire["ipdv_seconds"]["count"] == 3
+    assert sock.describe().startswith(f"Kernel timestamps: {sock.tx_stamps} transmit, 5 receive")
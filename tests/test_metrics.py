@@ -0,0 +1,18 @@
+import json
+
+import udp_metrics
+
+def test_summary_quantiles_past_last_bucket_stay_valid_json(workdir):
+    metrics = udp_metrics.RunMetrics("overflow")
+    for _ in range(10):
+        metrics.record_send(10, latency=5.0)  # Past the last latency bucket
+    path = metrics.write_summary(str(workdir / "results" / "run.log"))
+    with open(path) as file:
+        send = json.load(file)["send_seconds"]
+    assert send["p99"] == udp_metrics.LATENCY_BUCKETS[-1] and send["overflow"] is True
+    assert metrics.capture_seconds.summary()["p50"] is None
+
+def test_label_values_are_escaped():
+    counter = udp_metrics.Counter("udp_errors_total", "")
+    counter.inc(kind='bad "quote"\\\nline')
+    assert counter.render() == ['udp_errors_total{kind="bad \\"quote\\"\\\\\\nline"} 1']
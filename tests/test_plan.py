@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import udp_plan
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "commands")
+
+def write(workdir, name, text):
+    path = workdir / "commands" / name
+    path.write_text(text)
+    return str(path)
+
+def sends(plan):
+    return [op[1] for op in udp_plan.LoopRunner().iterate(plan["ops"]) if op[0] == "send"]
+
+def test_loop_sample_sends_what_the_unrolled_sample_sends():
+    unrolled = udp_plan.build_plan(os.path.join(SAMPLES, "example_02.txt"), SAMPLES)
+    looped = udp_plan.build_plan(os.path.join(SAMPLES, "example_03.txt"), SAMPLES)
+    assert not any(op[0] == "loop" for op in unrolled["ops"])  # Shared with senders that predate #REPEAT
+    assert sends(looped) == sends(unrolled)
+    assert udp_plan.count_packets(looped) == udp_plan.count_packets(unrolled) == 10
+
+def test_nested_loops_hold_one_body_and_resume_inside_it(workdir):
+    path = write(workdir, "nested.txt", "#REPEAT 2\nAA\n#repeat 3\nBB\n#END\n#END\nCC\n")
+    plan = udp_plan.build_plan(path, str(workdir / "commands"))
+    assert [op[0] for op in plan["ops"]] == ["loop", "send"]
+    assert sends(plan) == ["AA", "BB", "BB", "BB"] * 2 + ["CC"]
+    assert udp_plan.count_packets(plan) == 9
+
+    runner = udp_plan.LoopRunner()
+    ops = runner.iterate(plan["ops"], resume=[[0, 0], [1, 1], [2, 0]])  # Third BB of the second pass
+    assert [op[1] for op in ops] == ["BB", "CC"]
+
+def test_loop_errors_name_the_line(workdir):
+    path = write(workdir, "bad.txt", "#REPEAT 0\nAA\n#END\n#END\n#FOREVER\nAA\n")
+    with pytest.raises(udp_plan.PlanError) as error:
+        udp_plan.build_plan(path, str(workdir / "commands"))
+    assert error.value.problems == ["bad.txt:1: bad #REPEAT: expected a repeat count of at least 1",
+                        "bad.txt:3: #END without #REPEAT or #FOREVER",
+                        "bad.txt:4: #END without #REPEAT or #FOREVER",
+                        "bad.txt:5: bad #FOREVER: needs a stop condition (FOR <duration> or UNTIL FAIL)"]
+
+def test_streamed_plans_are_estimated_from_a_sample(workdir, monkeypatch):
+    path = write(workdir, "big.txt", "AABBCCDD\n" * 5000)
+    plan = udp_plan.open_plan(path, str(workdir / "commands"), stream_threshold=1)
+    assert plan["streaming"]
+    assert udp_plan.estimate_packets(plan) == 5000
+
+    reads = []
+    real_open = open
+    def counting_open(file, mode="r", *args, **kwargs):
+        handle = real_open(file, mode, *args, **kwargs)
+        if file == path:
+            real_read = handle.read
+            handle.read = lambda size=-1: reads.append(size) or real_read(size)
+        return handle
+    monkeypatch.setattr(udp_plan, "ESTIMATE_SAMPLE", 900)
+    monkeypatch.setattr("builtins.open", counting_open)
+    assert udp_plan.estimate_packets(plan) == 5000  # Lines are evenly sized, so the sample extrapolates exactly
+    assert reads == [900]
+
+def test_directives_are_matched_in_any_case(workdir):
+    path = write(workdir, "mixed.txt", "#Scope Capture\n#scope capture\n#expect AA TIMEOUT 1s\n#Wait_Quiet 10ms TIMEOUT 1s\n"
+                                       "#NOTE just a comment\nAABB # inline comment\n")
+    plan = udp_plan.build_plan(path, str(workdir / "commands"))
+    assert [op[0] for op in plan["ops"]] == ["capture", "capture", "expect", "wait_quiet", "send"]
+    assert plan["ops"][-1][1] == "AABB"
@@ -0,0 +1,70 @@
+import subprocess
+import sys
+import time
+
+import udp_queue
+
+def open_queue(workdir, origin=None):
+    return udp_queue.JobQueue(str(workdir / "queue.sqlite"), origin)
+
+def test_claims_follow_priority_limits_and_origin(workdir):
+    queue = open_queue(workdir)
+    low = queue.submit("a.txt", "10.0.0.1:5005", 0.1)
+    high = queue.submit("b.txt", "10.0.0.1:5005", 0.1, priority=5)
+    other = queue.submit("c.txt", "10.0.0.2:5005", 0.1)
+    open_queue(workdir, origin="gui").submit("d.txt", "10.0.0.3:5005", 0.1)
+
+    assert queue.claim({}, {})["id"] == high
+    assert queue.claim({"10.0.0.1:5005": 1}, {})["id"] == other  # The first board is full
+    assert queue.claim({"10.0.0.1:5005": 1, "10.0.0.2:5005": 1}, {}) is None  # The GUI's job is not ours
+    assert queue.claim({"10.0.0.1:5005": 1}, {"10.0.0.1:5005": 2})["id"] == low
+    assert [job["state"] for job in queue.jobs()] == ["running", "running", "running", "queued"]
+
+def test_recover_requeues_only_abandoned_claims(workdir):
+    queue = open_queue(workdir)
+    live, dead, stale = (queue.submit(name, "10.0.0.1:5005", 0.1) for name in ("live.txt", "dead.txt", "stale.txt"))
+    for _ in range(3):
+        queue.claim({}, {"10.0.0.1:5005": 3})
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    host = queue.owner.rsplit(":", 1)[0]
+    queue.db.execute("UPDATE jobs SET owner = ? WHERE id = ?", (f"{host}:{exited.pid}", dead))
+    queue.db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - udp_queue.STALE_AFTER - 1, stale))
+
+    assert queue.recover() == 2
+    assert queue.get(live)["state"] == "running"
+    assert queue.get(dead)["state"] == queue.get(stale)["state"] == "queued"
+    assert queue.get(dead)["owner"] is None and queue.get(dead)["attempts"] == 1
+
+def test_failed_attempts_back_off_then_fail(workdir):
+    queue = open_queue(workdir)
+    job_id = queue.submit("a.txt", "10.0.0.1:5005", 0.1, max_attempts=2)
+    job = queue.claim({}, {})
+    assert queue.complete(job, False, "boom") == "retry"
+    retried = queue.get(job_id)
+    assert retried["state"] == "queued" and retried["not_before"] >= time.time() + udp_queue.RETRY_BACKOFF - 1
+    assert queue.claim({}, {}) is None  # Not due yet
+
+    queue.db.execute("UPDATE jobs SET not_before = 0 WHERE id = ?", (job_id,))
+    job = queue.claim({}, {})
+    assert job["attempts"] == 2
+    assert queue.complete(job, False, "boom again") == "failed"
+    assert queue.get(job_id)["error"] == "boom again"
+    assert queue.stats()["counts"]["failed"] == 1
+
+def test_scheduler_retries_until_the_run_succeeds(workdir, monkeypatch):
+    monkeypatch.setattr(udp_queue, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(udp_queue, "POLL_INTERVAL", 0.05)
+    queue = open_queue(workdir)
+    job_id = queue.submit("a.txt", "10.0.0.1:5005", 0.1, max_attempts=3, options={"sequence": True})
+    calls = []
+
+    def send_file(script, ip, port, delay, **options):
+        calls.append(options)
+        if len(calls) == 1:
+            raise OSError("board unreachable")
+        return len(calls) == 3
+
+    stats = udp_queue.run_until_drained(queue, send_file, log=lambda text: None)
+    assert calls == [{"sequence": True, "job": job_id}] * 3
+    assert queue.get(job_id)["state"] == "done" and stats["counts"]["done"] == 1
@@ -0,0 +1,28 @@
+import socket
+import time
+
+import udp_rate
+
+def pace(pacer, address, count):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        for _ in range(count):
+            sent_at = time.perf_counter()
+            sock.sendto(b"\x01\x02", address)
+            pacer.after_send(sock, sent_at)
+        pacer.finish(sock)
+
+def test_silent_board_falls_back_to_the_fixed_delay():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink:
+        sink.bind(("127.0.0.1", 0))
+        pacer = udp_rate.pacer_from_config({"reply_timeout": 0.02, "min_delay": 0.001, "max_delay": 1.0}, 0.01)
+        pace(pacer, sink.getsockname(), 30)
+    assert pacer.fallen_back and pacer.summary()["fixed_delay_fallbacks"] == 1
+    assert pacer.delay == 0.01
+
+def test_answering_board_stays_adaptive(dut):
+    sim, target = dut
+    host, port = target.split(":")
+    pacer = udp_rate.pacer_from_config({"reply_timeout": 0.2, "min_delay": 0.001, "max_delay": 1.0}, 0.01)
+    pace(pacer, (host, int(port)), 30)
+    assert not pacer.fallen_back and pacer.replies == 30
@@ -0,0 +1,30 @@
+import json
+
+import udp_journal
+import udp_plan
+import UDP_sender_v7 as sender
+
+def test_resumed_run_keeps_its_key_and_packet_count(workdir, dut, monkeypatch):
+    sim, target = dut
+    host, port = target.split(":")
+    script = str(workdir / "commands" / "four.txt")
+    (workdir / "commands" / "four.txt").write_text("01\n02\n03\n04\n")
+    key = "20260101_120000_123_four"
+    log = str(workdir / "results" / f"{key}.txt")
+    journal = udp_journal.RunJournal(udp_journal.journal_path(log), {
+        "script": script, "fingerprint": udp_journal.plan_fingerprint(udp_plan.open_plan(script, str(workdir / "commands"))),
+        "log": log, "scopeshots": udp_journal.scopeshot_folder(log)})
+    journal.record([[0, 2]], packets=2)
+    journal.close()  # Interrupted after two packets
+
+    sender.ascii_header = ""
+    monkeypatch.setattr(sender, "COMMANDS_FOLDER", str(workdir / "commands"))
+    monkeypatch.setattr(sender, "RESULTS_DIR", str(workdir / "results"))
+    monkeypatch.setattr("builtins.input", lambda prompt="": "y")
+    assert sender.send_udp_command(script, host, int(port), 0.0)
+
+    assert sim.stats()["received"] == 2
+    with open(workdir / "results" / f"{key}_summary.json") as file:
+        assert json.load(file)["packets_sent"] == 4
+    assert sorted(path.name for path in (workdir / "results").iterdir() if path.name.endswith("_summary.json")) == [f"{key}_summary.json"]
+    assert udp_journal.find_interrupted(str(workdir / "results"), script) == []
@@ -0,0 +1,48 @@
+import os
+
+import udp_blobs
+import udp_journal
+import udp_retention
+
+def test_side_files_and_segments_belong_to_their_run(workdir):
+    key = "20260101_120000_123_ping"
+    names = [f"{key}.txt", f"{key}_summary.json", f"{key}_journal.dat", f"{key}_soak.json",
+             f"{key}.0001.txt.gz", f"{key}_rate.json"]
+    for name in names:
+        (workdir / "results" / name).write_text("x")
+    (workdir / "results" / "20260101_130000_456_suite_timing.json").write_text("{}")
+    (workdir / "results" / udp_retention.ARCHIVE_DIR).mkdir()
+
+    runs = udp_retention.scan_runs(str(workdir / "results"))
+    assert [run["key"] for run in runs] == [key, "20260101_130000_456_suite_timing"]
+    assert len(runs[0]["paths"]) == len(names)
+
+def make_run(results, key, size=1000):
+    (results / f"{key}.txt").write_bytes(b"x" * size)
+    (results / f"{key}_summary.json").write_text("{}")
+
+def test_runs_with_a_journal_are_never_archived(workdir):
+    results = workdir / "results"
+    make_run(results, "20200101_120000_000_old")
+    make_run(results, "20200102_120000_000_soak")
+    journal = udp_journal.RunJournal(str(results / "20200102_120000_000_soak_journal.dat"),
+                                     {"script": "soak.txt", "log": str(results / "20200102_120000_000_soak.txt")})
+    journal.record([[0, 1]])  # Still running in this process
+
+    summary = udp_retention.apply_retention(str(results), {"max_age_days": 1}, log=lambda text: None)
+
+    assert summary["archived"] == 1
+    assert (results / "20200102_120000_000_soak.txt").exists()
+    assert not (results / "20200101_120000_000_old.txt").exists()
+    journal.close()  # Interrupted now: still kept, so it can be resumed
+    assert udp_retention.apply_retention(str(results), {"max_age_days": 1}, log=lambda text: None)["archived"] == 0
+
+def test_linked_scopeshots_do_not_count_towards_size(workdir):
+    results = workdir / "results"
+    make_run(results, "20200101_120000_000_shots", size=10)
+    folder = results / "20200101_120000_000_shots"
+    folder.mkdir()
+    udp_blobs.BlobStore(str(results)).store(b"png" * 1000, str(folder / "a_scopeshot.png"))
+    [run] = udp_retention.scan_runs(str(results))
+    linked = os.stat(folder / "a_scopeshot.png").st_nlink > 1
+    assert run["size"] == 12 + (0 if linked else 3000)
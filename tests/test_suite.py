@@ -0,0 +1,42 @@
+import json
+
+import udp_suite
+
+def write(workdir, name, text):
+    (workdir / "commands" / name).write_text(text)
+
+def test_jobs_keep_cmd_lists_whole(workdir):
+    write(workdir, "a.txt", "01\n")
+    write(workdir, "b.txt", "02\n")
+    write(workdir, "c.txt", "03\n")
+    write(workdir, "CMD_ab.txt", "a.txt\nb.txt\n")
+    jobs, problems = udp_suite.build_jobs(["CMD_ab.txt", "a.txt", "b.txt", "c.txt"], str(workdir / "commands"))
+    assert problems == []
+    assert [(job["name"], job["files"]) for job in jobs] == [("CMD_ab.txt", ["a.txt", "b.txt"]), ("c.txt", ["c.txt"])]
+
+def test_lanes_balance_longest_first(workdir):
+    write(workdir, "long.txt", "01\n" * 10)
+    write(workdir, "mid.txt", "01\n" * 6)
+    write(workdir, "short.txt", "01\n" * 4)
+    jobs, _ = udp_suite.build_jobs(["long.txt", "mid.txt", "short.txt"], str(workdir / "commands"))
+    lanes = udp_suite.assign_lanes(jobs, [("10.0.0.1", 1), ("10.0.0.2", 2)], 1.0, str(workdir / "commands"))
+    assert [[job["name"] for job in lane["jobs"]] for lane in lanes] == [["long.txt"], ["mid.txt", "short.txt"]]
+    assert [lane["estimate"] for lane in lanes] == [10.0, 10.0]
+
+def test_suite_reports_failed_files_and_keeps_going(workdir):
+    for name in ("ok.txt", "bad.txt", "boom.txt"):
+        write(workdir, name, "01\n")
+
+    def send_file(file_path, ip, port, delay):
+        if file_path.endswith("boom.txt"):
+            raise OSError("unreachable")
+        return not file_path.endswith("bad.txt")
+
+    report = udp_suite.run_suite(["ok.txt", "bad.txt", "boom.txt", "gone.txt"], [("127.0.0.1", 9)], 0.0, send_file,
+                                 commands_folder=str(workdir / "commands"), results_dir=str(workdir / "results"))
+    statuses = {entry["file"]: entry for job in report["jobs"] for entry in job["files"]}
+    assert {name: entry["status"] for name, entry in statuses.items()} == {
+        "ok.txt": "sent", "bad.txt": "failed", "boom.txt": "failed", "gone.txt": "missing"}
+    assert statuses["boom.txt"]["error"] == "unreachable"
+    with open(report["report_path"]) as file:
+        assert json.load(file)["jobs"] == report["jobs"]
@@ -0,0 +1,26 @@
+import json
+
+import udp_trace
+
+def test_long_runs_keep_the_newest_events_and_count_the_rest(tmp_path):
+    tracer = udp_trace.Tracer(max_events=10)
+    for index in range(25):
+        with tracer.span("send", index=index):
+            pass
+    tracer.instant("stop")
+    assert len(tracer.events) == 10 and tracer.dropped == 16
+    assert tracer.span_totals()["send"][0] == 25  # Totals cover dropped spans too
+
+    tracer.write(str(tmp_path / "run_trace.json"))
+    trace = json.loads((tmp_path / "run_trace.json").read_text())
+    assert trace["otherData"] == {"recorded_events": 26, "dropped_events": 16}
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [event["args"]["index"] for event in spans] == list(range(16, 25))
+
+    tracer.write_profile_summary(str(tmp_path / "run_profile.txt"))
+    assert "16 older ones were dropped" in (tmp_path / "run_profile.txt").read_text()
+
+def test_disabled_tracer_records_nothing():
+    with udp_trace.NULL_TRACER.span("send"):
+        pass
+    assert not udp_trace.NULL_TRACER.events and udp_trace.NULL_TRACER.dropped == 0
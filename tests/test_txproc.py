@@ -0,0 +1,23 @@
+import time
+
+import udp_txproc
+
+def test_error_events_carry_their_message(dut):
+    sim, target = dut
+    host, port = target.split(":")
+    ops = [("send", "0102", "ping.txt", 1), ("replay", {"path": "missing.pcap", "speed": None}, "ping.txt", 2)]
+    tx = udp_txproc.TransmitProcess(ops, (host, int(port)), 0.01)
+    tx.start()
+    kinds, errors = [], []
+    deadline = time.monotonic() + 20.0
+    while udp_txproc.EV_DONE not in kinds and time.monotonic() < deadline:
+        for kind, index, a, b, c in tx.events():
+            kinds.append(kind)
+            if kind == udp_txproc.EV_ERROR:
+                errors.append((index, tx.error_message(index)))
+        time.sleep(0.01)
+    summary = tx.finish()
+
+    assert kinds == [udp_txproc.EV_SENT, udp_txproc.EV_PACED, udp_txproc.EV_ERROR, udp_txproc.EV_DONE]
+    assert errors[0][0] == 1 and "missing.pcap" in errors[0][1]
+    assert summary["overflowed"] == 0
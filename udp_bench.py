@@ -0,0 +1,444 @@
+import os
+import io
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+
+import udp_capture
+import udp_dut_sim
+import udp_template
+
+# Loopback benchmark harness for the send, receive and capture paths.
+#
+#   python udp_bench.py                          run and save results/benchmarks/<timestamp>.json
+#   python udp_bench.py --baseline old.json      also fail (exit 1) on regressions
+#   python udp_bench.py --threshold 0.15 --quick
+#
+# Everything runs on 127.0.0.1 through the tools' own entry points: the CLI
+# (send_udp_command), UDP_receiver_v0.py and, when PyQt6 and pyvisa are
+# installed, the GUI's sender thread, log pane and scopeshot capture. They
+# talk to a counting receiver, the simulated DUT (udp_dut_sim.py) and a
+# simulated oscilloscope that answers ":DISPlay:DATA? PNG" with a canned
+# image.
+
+BENCH_DIR = os.path.join("results", "benchmarks")
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_THRESHOLD = 0.10  # Allowed relative regression before a run fails
+PAYLOAD_SIZES = (16, 64, 512, 1400)
+SCOPE_IMAGE_SIZE = 300 * 1024
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a list of numbers (nearest rank)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def metric(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+class CountingReceiver(threading.Thread):
+    """Receive datagrams on loopback and record their arrival times."""
+
+    def __init__(self, keep_times=False):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.2)
+        self.address = self.sock.getsockname()
+        self.keep_times = keep_times
+        self.count = 0
+        self.times = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                self.sock.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.count += 1
+            if self.keep_times:
+                self.times.append(time.perf_counter())
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+class SimulatedDut:
+    """udp_dut_sim on an ephemeral loopback port, run on its own event loop thread; echoes every datagram."""
+
+    def __init__(self, **options):
+        self.loop = asyncio.new_event_loop()
+        self.sim = udp_dut_sim.DutSimulator(port=0, **options)
+        self.loop.run_until_complete(self.sim.start())
+        self.address = self.sim.devices[0].transport.get_extra_info("sockname")
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.sim.stop()
+        self.loop.close()
+
+class SimulatedScope(threading.Thread):
+    """A TCP SCPI stand-in that answers screenshot requests with an IEEE 488.2 block."""
+
+    def __init__(self, image_size=SCOPE_IMAGE_SIZE):
+        super().__init__(daemon=True)
+        self.image = b"\x89PNG\r\n\x1a\n" + os.urandom(image_size - 8)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.server.settimeout(0.2)
+        self.address = self.server.getsockname()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()  # A session per capture
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rb") as reader:
+            for line in reader:
+                if line.strip().upper().startswith(b":DISP"):
+                    size = str(len(self.image)).encode()
+                    conn.sendall(b"#" + str(len(size)).encode() + size + self.image + b"\n")
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+        self.join()
+
+class SimulatedVisa:
+    """Stands in for the pyvisa module in the GUI: resources open the simulated scope's SCPI socket."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def ResourceManager(self):
+        return self
+
+    def open_resource(self, resource):
+        return ScopeSession(self.address)
+
+class ScopeSession:
+    """A VISA session on the simulated scope; read_raw() returns a whole reply, block header included."""
+
+    def __init__(self, address):
+        self.conn = socket.create_connection(address)
+        self.reader = self.conn.makefile("rb")
+
+    def write(self, command):
+        self.conn.sendall(command.encode() + b"\n")
+
+    def read_raw(self):
+        header = self.reader.read(2)
+        if header[:1] != b"#":
+            raise ValueError("scope reply is not a definite-length block")
+        size = self.reader.read(int(header[1:]))
+        return header + size + self.reader.read(int(size)) + self.reader.readline()
+
+    def close(self):
+        self.reader.close()
+        self.conn.close()
+
+    __del__ = close
+
+@contextlib.contextmanager
+def in_directory(path):
+    """Run the tools in path, so their commands/ and results/ folders stay out of the working tree."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def load_gui():
+    """Import the GUI for the GUI benchmarks; returns (module, QApplication) or None without PyQt6 / pyvisa."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        import UDP_sender_GUI_v7 as gui  # Creates commands/ and results/ in the current directory
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        return None
+    return gui, QApplication.instance() or QApplication(sys.argv[:1])
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def bench_send_throughput(sizes, count):
+    """Packets/s through the template engine and the CLI line path at several payload sizes."""
+    import UDP_sender_v7
+    UDP_sender_v7.ascii_header = ""
+    results = {}
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for size in sizes:
+        receiver = CountingReceiver()
+        receiver.start()
+        template = udp_template.parse_template(f"#TEMPLATE {count} {{counter:4}} {'00' * max(0, size - 4)}")
+        start = time.perf_counter()
+        udp_template.send_template(sender, receiver.address, template, 0)
+        elapsed = time.perf_counter() - start
+        time.sleep(0.2)
+        receiver.stop()
+        results[f"send_template_{size}B_pps"] = metric(round(count / elapsed), "packets/s", "higher")
+        results[f"send_template_{size}B_delivered"] = metric(round(receiver.count / count, 4), "ratio", "higher")
+
+        receiver = CountingReceiver()
+        receiver.start()
+        line = "AB" * (size // 2)  # The CLI sends lines as ASCII text: one byte per character
+        plan = {"ops": [("send", line, "bench", n) for n in range(count // 4)]}
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            UDP_sender_v7.send_plan(plan, receiver.address[0], receiver.address[1], 0)
+        elapsed = time.perf_counter() - start
+        receiver.stop()
+        results[f"send_cli_lines_{size}B_pps"] = metric(round(len(plan["ops"]) / elapsed), "packets/s", "higher")
+    sender.close()
+    return results
+
+def bench_pacing(delay, count):
+    """Deadline error of paced template sends, measured at a loopback receiver."""
+    receiver = CountingReceiver(keep_times=True)
+    receiver.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    template = udp_template.parse_template(f"#TEMPLATE {count} {{counter:4}}")
+    udp_template.send_template(sender, receiver.address, template, delay)
+    time.sleep(0.1)
+    receiver.stop()
+    sender.close()
+    times = receiver.times
+    errors = [abs(t - (times[0] + i * delay)) * 1e6 for i, t in enumerate(times)] if times else []
+    return {
+        "pacing_error_p50_us": metric(percentile(errors, 50), "us", "lower"),
+        "pacing_error_p99_us": metric(percentile(errors, 99), "us", "lower"),
+        "pacing_error_max_us": metric(max(errors) if errors else None, "us", "lower"),
+    }
+
+def bench_latency(count, workdir):
+    """Command to matched reply turnaround of the CLI (send_udp_command, #EXPECT) through the simulated DUT."""
+    import UDP_sender_v7
+    UDP_sender_v7.ascii_header = ""
+    dut = SimulatedDut()
+    dut.start()
+    with open(os.path.join(workdir, "commands", "bench_latency.txt"), "w") as file:
+        file.write(f"#REPEAT {count}\nAB\n#EXPECT 41 42 TIMEOUT 1s\n#END\n")  # "AB" goes out as ASCII
+    sent_at = None
+    rtts = []
+
+    def on_log(text):
+        nonlocal sent_at
+        now = time.perf_counter()
+        if text.startswith("Sent:"):
+            sent_at = now
+        elif text.startswith("EXPECT") and "PASS" in text and sent_at is not None:
+            rtts.append((now - sent_at) * 1e6)
+            sent_at = None
+
+    with in_directory(workdir), contextlib.redirect_stdout(io.StringIO()):
+        UDP_sender_v7.send_udp_command(os.path.join("commands", "bench_latency.txt"), dut.address[0], dut.address[1], 0,
+                                       interactive=False, log=on_log)
+    dut.stop()
+    return {
+        "cli_expect_rtt_p50_us": metric(percentile(rtts, 50), "us", "lower"),
+        "cli_expect_rtt_p99_us": metric(percentile(rtts, 99), "us", "lower"),
+        "cli_expect_loss_ratio": metric(round(1 - len(rtts) / count, 4), "ratio", "lower"),
+    }
+
+def bench_receiver(count, workdir):
+    """Datagrams/s handled by UDP_receiver_v0.py (printing and recording each one), fed by the CLI."""
+    import UDP_sender_v7
+    UDP_sender_v7.ascii_header = ""
+    port = free_port()
+    receiver = subprocess.Popen([sys.executable, "-u", os.path.join(HERE, "UDP_receiver_v0.py"),
+                                 os.path.join(workdir, "bench_receiver.pcap"), str(port)],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=workdir)
+    receiver.stdout.readline()  # "Listening on UDP port ..."
+    times = []
+
+    def read():
+        for line in receiver.stdout:
+            if line.startswith(b"Received raw message"):
+                times.append(time.perf_counter())
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    with open(os.path.join(workdir, "commands", "bench_receiver.txt"), "w") as file:
+        file.write(f"#REPEAT {count}\n{'AB' * 32}\n#END\n")
+    start = time.perf_counter()
+    with in_directory(workdir), contextlib.redirect_stdout(io.StringIO()):
+        UDP_sender_v7.send_udp_command(os.path.join("commands", "bench_receiver.txt"), "127.0.0.1", port, 0, interactive=False)
+    deadline = time.perf_counter() + 5.0
+    while len(times) < count and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    receiver.terminate()
+    receiver.wait()
+    reader.join()
+    elapsed = (times[-1] - start) if times else None
+    return {
+        "receiver_pps": metric(round(len(times) / elapsed) if elapsed else None, "packets/s", "higher"),
+        "receiver_delivered": metric(round(len(times) / count, 4), "ratio", "higher"),
+    }
+
+def bench_capture(count, workdir):
+    """Record and read back rates of the pcap capture path."""
+    path = os.path.join(workdir, "bench_capture.pcap")
+    payload = bytes(64)
+    start = time.perf_counter()
+    with udp_capture.CaptureWriter(path) as writer:
+        for _ in range(count):
+            writer.write(payload, ("127.0.0.1", 40000))
+    write_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    read = sum(1 for _ in udp_capture.read_capture(path))
+    read_elapsed = time.perf_counter() - start
+    return {
+        "capture_write_pps": metric(round(count / write_elapsed), "packets/s", "higher"),
+        "capture_read_pps": metric(round(read / read_elapsed), "packets/s", "higher"),
+    }
+
+def bench_scopeshot(gui, count, workdir):
+    """Turnaround of the GUI's scopeshot capture (UdpSenderThread.capture_scopeshot) from a simulated scope."""
+    gui, _ = gui
+    scope = SimulatedScope()
+    scope.start()
+    visa, gui.pyvisa = gui.pyvisa, SimulatedVisa(scope.address)
+    turnarounds = []
+    try:
+        with in_directory(workdir):
+            thread = gui.UdpSenderThread("bench_scopeshot.txt", ("127.0.0.1", 9), "127.0.0.1")
+            for n in range(count):
+                start = time.perf_counter()
+                thread.capture_scopeshot(os.path.join(gui.RESULTS_DIR, "bench_scopeshots"))
+                turnarounds.append((time.perf_counter() - start) * 1e3)
+    finally:
+        gui.pyvisa = visa
+        scope.stop()
+    return {
+        "scopeshot_turnaround_p50_ms": metric(percentile(turnarounds, 50), "ms", "lower"),
+        "scopeshot_turnaround_p99_ms": metric(percentile(turnarounds, 99), "ms", "lower"),
+        "scopeshot_failures": metric(count - thread.captures, "captures", "lower"),
+    }
+
+def bench_gui_run(gui, count, workdir):
+    """A GUI run (UdpSenderThread.run) against the simulated DUT, its log lines shown in the window's log pane."""
+    gui, app = gui
+    dut = SimulatedDut()
+    dut.start()
+    with in_directory(workdir):
+        with open(os.path.join(gui.UDP_COMMANDS_DIR, "bench_gui.txt"), "w") as file:
+            file.write(f"#REPEAT {count}\nAB\n#EXPECT AB TIMEOUT 1s\n#END\n")  # Each command waits for its echo, not 1 s
+        window = gui.MainWindow()
+        thread = gui.UdpSenderThread(os.path.join(gui.UDP_COMMANDS_DIR, "bench_gui.txt"), dut.address, "127.0.0.1")
+        thread.log_signal.connect(window.append_run_log)
+        start = time.perf_counter()
+        thread.start()
+        while thread.isRunning() or thread.pending_logs:
+            app.processEvents()
+        elapsed = time.perf_counter() - start
+        thread.wait()
+    dut.stop()
+    shown = window.log_pane.document().blockCount()
+    return {
+        "gui_run_commands_per_s": metric(round(thread.metrics.packets / elapsed), "commands/s", "higher"),
+        "gui_log_ingest_lps": metric(round(shown / elapsed), "lines/s", "higher"),
+        "gui_max_log_queue_depth": metric(thread.metrics.max_log_queue_depth, "lines", "lower"),
+    }
+
+def run_benchmarks(quick=False):
+    """Run every benchmark and return the results document."""
+    scale = 0.1 if quick else 1.0
+    metrics = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "commands"))
+        os.makedirs(os.path.join(workdir, "results"))
+        metrics.update(bench_send_throughput(PAYLOAD_SIZES, int(20000 * scale)))
+        metrics.update(bench_pacing(0.001, int(1000 * scale)))
+        metrics.update(bench_latency(int(2000 * scale), workdir))
+        metrics.update(bench_receiver(int(5000 * scale), workdir))
+        metrics.update(bench_capture(int(50000 * scale), workdir))
+        with in_directory(workdir):
+            gui = load_gui()
+        if gui is not None:  # The GUI benchmarks need PyQt6 and pyvisa
+            metrics.update(bench_scopeshot(gui, max(3, int(20 * scale)), workdir))
+            metrics.update(bench_gui_run(gui, int(2000 * scale), workdir))
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "quick": quick,
+        "metrics": metrics,
+    }
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Return a list of (name, old, new, change) for metrics that regressed past threshold."""
+    regressions = []
+    for name, new in current["metrics"].items():
+        old = baseline.get("metrics", {}).get(name)
+        if not old or old["value"] in (None, 0) or new["value"] is None:
+            continue
+        change = (new["value"] - old["value"]) / abs(old["value"])
+        if (new["better"] == "higher" and change < -threshold) or (new["better"] == "lower" and change > threshold):
+            regressions.append((name, old["value"], new["value"], change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmarks for the UDP command sender.")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative regression")
+    parser.add_argument("--output", help="where to write the results JSON")
+    parser.add_argument("--quick", action="store_true", help="run a smaller, faster benchmark set")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.quick)
+    for name, entry in results["metrics"].items():
+        value = entry["value"]
+        shown = f"{value:.1f}" if isinstance(value, float) else value
+        print(f"{name:36s} {shown} {entry['unit']}")
+
+    output = args.output
+    if not output:
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        output = os.path.join(BENCH_DIR, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results saved: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.threshold)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old} -> {new} ({change:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}.")
+
+if __name__ == "__main__":
+    main()
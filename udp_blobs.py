@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+# Content-addressed storage for scopeshots and other capture data. Each blob
+# is stored once under <results>/.blobs/<first two hex digits>/<sha256><ext>
+# and every run folder gets a hard link to it, so identical screens cost one
+# file no matter how often they are captured. Where hard links are not
+# available, the run folder records the blob in a scopeshots.json catalog
+# instead and readers resolve names through resolve().
+#
+#   python udp_blobs.py compact [results]   dedup existing history into the store
+#   python udp_blobs.py stats [results]     show store size and savings
+
+BLOB_DIR = ".blobs"
+CATALOG_FILE = "scopeshots.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+HASH_CHUNK = 1 << 20
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_catalog(folder):
+    """Return the {name: blob path relative to the results dir} catalog of a run folder."""
+    path = os.path.join(folder, CATALOG_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+def _save_catalog(folder, catalog):
+    path = os.path.join(folder, CATALOG_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as file:
+        json.dump(catalog, file, indent=4)
+    os.replace(tmp, path)
+
+class BlobStore:
+    """A sha256-addressed blob store inside a results directory."""
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        self.root = os.path.join(results_dir, BLOB_DIR)
+
+    def path_for(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def put(self, data, ext=".png"):
+        """Store data once; return (digest, blob path, True if it was new)."""
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.path_for(digest, ext)
+        if os.path.exists(blob_path):
+            return digest, blob_path, False
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp = f"{blob_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, blob_path)  # Atomic, so concurrent writers of the same content are harmless
+        return digest, blob_path, True
+
+    def _place(self, blob_path, dest_path):
+        """Hard-link a blob to dest_path; fall back to a catalog entry. Returns True if linked."""
+        tmp = dest_path + ".link.tmp"
+        try:
+            os.link(blob_path, tmp)
+            os.replace(tmp, dest_path)
+            return True
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        folder = os.path.dirname(dest_path)
+        catalog = load_catalog(folder)
+        catalog[os.path.basename(dest_path)] = os.path.relpath(blob_path, self.results_dir)
+        _save_catalog(folder, catalog)
+        return False
+
+    def store(self, data, dest_path):
+        """Store capture data and make it appear as dest_path; return (digest, True if the content was new)."""
+        ext = os.path.splitext(dest_path)[1].lower() or ".bin"
+        digest, blob_path, new = self.put(data, ext)
+        self._place(blob_path, dest_path)
+        return digest, new
+
+    def remove(self, dest_path):
+        """Remove a capture from its run folder; a linked blob nothing else links to goes with it.
+
+        Blobs only referenced from catalogs are left to remove_orphans().
+        """
+        if os.path.exists(dest_path):
+            blob_path = None
+            if os.stat(dest_path).st_nlink == 2:  # This run's link and the store copy
+                ext = os.path.splitext(dest_path)[1].lower() or ".bin"
+                candidate = self.path_for(_hash_file(dest_path), ext)
+                if os.path.exists(candidate) and os.path.samefile(candidate, dest_path):
+                    blob_path = candidate
+            os.remove(dest_path)
+            if blob_path is not None:
+                os.remove(blob_path)
+            return
+        folder = os.path.dirname(dest_path)
+        catalog = load_catalog(folder)
+        if catalog.pop(os.path.basename(dest_path), None) is not None:
+            _save_catalog(folder, catalog)
+
+    def compact(self, extensions=IMAGE_EXTENSIONS, log=print):
+        """Move existing captures under the results dir into the store; return dedup stats."""
+        stats = {"files": 0, "already_stored": 0, "deduplicated": 0, "stored": 0, "cataloged": 0, "bytes_saved": 0, "errors": 0}
+        for folder, dirs, files in os.walk(self.results_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if not name.lower().endswith(extensions):
+                    continue
+                path = os.path.join(folder, name)
+                stats["files"] += 1
+                try:
+                    info = os.stat(path)
+                    digest = _hash_file(path)
+                    blob_path = self.path_for(digest, os.path.splitext(name)[1].lower())
+                    if os.path.exists(blob_path):
+                        if os.path.samefile(path, blob_path):
+                            stats["already_stored"] += 1
+                            continue
+                        linked = self._place(blob_path, path)
+                        if not linked:
+                            os.remove(path)
+                        stats["deduplicated"] += 1
+                        stats["bytes_saved"] += info.st_size
+                    else:
+                        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                        try:
+                            os.link(path, blob_path)  # The file itself becomes the blob
+                        except OSError:
+                            os.replace(path, blob_path)
+                            self._place(blob_path, path)
+                            stats["cataloged"] += 1
+                        stats["stored"] += 1
+                except OSError as e:
+                    stats["errors"] += 1
+                    log(f"Could not compact {path}: {e}")
+        stats["orphans_removed"] = self.remove_orphans()
+        return stats
+
+    def remove_orphans(self):
+        """Delete blobs that no run folder links to or catalogs; return how many were removed."""
+        if not os.path.isdir(self.root):
+            return 0
+        referenced = set()
+        for folder, dirs, files in os.walk(self.results_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            if CATALOG_FILE in files:
+                try:
+                    referenced.update(os.path.normpath(os.path.join(self.results_dir, rel)) for rel in load_catalog(folder).values())
+                except (OSError, ValueError):
+                    return 0  # An unreadable catalog could hide references; keep everything
+        removed = 0
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(folder, name)
+                if name.endswith(".tmp") or os.stat(path).st_nlink > 1 or os.path.normpath(path) in referenced:
+                    continue
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def stats(self):
+        """Return blob count, store size and the bytes the links save."""
+        blobs = size = saved = 0
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                info = os.stat(os.path.join(folder, name))
+                blobs += 1
+                size += info.st_size
+                saved += info.st_size * max(0, info.st_nlink - 2)  # The store copy plus one run copy are not savings
+        return {"blobs": blobs, "store_bytes": size, "bytes_saved_by_links": saved}
+
+def list_captures(folder, extensions=IMAGE_EXTENSIONS):
+    """Return the sorted capture names in a run folder, including cataloged ones."""
+    names = {name for name in os.listdir(folder) if name.lower().endswith(extensions)}
+    try:
+        names.update(name for name in load_catalog(folder) if name.lower().endswith(extensions))
+    except (OSError, ValueError):
+        pass
+    return sorted(names)
+
+def resolve(results_dir, folder, name):
+    """Return the readable path of a capture shown as folder/name."""
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        return path
+    try:
+        rel = load_catalog(folder).get(name)
+    except (OSError, ValueError):
+        rel = None
+    return os.path.join(results_dir, rel) if rel else path
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed scopeshot store.")
+    parser.add_argument("command", choices=("compact", "stats"))
+    parser.add_argument("results", nargs="?", default="results", help="results directory")
+    args = parser.parse_args()
+    if not os.path.isdir(args.results):
+        print(f"Results directory not found: {args.results}")
+        sys.exit(1)
+    store = BlobStore(args.results)
+    if args.command == "compact":
+        stats = store.compact()
+        print(f"Compacted {stats['files']} captures: {stats['deduplicated']} duplicates linked, "
+              f"{stats['stored']} stored, {stats['already_stored']} already stored, "
+              f"{stats['bytes_saved'] / 1e6:.1f} MB saved, {stats['orphans_removed']} orphans removed")
+        if stats["errors"]:
+            print(f"{stats['errors']} files could not be compacted")
+    print(f"Store: {store.stats()}")
+
+if __name__ == "__main__":
+    main()
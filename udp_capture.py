@@ -0,0 +1,150 @@
+import os
+import time
+import socket
+import struct
+
+# Record-and-replay of UDP traffic. Captures are standard nanosecond pcap
+# files (LINKTYPE_RAW, one synthesized IPv4/UDP header per datagram), so they
+# are append-only, compact and open directly in Wireshark. Each record keeps
+# the payload, the source address and a nanosecond receive timestamp.
+
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAP_MAGIC_US = 0xA1B2C3D4
+LINKTYPE_RAW = 101
+SNAPLEN = 65535
+FLUSH_EVERY = 64  # Records between flushes while recording
+FLUSH_INTERVAL = 0.2  # Seconds between flushes while recording
+
+_GLOBAL_HEADER = struct.Struct("<IHHiIII")
+_RECORD_HEADER = struct.Struct("<IIII")
+_IP_HEADER = struct.Struct("!BBHHHBBH4s4s")
+_UDP_HEADER = struct.Struct("!HHHH")
+
+def _ip_checksum(header):
+    total = sum(struct.unpack("!10H", header))
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def _ip_udp_headers(payload, src, dst):
+    """Build the IPv4 and UDP headers that wrap a captured payload."""
+    length = 20 + 8 + len(payload)
+    ip_header = _IP_HEADER.pack(0x45, 0, length, 0, 0, 64, socket.IPPROTO_UDP, 0,
+                                socket.inet_aton(src[0]), socket.inet_aton(dst[0]))
+    ip_header = ip_header[:10] + struct.pack("!H", _ip_checksum(ip_header)) + ip_header[12:]
+    return ip_header + _UDP_HEADER.pack(src[1], dst[1], 8 + len(payload), 0)
+
+class CaptureWriter:
+    """Append datagrams to a nanosecond pcap capture file."""
+
+    def __init__(self, path, local_address=("0.0.0.0", 0)):
+        self.path = path
+        self.local_address = local_address
+        self.count = 0
+        self.last_flush = time.monotonic()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(_GLOBAL_HEADER.pack(PCAP_MAGIC_NS, 2, 4, 0, 0, SNAPLEN, LINKTYPE_RAW))
+            self.file.flush()
+
+    def write(self, payload, src, timestamp_ns=None, dst=None):
+        """Append one datagram received from src at timestamp_ns (defaults to now)."""
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        frame = _ip_udp_headers(payload, src, dst or self.local_address) + payload
+        seconds, nanos = divmod(timestamp_ns, 1_000_000_000)
+        self.file.write(_RECORD_HEADER.pack(seconds, nanos, len(frame), len(frame)) + frame)
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0 or time.monotonic() - self.last_flush > FLUSH_INTERVAL:
+            self.file.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_capture(path):
+    """Yield (timestamp_ns, src, dst, payload) for every UDP datagram in a pcap file."""
+    with open(path, "rb") as file:
+        header = file.read(_GLOBAL_HEADER.size)
+        if len(header) < _GLOBAL_HEADER.size:
+            return
+        magic = struct.unpack("<I", header[:4])[0]
+        if magic in (PCAP_MAGIC_NS, PCAP_MAGIC_US):
+            endian = "<"
+        else:
+            endian = ">"
+            magic = struct.unpack(">I", header[:4])[0]
+        if magic not in (PCAP_MAGIC_NS, PCAP_MAGIC_US):
+            raise ValueError(f"{path} is not a pcap capture")
+        fraction = 1 if magic == PCAP_MAGIC_NS else 1000
+        linktype = struct.unpack(endian + "I", header[20:24])[0]
+        if linktype != LINKTYPE_RAW:
+            raise ValueError(f"{path} uses unsupported link type {linktype}")
+        record_header = struct.Struct(endian + "IIII")
+
+        while True:
+            raw = file.read(record_header.size)
+            if len(raw) < record_header.size:
+                return
+            seconds, sub, incl_len, _ = record_header.unpack(raw)
+            frame = file.read(incl_len)
+            if len(frame) < incl_len:
+                return  # Partial record at the end of a capture still being written
+            header_len = (frame[0] & 0x0F) * 4
+            if frame[0] >> 4 != 4 or frame[9] != socket.IPPROTO_UDP:
+                continue
+            src_port, dst_port = struct.unpack("!HH", frame[header_len:header_len + 4])
+            src = (socket.inet_ntoa(frame[12:16]), src_port)
+            dst = (socket.inet_ntoa(frame[16:20]), dst_port)
+            yield seconds * 1_000_000_000 + sub * fraction, src, dst, frame[header_len + 8:]
+
+def parse_speed(text):
+    """Parse a replay speed such as "1", "2x", "0.5X" or "FAST" (returns None for as fast as possible)."""
+    text = str(text).strip().lower()
+    if text in ("fast", "max", "0"):
+        return None
+    speed = float(text.rstrip("x"))
+    if speed <= 0:
+        raise ValueError("replay speed must be positive")
+    return speed
+
+def replay_capture(path, sock, address, speed=1.0, stop_event=None, on_packet=None, metrics=None):
+    """Send every payload of a capture to address, keeping the original timing scaled by speed.
+
+    speed=None sends as fast as possible. Packets are scheduled against
+    absolute deadlines, so sleep overshoot does not accumulate.
+    metrics is an optional udp_metrics.RunMetrics. Returns the number of
+    packets sent.
+    """
+    sent = 0
+    first_ts = None
+    start = time.perf_counter()
+    for timestamp_ns, src, dst, payload in read_capture(path):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if first_ts is None:
+            first_ts = timestamp_ns
+        if speed is not None:
+            deadline = start + (timestamp_ns - first_ts) / 1e9 / speed
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            if metrics is not None:
+                metrics.record_pacing(time.perf_counter() - deadline)
+        sent_at = time.perf_counter()
+        sock.sendto(payload, address)
+        if metrics is not None:
+            metrics.record_send(len(payload), time.perf_counter() - sent_at)
+        sent += 1
+        if on_packet is not None:
+            on_packet(payload, src)
+    return sent
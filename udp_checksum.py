@@ -0,0 +1,174 @@
+import re
+import zlib
+import binascii
+import numpy as np
+
+# Checksum fields for command files. A hex line may contain placeholders
+# that are filled when the command file is compiled into a plan:
+#
+#   A5 01 0203 {crc16}        CRC over every byte before the placeholder
+#   A5 01 0203 {crc32le:1}    little-endian, covering bytes 1.. onwards
+#
+# The same fields work inside #TEMPLATE lines, where they are computed for a
+# whole batch of packets at once (table lookups vectorized across packets).
+#
+# A checksum always covers the bytes that go on the wire: the GUI sends hex
+# lines as binary, the command line sender as ASCII text (see encode_line).
+#
+# Supported kinds:
+#   crc8         CRC-8 (poly 0x07, init 0x00)
+#   crc16        CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)
+#   crc16modbus  CRC-16/MODBUS (reflected poly 0xA001, init 0xFFFF)
+#   crc32        CRC-32 as used by zlib/Ethernet
+#   sum8         8-bit sum of all bytes
+#   xor8         8-bit XOR of all bytes
+
+_PLACEHOLDER_RE = re.compile(r"\{([^}]*)\}")
+
+def _table(poly, width, reflected):
+    """Build a 256-entry CRC lookup table."""
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        if reflected:
+            crc = byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        else:
+            crc = byte << (width - 8)
+            for _ in range(8):
+                crc = ((crc << 1) ^ poly) if crc & top else crc << 1
+        table.append(crc & mask)
+    return table
+
+# name: (width in bytes, poly, init, xorout, reflected)
+CHECKSUMS = {
+    "crc8": (1, 0x07, 0x00, 0x00, False),
+    "crc16": (2, 0x1021, 0xFFFF, 0x0000, False),
+    "crc16modbus": (2, 0xA001, 0xFFFF, 0x0000, True),
+    "crc32": (4, 0xEDB88320, 0xFFFFFFFF, 0xFFFFFFFF, True),
+    "sum8": (1, None, 0, 0, False),
+    "xor8": (1, None, 0, 0, False),
+}
+
+_TABLES = {
+    name: _table(poly, width * 8, reflected)
+    for name, (width, poly, init, xorout, reflected) in CHECKSUMS.items() if poly is not None
+}
+_NP_TABLES = {name: np.array(table, dtype=np.uint64) for name, table in _TABLES.items()}
+
+def checksum_size(kind):
+    """Return the width in bytes of a checksum kind."""
+    if kind not in CHECKSUMS:
+        raise ValueError(f"unknown checksum {kind!r}")
+    return CHECKSUMS[kind][0]
+
+def checksum(kind, data):
+    """Compute one checksum over a bytes-like object."""
+    width, poly, init, xorout, reflected = CHECKSUMS[kind]
+    if kind == "crc32":
+        return zlib.crc32(data)
+    if kind == "crc16":
+        return binascii.crc_hqx(data, init)
+    if kind == "sum8":
+        return sum(data) & 0xFF
+    if kind == "xor8":
+        value = 0
+        for byte in data:
+            value ^= byte
+        return value
+    table = _TABLES[kind]
+    crc = init
+    bits = width * 8
+    mask = (1 << bits) - 1
+    for byte in bytes(data):
+        if reflected:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        else:
+            crc = ((crc << 8) & mask) ^ table[((crc >> (bits - 8)) ^ byte) & 0xFF]
+    return crc ^ xorout
+
+def checksum_rows(kind, rows):
+    """Compute a checksum for every row of a (packets, bytes) uint8 array at once.
+
+    The table lookup runs once per byte column, vectorized across all packets.
+    """
+    width, poly, init, xorout, reflected = CHECKSUMS[kind]
+    if kind == "sum8":
+        return rows.sum(axis=1, dtype=np.uint64) & np.uint64(0xFF)
+    if kind == "xor8":
+        if rows.shape[1] == 0:
+            return np.zeros(rows.shape[0], dtype=np.uint64)
+        return np.bitwise_xor.reduce(rows, axis=1).astype(np.uint64)
+    table = _NP_TABLES[kind]
+    bits = width * 8
+    mask = np.uint64((1 << bits) - 1)
+    byte_mask = np.uint64(0xFF)
+    eight = np.uint64(8)
+    high_shift = np.uint64(bits - 8)
+    crc = np.full(rows.shape[0], init, dtype=np.uint64)
+    for column in range(rows.shape[1]):
+        data = rows[:, column].astype(np.uint64)
+        if reflected:
+            crc = (crc >> eight) ^ table[(crc ^ data) & byte_mask]
+        else:
+            crc = ((crc << eight) & mask) ^ table[((crc >> high_shift) ^ data) & byte_mask]
+    return crc ^ np.uint64(xorout)
+
+def parse_checksum_field(spec):
+    """Parse "kind[le][:start]" into a field dict, or return None if kind is not a checksum."""
+    parts = [p.strip() for p in spec.split(":")]
+    kind = parts[0].lower()
+    little = kind.endswith("le") and kind[:-2] in CHECKSUMS
+    if little:
+        kind = kind[:-2]
+    if kind not in CHECKSUMS:
+        return None
+    if len(parts) > 2:
+        raise ValueError(f"{kind} takes at most a START offset")
+    start = int(parts[1], 0) if len(parts) > 1 else 0
+    return {"kind": "checksum", "algorithm": kind, "size": checksum_size(kind), "little": little, "start": start}
+
+def encode_line(line, text=False):
+    """Return the payload of a hex command line, with {checksum} placeholders filled.
+
+    By default the line is sent as the bytes its hex digits spell. With
+    text, it is sent as written (ASCII, as the command line sender does) and
+    each checksum covers the transmitted characters before it, from the
+    character where byte START begins, and is inserted as hex digits.
+    Raises ValueError for malformed lines.
+    """
+    if "{" not in line:
+        return line.encode() if text else bytes.fromhex(line)
+    data = bytearray()
+    starts = []  # Offset in data where each payload byte begins (text: its first hex digit)
+    pos = 0
+
+    def add(segment):
+        if not text:
+            starts.extend(range(len(data), len(data) + len(bytes.fromhex(segment))))
+            data.extend(bytes.fromhex(segment))
+            return
+        bytes.fromhex(segment)  # Validate
+        digits = 0
+        for char in segment:
+            if not char.isspace():
+                if digits % 2 == 0:
+                    starts.append(len(data))
+                digits += 1
+            data.extend(char.encode())
+
+    for match in _PLACEHOLDER_RE.finditer(line):
+        add(line[pos:match.start()])
+        field = parse_checksum_field(match.group(1))
+        if field is None:
+            raise ValueError(f"unknown checksum field {{{match.group(1)}}}")
+        if field["start"] > len(starts):
+            raise ValueError(f"checksum start {field['start']} is past the end of the data")
+        begin = starts[field["start"]] if field["start"] < len(starts) else len(data)
+        value = checksum(field["algorithm"], bytes(data[begin:]))
+        add(value.to_bytes(field["size"], "little" if field["little"] else "big").hex().upper())
+        pos = match.end()
+    add(line[pos:])
+    return bytes(data)
@@ -0,0 +1,219 @@
+import time
+import socket
+import struct
+import argparse
+import threading
+
+import udp_suite
+
+# Clock synchronisation for stations that run the same script against
+# interconnected boards. One process (the coordinator, or a standalone
+# "python udp_clock.py serve") answers NTP-style requests over UDP and its
+# wall clock is the reference. Every participating run measures its offset
+# to it just before starting, waits for a common start deadline given in
+# reference time, and stamps its run log with reference time, so logs from
+# different stations line up.
+#
+# A measurement is SAMPLES request/reply exchanges; the one with the
+# smallest round trip is used (the usual NTP filter), which keeps queueing
+# delays out of the estimate. The offset is good to within half that round
+# trip, typically well under a millisecond on a lab network. Runs measure
+# again when they finish so slow drift over long runs can be corrected
+# afterwards.
+#
+#   python udp_clock.py serve [--port 9110]
+#   python udp_clock.py measure HOST[:PORT]
+
+DEFAULT_CLOCK_PORT = 9110
+SAMPLES = 16
+REPLY_TIMEOUT = 0.5  # Seconds to wait for each reply
+SPIN_SECONDS = 0.002  # The last part of a wait for a start deadline is spent polling, not sleeping
+SERVE_POLL = 0.2  # Seconds between stop checks of the server thread (closing a socket does not wake recvfrom)
+MAGIC = b"UCLK"
+REQUEST = struct.Struct("!4sd")  # magic, t1 (client send time)
+REPLY = struct.Struct("!4sddd")  # magic, t1, t2 (server receive time), t3 (server send time)
+
+class ClockError(Exception):
+    """The reference clock did not answer."""
+
+class ClockServer:
+    """Answers clock requests from a background thread; its wall clock is the reference."""
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_CLOCK_PORT):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Start answering; returns False (after printing why) if the port is busy."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind((self.host, self.port))
+        except OSError as e:
+            self.sock.close()
+            print(f"Clock server disabled: {e}")
+            return False
+        self.port = self.sock.getsockname()[1]
+        self.sock.settimeout(SERVE_POLL)
+        self.thread = threading.Thread(target=self._serve, name="clock-server", daemon=True)
+        self.thread.start()
+        return True
+
+    def _serve(self):
+        while not self.stopping.is_set():
+            try:
+                data, address = self.sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except ConnectionResetError:
+                continue  # ICMP port unreachable for an earlier reply (Windows)
+            except OSError:
+                return
+            received = time.time()
+            if len(data) != REQUEST.size:
+                continue
+            magic, sent = REQUEST.unpack(data)
+            if magic == MAGIC:
+                self.sock.sendto(REPLY.pack(MAGIC, sent, received, time.time()), address)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.sock is not None:
+            self.sock.close()
+
+def measure(server, samples=SAMPLES, timeout=REPLY_TIMEOUT):
+    """Return (offset, round trip) of this clock against the reference at server ("host:port" or (host, port)).
+
+    Reference time is local time.time() plus offset.
+    """
+    address = udp_suite.parse_target(server, DEFAULT_CLOCK_PORT)
+    best = None
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        for _ in range(samples):
+            t1 = time.time()
+            sock.sendto(REQUEST.pack(MAGIC, t1), address)
+            while True:
+                try:
+                    data = sock.recv(64)
+                except socket.timeout:
+                    data = None
+                    break
+                t4 = time.time()
+                if len(data) == REPLY.size:
+                    magic, echoed, t2, t3 = REPLY.unpack(data)
+                    if magic == MAGIC and echoed == t1:
+                        break  # Anything else is a late reply to an earlier request
+            if data is None:
+                continue
+            round_trip = (t4 - t1) - (t3 - t2)
+            if best is None or round_trip < best[1]:
+                best = (((t2 - t1) + (t3 - t4)) / 2, round_trip)
+    finally:
+        sock.close()
+    if best is None:
+        raise ClockError(f"no reply from clock server {address[0]}:{address[1]}")
+    return best
+
+class SyncedClock:
+    """Reference time on this station: the local clock corrected by a measured offset."""
+
+    def __init__(self, server, samples=SAMPLES):
+        self.server = server
+        self.reference = "%s:%d" % udp_suite.parse_target(server, DEFAULT_CLOCK_PORT)
+        self.samples = samples
+        self.offset, self.round_trip = measure(server, samples)
+        self.start_at = None
+        self.start_lateness = None
+        self.end_offset = None
+
+    def now(self):
+        return time.time() + self.offset
+
+    def stamp(self):
+        """Return the current reference time as a log prefix (seconds since the epoch, microseconds)."""
+        return f"{self.now():.6f}"
+
+    def wait_until(self, deadline, stop_event=None):
+        """Wait for the reference time deadline; returns how late it ended (negative if stopped early)."""
+        self.start_at = deadline
+        target = time.perf_counter() + (deadline - self.now())  # Monotonic from here on
+        while True:
+            remaining = target - time.perf_counter()
+            if remaining <= SPIN_SECONDS:
+                break
+            if stop_event is not None:
+                if stop_event.wait(min(remaining - SPIN_SECONDS, 0.5)):
+                    return -remaining
+            else:
+                time.sleep(remaining - SPIN_SECONDS)
+        while time.perf_counter() < target:
+            pass
+        self.start_lateness = time.perf_counter() - target
+        return self.start_lateness
+
+    def finish(self):
+        """Measure the offset again at the end of a run; drift shows as the difference."""
+        try:
+            self.end_offset = measure(self.server, self.samples)[0]
+        except (ClockError, OSError):
+            pass
+
+    def summary(self):
+        """Return the synchronisation details for the run summary."""
+        return {
+            "reference": self.reference,
+            "offset": round(self.offset, 9),
+            "error_bound": round(self.round_trip / 2, 9),
+            "start_at": self.start_at,
+            "start_lateness": None if self.start_lateness is None else round(self.start_lateness, 9),
+            "end_offset": None if self.end_offset is None else round(self.end_offset, 9),
+        }
+
+    def describe(self):
+        return (f"clock offset {self.offset * 1e3:+.3f} ms to {self.reference} "
+                f"(±{self.round_trip / 2 * 1e3:.3f} ms)")
+
+def local_address(peer):
+    """Return this machine's address on the route to peer ("host:port"), for agents to reach its clock server."""
+    host, port = udp_suite.parse_target(peer, DEFAULT_CLOCK_PORT)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect((host, port))  # No packet is sent; this only picks the route
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reference clock for synchronized multi-station runs.")
+    parser.add_argument("command", choices=("serve", "measure"))
+    parser.add_argument("server", nargs="?", help="HOST[:PORT] of the reference (measure)")
+    parser.add_argument("--port", type=int, default=DEFAULT_CLOCK_PORT, help="port to serve on")
+    args = parser.parse_args()
+    if args.command == "serve":
+        server = ClockServer(port=args.port)
+        if not server.start():
+            return
+        print(f"Reference clock on UDP port {server.port}; Ctrl+C stops")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+    if not args.server:
+        parser.error("measure needs the reference HOST[:PORT]")
+    try:
+        offset, round_trip = measure(args.server)
+    except (ClockError, OSError) as e:
+        print(e)
+        return
+    print(f"Offset {offset * 1e3:+.3f} ms, round trip {round_trip * 1e3:.3f} ms")
+
+if __name__ == "__main__":
+    main()
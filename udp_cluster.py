@@ -0,0 +1,390 @@
+import os
+import json
+import time
+import base64
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import udp_blobs
+import udp_clock
+import udp_plan
+import udp_retention
+import udp_suite
+
+# Coordinator for regressions spread over several lab workstations. Every
+# workstation runs an agent: the control API (udp_control.py) of a headless
+# sender started with --host 0.0.0.0, or of the GUI, which also captures
+# scopeshots. Each agent drives the boards on its own network segment.
+#
+# The coordinator splits a suite over all agents' targets the way "Send all
+# files" splits it over local ones (udp_suite.py), uploads the command
+# files each job needs and queues the jobs on the agents. As jobs finish,
+# every completed run is pulled back into the coordinator's results folder
+# under its usual "<timestamp>_<script>" names, so the run list, retention
+# and archive treat it like a local run; scopeshots go through the blob
+# store. A suite timing report covering all agents is written at the end.
+#
+# Agents come from --agent options or the "agents" entry of udp_config.json:
+#   "agents": [{"url": "10.0.1.5:9109", "targets": ["192.168.1.221:5005"]},
+#              {"url": "10.0.2.7:9109"}]      (no targets: the agent's own)
+#
+#   python udp_cluster.py [files...] [--agent URL[=TARGET,...]]... [--delay S] [--sync]
+#
+# With --sync, every script instead runs on all targets at the same time,
+# one script after another: this process serves the reference clock
+# (udp_clock.py), each run waits for a common start deadline, and run logs
+# are stamped with reference time so they can be compared across stations.
+#
+# Several agents on one machine (each in its own working directory and
+# port) are enough to try it out.
+
+CONFIG_FILE = "udp_config.json"
+POLL_INTERVAL = 1.0
+CHUNK_SIZE = 512 * 1024  # File bytes per upload call (the agent's fetch chunks are its own)
+RPC_TIMEOUT = 30.0
+FINISHED = ("done", "failed", "cancelled")
+SYNC_LEAD = 3.0  # Seconds from queuing a synchronized round to its common start
+
+class AgentError(Exception):
+    """An agent could not be reached or refused a call."""
+
+class Agent:
+    """A remote control API and the coordinator's bookkeeping for it."""
+
+    def __init__(self, url, targets=None):
+        self.url = (url if "://" in url else "http://" + url).rstrip("/")
+        self.targets = [udp_suite.parse_target(target) for target in targets or []]
+        self.since = 0.0  # Agent clock at the start of the suite
+        self.uploaded = set()
+        self.merged = set()
+        self.calls = 0
+
+    def call(self, method, **params):
+        """Make one JSON-RPC call and return its result."""
+        self.calls += 1
+        body = json.dumps({"jsonrpc": "2.0", "id": self.calls, "method": method, "params": params}).encode()
+        request = urllib.request.Request(self.url + "/rpc", body, {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=RPC_TIMEOUT) as response:
+                reply = json.load(response)
+        except (OSError, ValueError) as e:
+            raise AgentError(f"{self.url}: {e}")
+        if "error" in reply:
+            raise AgentError(f"{self.url}: {reply['error']['message']}")
+        return reply["result"]
+
+    def connect(self):
+        """Read the agent's clock (and its targets when none were given)."""
+        try:
+            with urllib.request.urlopen(self.url + "/health", timeout=RPC_TIMEOUT) as response:
+                health = json.load(response)
+        except (OSError, ValueError) as e:
+            raise AgentError(f"{self.url}: {e}")
+        self.since = health["time"]
+        if not self.targets:
+            self.targets = [udp_suite.parse_target(target) for target in health.get("targets", [])]
+
+    def upload(self, path, name):
+        """Copy a command file to the agent's commands folder as name, once per suite."""
+        if name in self.uploaded:
+            return
+        with open(path, "rb") as file:
+            offset = 0
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                self.call("upload", name=name, data=base64.b64encode(chunk).decode(), offset=offset)
+                offset += len(chunk)
+                if len(chunk) < CHUNK_SIZE:
+                    break
+        self.uploaded.add(name)
+
+    def fetch(self, name, dest):
+        """Copy a file from the agent's results folder to dest; returns its bytes for captures, else None."""
+        tmp = dest + ".part"
+        capture = name.lower().endswith(udp_blobs.IMAGE_EXTENSIONS)
+        data = bytearray()
+        with open(tmp, "wb") as file:
+            offset = 0
+            while True:
+                chunk = self.call("fetch", path=name, offset=offset)
+                block = base64.b64decode(chunk["data"])
+                offset += len(block)
+                if capture:
+                    data += block
+                else:
+                    file.write(block)
+                if chunk["eof"] or not block:
+                    break
+        if capture:
+            os.remove(tmp)
+            return bytes(data)
+        os.replace(tmp, dest)
+        return None
+
+def parse_agent(text):
+    """Parse a --agent value: "host:port" or "host:port=ip:port,ip:port"."""
+    url, _, targets = text.partition("=")
+    return Agent(url, [target for target in targets.split(",") if target])
+
+def load_agents(config_file=CONFIG_FILE):
+    """Return the agents listed in the config file."""
+    if not os.path.exists(config_file):
+        return []
+    with open(config_file, "r") as file:
+        config = json.load(file)
+    return [Agent(entry["url"], entry.get("targets")) for entry in config.get("agents", [])]
+
+def job_files(job_name, commands_folder):
+    """Return [(path, name in the commands folder)] for every file a job needs on an agent."""
+    root = os.path.realpath(commands_folder)
+    plan = udp_plan.open_plan(os.path.join(commands_folder, job_name), commands_folder)
+    files = []
+    for path in plan["deps"]:
+        name = os.path.relpath(path, root)
+        if name.startswith(os.pardir):
+            raise udp_plan.PlanError([f"{job_name}: {path} is outside {commands_folder} and cannot be sent to an agent"])
+        files.append((path, name.replace(os.sep, "/")))
+    return files
+
+def free_key(results_dir, key):
+    """Return key, or the first later millisecond with the same script that no local run uses.
+
+    Runs started together on different stations often share a key.
+    """
+    taken = {udp_retention.run_key(name) for name in os.listdir(results_dir)} if os.path.isdir(results_dir) else set()
+    stamp, script = udp_retention.RUN_RE.match(key).groups()
+    started = datetime.strptime(stamp, "%Y%m%d_%H%M%S_%f")
+    while key in taken:
+        started += timedelta(milliseconds=1)
+        key = f"{started.strftime('%Y%m%d_%H%M%S_%f')[:-3]}_{script}"
+    return key
+
+def merge_runs(agent, job_ids, results_dir, store, lock, log=print):
+    """Pull the agent's completed runs of job_ids not merged yet into results_dir; returns how many were merged.
+
+    Runs made on the agent outside those jobs (an operator's GUI runs) stay there.
+    """
+    merged = 0
+    for run in agent.call("runs", since=agent.since, jobs=sorted(job_ids)):
+        if run["key"] in agent.merged:
+            continue
+        with lock:  # Claim a free key before another agent's merge can
+            key = free_key(results_dir, run["key"])
+            os.makedirs(results_dir, exist_ok=True)
+            open(os.path.join(results_dir, f"{key}.part"), "w").close()
+        try:
+            for name in run["files"]:
+                dest = os.path.join(results_dir, key + name[len(run["key"]):])
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                data = agent.fetch(name, dest)
+                if data is not None:
+                    store.store(data, dest)
+        finally:
+            os.remove(os.path.join(results_dir, f"{key}.part"))
+        agent.merged.add(run["key"])
+        merged += 1
+        log(f"{agent.url}: merged run {run['key']}" + (f" as {key}" if key != run["key"] else ""))
+    return merged
+
+def drive_agent(agent, submissions, results_dir, stop_event, lock, log=print):
+    """Wait for an agent's jobs, merging its runs as they finish; returns the number of runs merged."""
+    store = udp_blobs.BlobStore(results_dir)
+    merged = 0
+    job_ids = {submission["id"] for submission in submissions}
+    pending = list(submissions)
+    while pending:
+        if stop_event.wait(POLL_INTERVAL):
+            for submission in pending:
+                try:
+                    agent.call("cancel", id=submission["id"])
+                except AgentError:
+                    pass
+                submission["state"] = "cancelled"
+            break
+        finished = False
+        for submission in list(pending):
+            job = agent.call("status", id=submission["id"])
+            if job["state"] in FINISHED:
+                submission.update(state=job["state"], error=job["error"], attempts=job["attempts"],
+                                  duration=round((job["finished"] or 0) - (job["started"] or 0), 6))
+                pending.remove(submission)
+                finished = True
+                log(f"{agent.url}: {submission['job']} on {submission['target']} {job['state']}")
+        if finished:
+            merged += merge_runs(agent, job_ids, results_dir, store, lock, log)
+    return merged + merge_runs(agent, job_ids, results_dir, store, lock, log)
+
+def connect_agents(agents, log=print):
+    """Return the agents that answer and have targets."""
+    reachable = []
+    for agent in agents:
+        try:
+            agent.connect()
+        except AgentError as e:
+            log(f"Skipping agent: {e}")
+            continue
+        if agent.targets:
+            reachable.append(agent)
+        else:
+            log(f"Skipping agent {agent.url}: no targets")
+    return reachable
+
+def upload_job(agent, job, commands_folder):
+    for path, name in job_files(job["name"], commands_folder):
+        agent.upload(path, name)
+
+def submit_job(agent, job, target, delay, **options):
+    """Queue a job on an agent; returns its submission record."""
+    ip, port = target
+    job_id = agent.call("submit", script=job["name"], target=f"{ip}:{port}", delay=delay, **options)["jobs"][0]
+    return {"agent": agent.url, "target": f"{ip}:{port}", "job": job["name"], "id": job_id,
+            "estimate": round(job.get("estimate", 0.0), 6), "state": "queued"}
+
+def drive_agents(submissions, results_dir, stop_event, problems, log=print):
+    """Wait for all submitted jobs, merging runs as they finish; returns the number of runs merged."""
+    merged = 0
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, len(submissions))) as pool:
+        futures = {pool.submit(drive_agent, agent, pending, results_dir, stop_event, lock, log): agent
+                   for agent, pending in submissions.items() if pending}
+        for future, agent in futures.items():
+            try:
+                merged += future.result()
+            except (AgentError, OSError) as e:
+                log(f"Lost agent {agent.url}: {e}")
+                problems.append(str(e))
+    return merged
+
+def write_report(agents, delay, job_results, problems, merged, wall, results_dir, **extra):
+    serial = sum(submission.get("duration", 0.0) for submission in job_results)
+    report = {
+        "agents": {agent.url: [f"{ip}:{port}" for ip, port in agent.targets] for agent in agents},
+        "delay": delay,
+        "jobs": job_results,
+        "problems": problems,
+        "runs_merged": merged,
+        "wall_time": round(wall, 6),
+        "serial_time": round(serial, 6),
+        "speedup": round(serial / wall, 3) if wall > 0 else None,
+        **extra,
+    }
+    report["report_path"] = udp_suite.write_timing_report(report, results_dir)
+    return report
+
+def run_cluster(files, agents, delay, commands_folder=udp_suite.COMMANDS_FOLDER, results_dir=udp_suite.RESULTS_DIR,
+                stop_event=None, log=print):
+    """Run a suite over the agents' targets and merge the results; returns the timing report."""
+    stop_event = stop_event or threading.Event()
+    reachable = connect_agents(agents, log)
+    jobs, problems = udp_suite.build_jobs(files, commands_folder)
+    lanes = udp_suite.assign_lanes(jobs, [(agent, target) for agent in reachable for target in agent.targets],
+                                   delay, commands_folder)
+
+    t0 = time.perf_counter()
+    submissions = {agent: [] for agent in reachable}
+    for lane in lanes:
+        agent, target = lane["target"]
+        for job in lane["jobs"]:  # Queued in lane order, so they run in that order on the target
+            try:
+                upload_job(agent, job, commands_folder)
+                submissions[agent].append(submit_job(agent, job, target, delay))
+            except (udp_plan.PlanError, AgentError, OSError) as e:
+                problems.extend(getattr(e, "problems", None) or [f"{job['name']}: {e}"])
+    for problem in problems:
+        log(f"Not run: {problem}")
+
+    merged = drive_agents(submissions, results_dir, stop_event, problems, log)
+    job_results = [submission for agent in reachable for submission in submissions[agent]]
+    return write_report(reachable, delay, job_results, problems, merged, time.perf_counter() - t0, results_dir)
+
+def run_synchronized(files, agents, delay, lead=SYNC_LEAD, clock_port=udp_clock.DEFAULT_CLOCK_PORT,
+                     commands_folder=udp_suite.COMMANDS_FOLDER, results_dir=udp_suite.RESULTS_DIR, stop_event=None, log=print):
+    """Run each job on every target at once, one job after another, from common start deadlines.
+
+    This process serves the reference clock; every run's log is stamped
+    with it, so the merged logs of one round can be compared directly.
+    Returns the timing report.
+    """
+    stop_event = stop_event or threading.Event()
+    reachable = connect_agents(agents, log)
+    jobs, problems = udp_suite.build_jobs(files, commands_folder)
+    clock = udp_clock.ClockServer(port=clock_port)
+    if not clock.start():
+        return write_report(reachable, delay, [], problems + ["clock server could not start"], 0, 0.0, results_dir)
+    # Each agent reaches the clock at this machine's address on its own route
+    clocks = {agent: f"{udp_clock.local_address(urllib.parse.urlsplit(agent.url).hostname)}:{clock.port}"
+              for agent in reachable}
+
+    t0 = time.perf_counter()
+    job_results = []
+    merged = 0
+    try:
+        for job in jobs:
+            if stop_event.is_set():
+                break
+            submissions = {agent: [] for agent in reachable}
+            try:
+                for agent in reachable:
+                    upload_job(agent, job, commands_folder)
+                start_at = time.time() + lead  # Reference time: this machine's clock
+                for agent in reachable:
+                    for target in agent.targets:
+                        submissions[agent].append(submit_job(agent, job, target, delay, clock=clocks[agent], start_at=start_at))
+                log(f"{job['name']}: {sum(map(len, submissions.values()))} runs start at "
+                    f"{datetime.fromtimestamp(start_at).strftime('%H:%M:%S.%f')[:-3]}")
+            except (udp_plan.PlanError, AgentError, OSError) as e:
+                problems.extend(getattr(e, "problems", None) or [f"{job['name']}: {e}"])
+            merged += drive_agents(submissions, results_dir, stop_event, problems, log)
+            job_results.extend(submission for pending in submissions.values() for submission in pending)
+    finally:
+        clock.stop()
+    for problem in problems:
+        log(f"Problem: {problem}")
+    return write_report(reachable, delay, job_results, problems, merged, time.perf_counter() - t0, results_dir,
+                        synchronized={"lead": lead, "clock_port": clock.port})
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a command suite on remote agents and merge their results.")
+    parser.add_argument("files", nargs="*", help="command files (default: every file in the commands folder)")
+    parser.add_argument("--agent", action="append", default=[], help='"host:port" or "host:port=ip:port,ip:port"')
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds between commands")
+    parser.add_argument("--sync", action="store_true", help="run each script on all targets from a common start")
+    parser.add_argument("--lead", type=float, default=SYNC_LEAD, help="seconds from queuing to a synchronized start")
+    parser.add_argument("--clock-port", type=int, default=udp_clock.DEFAULT_CLOCK_PORT)
+    parser.add_argument("--commands", default=udp_suite.COMMANDS_FOLDER)
+    parser.add_argument("--results", default=udp_suite.RESULTS_DIR)
+    args = parser.parse_args()
+
+    agents = [parse_agent(text) for text in args.agent] or load_agents()
+    if not agents:
+        print('No agents: pass --agent or list them under "agents" in udp_config.json')
+        return
+    files = args.files or sorted(name for name in os.listdir(args.commands) if os.path.isfile(os.path.join(args.commands, name)))
+    stop_event = threading.Event()
+    reports = []
+    if args.sync:
+        run = lambda: run_synchronized(files, agents, args.delay, args.lead, args.clock_port, args.commands, args.results, stop_event)
+    else:
+        run = lambda: run_cluster(files, agents, args.delay, args.commands, args.results, stop_event)
+    worker = threading.Thread(target=lambda: reports.append(run()))
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        print("Stopping: cancelling queued jobs on the agents")
+        stop_event.set()
+        worker.join()
+    if reports:
+        report = reports[0]
+        failed = sum(1 for job in report["jobs"] if job["state"] != "done")
+        print(f"{len(report['jobs'])} jobs on {len(report['agents'])} agents, {failed} not done, "
+              f"{report['runs_merged']} runs merged in {report['wall_time']:.1f}s "
+              f"(speedup {report['speedup']}x); report: {report['report_path']}")
+
+if __name__ == "__main__":
+    main()
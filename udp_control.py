@@ -0,0 +1,445 @@
+import os
+import json
+import base64
+import time
+import asyncio
+import argparse
+import threading
+
+import udp_metrics
+import udp_blobs
+import udp_queue
+import udp_retention
+import udp_suite
+
+# Local control API for automation. Runs submitted here go into the
+# persistent job queue (udp_queue.py) and are started by its scheduler, in
+# the GUI or headless (python udp_control.py). The server runs its own
+# asyncio loop on a background thread, so any number of status polls and
+# event streams never compete with the send engine for a thread.
+#
+#   POST /rpc      JSON-RPC 2.0, single calls or batches:
+#                    submit        {"script", "targets", "delay", "pacing", "priority", "at", "retries", "instrument",
+#                                   "clock", "start_at"}  (clock + start_at: synchronized start, see udp_clock.py)
+#                    submit_batch  {"runs": [<submit params>, ...]}
+#                    status        {"id"}
+#                    list          {"states": [...]}
+#                    cancel        {"id"}
+#                    stats         {}
+#                  and, for a coordinator driving this machine as an agent
+#                  (udp_cluster.py):
+#                    upload        {"name", "data", "offset"}  a command file chunk, base64
+#                    runs          {"since", "jobs"}           completed runs started since then (of those job ids)
+#                    fetch         {"path", "offset"}          a results file chunk, base64
+#   GET /events    server-sent events: "job" (started / done / retry / failed),
+#                  "log" (scheduler log lines), "run_log" (the log lines of
+#                  each run, with its job id) and "progress" (packets sent)
+#   GET /health    {"ok": true, "time": <this machine's clock>, "targets": <default targets>}
+#
+# It listens on 127.0.0.1 unless given another address (--host for agents
+# on the lab network); anything that can reach it can start runs.
+
+DEFAULT_CONTROL_PORT = 9109
+MAX_BODY = 1024 * 1024  # Largest request body accepted
+SUBSCRIBER_BACKLOG = 1000  # Events buffered per event stream; the oldest are dropped for slow readers
+KEEPALIVE_SECONDS = 15.0
+PROGRESS_INTERVAL = 1.0
+CHUNK_SIZE = 512 * 1024  # File bytes per upload / fetch call
+
+PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INVALID_PARAMS, SERVER_ERROR = -32700, -32600, -32601, -32602, -32000
+
+def _total(counter):
+    """Return the sum of a counter over all its labels."""
+    with counter.lock:
+        return sum(counter.values.values())
+
+class RpcError(Exception):
+    """A JSON-RPC error reply."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class EventBus:
+    """Fans events out to event-stream subscribers; publish() may be called from any thread."""
+
+    def __init__(self):
+        self.loop = None
+        self.subscribers = set()
+        self.last_id = 0
+
+    def publish(self, kind, **data):
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._deliver, kind, data)
+
+    def _deliver(self, kind, data):
+        self.last_id += 1
+        event = (self.last_id, kind, data)
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+class ControlServer:
+    """The HTTP control endpoint; submissions are queued in job_queue.
+
+    defaults supplies "targets" and "delay" for submissions that leave
+    them out.
+    """
+
+    def __init__(self, job_queue, defaults, port=DEFAULT_CONTROL_PORT, host="127.0.0.1",
+                 commands_folder=udp_suite.COMMANDS_FOLDER, results_dir=udp_suite.RESULTS_DIR):
+        self.job_queue = job_queue
+        self.defaults = defaults
+        self.host = host
+        self.port = port
+        self.commands_folder = commands_folder
+        self.results_dir = results_dir
+        self.bus = EventBus()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.methods = {
+            "submit": self.submit, "submit_batch": self.submit_batch, "status": self.status,
+            "list": self.list_jobs, "cancel": self.cancel, "stats": self.stats,
+            "upload": self.upload, "runs": self.runs, "fetch": self.fetch,
+        }
+
+    # Scheduler hooks (called from its threads)
+
+    def log(self, text):
+        self.bus.publish("log", text=text, time=time.time())
+
+    def run_log(self, job, text):
+        self.bus.publish("run_log", id=job["id"], text=text, time=time.time())
+
+    def job_changed(self, job, state, seconds):
+        self.bus.publish("job", id=job["id"], state=state, script=job["script"], target=job["target"],
+                         attempt=job["attempts"], seconds=round(seconds, 6), error=job.get("error"))
+
+    # RPC methods (run on a worker thread of the event loop)
+
+    def submit(self, script, targets=None, target=None, delay=None, pacing=None, priority=0, at=None, retries=0,
+               instrument=None, clock=None, start_at=None):
+        path = script if os.path.exists(script) else os.path.join(self.commands_folder, script)
+        if not os.path.isfile(path):
+            raise RpcError(INVALID_PARAMS, f"script {script!r} not found")
+        if pacing not in (None, "fixed", "adaptive"):
+            raise RpcError(INVALID_PARAMS, 'pacing must be "fixed" or "adaptive"')
+        targets = [target] if target else (targets or self.defaults["targets"])
+        if not targets:
+            raise RpcError(INVALID_PARAMS, "no targets given and none configured")
+        delay = self.defaults["delay"] if delay is None else float(delay)
+        not_before = udp_queue.parse_start(at) if at else None
+        if (clock is None) != (start_at is None):
+            raise RpcError(INVALID_PARAMS, "clock and start_at go together")
+        start_at = None if start_at is None else float(start_at)
+        options = {key: value for key, value in (("pacing", pacing), ("clock", clock), ("start_at", start_at)) if value}
+        ids = [self.job_queue.submit(path, target, delay, int(priority), not_before, int(retries) + 1, instrument, options or None)
+               for target in targets]
+        return {"jobs": ids}
+
+    def submit_batch(self, runs):
+        results = []
+        for params in runs:
+            try:
+                results.append(self.submit(**params))
+            except RpcError as e:
+                results.append({"error": str(e)})
+            except (TypeError, ValueError) as e:
+                results.append({"error": f"invalid params: {e}"})
+        return results
+
+    def status(self, id):
+        job = self.job_queue.get(int(id))
+        if job is None:
+            raise RpcError(INVALID_PARAMS, f"no job {id}")
+        return job
+
+    def list_jobs(self, states=None):
+        return self.job_queue.jobs(states)
+
+    def cancel(self, id):
+        return {"cancelled": self.job_queue.cancel(int(id))}
+
+    def stats(self):
+        return self.job_queue.stats()
+
+    @staticmethod
+    def _inside(folder, name):
+        """Return folder/name, refusing names that lead outside folder."""
+        root = os.path.realpath(folder)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.isabs(name) or not path.startswith(root + os.sep):
+            raise RpcError(INVALID_PARAMS, f"{name!r} is outside {folder}")
+        return path
+
+    def upload(self, name, data, offset=0):
+        """Write a chunk of a command file; offset 0 starts the file over."""
+        path = self._inside(self.commands_folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "r+b" if offset else "wb") as file:
+            file.seek(offset)
+            file.write(base64.b64decode(data))
+        return {"size": os.path.getsize(path)}
+
+    def runs(self, since=0.0, jobs=None):
+        """Return the completed runs started at or after since (this machine's clock) with their files.
+
+        With jobs (a list of job ids), only the runs of those queue jobs are
+        returned, not other runs made on this machine meanwhile. A run is
+        complete once its _summary file is written; file names are relative
+        to the results folder.
+        """
+        runs = []
+        for run in udp_retention.scan_runs(self.results_dir):
+            names = {os.path.basename(path) for path in run["paths"]}
+            summary = f"{run['key']}_summary.json"
+            if run["started"].timestamp() < int(since) or summary not in names:
+                continue
+            if jobs is not None and self._run_job(os.path.join(self.results_dir, summary)) not in jobs:
+                continue
+            files = []
+            for path in run["paths"]:
+                if os.path.isdir(path):
+                    files.extend(os.path.join(os.path.basename(path), name) for name in udp_blobs.list_captures(path, "")
+                                 if name != udp_blobs.CATALOG_FILE)
+                else:
+                    files.append(os.path.basename(path))
+            runs.append({"key": run["key"], "files": sorted(files)})
+        return runs
+
+    @staticmethod
+    def _run_job(summary_path):
+        try:
+            with open(summary_path) as file:
+                return json.load(file).get("job")
+        except (OSError, ValueError):
+            return None
+
+    def fetch(self, path, offset=0):
+        """Return a chunk of a results file (captures only kept in the blob store included)."""
+        full = self._inside(self.results_dir, path)
+        folder, name = os.path.split(full)
+        with open(udp_blobs.resolve(self.results_dir, folder, name), "rb") as file:
+            file.seek(offset)
+            data = file.read(CHUNK_SIZE)
+            eof = file.tell() >= os.fstat(file.fileno()).st_size
+        return {"data": base64.b64encode(data).decode(), "eof": eof}
+
+    # JSON-RPC
+
+    def _call(self, request):
+        """Run one JSON-RPC request object; returns the response object (None for notifications)."""
+        request_id = request.get("id") if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                raise RpcError(INVALID_REQUEST, "invalid request")
+            method = self.methods.get(request["method"])
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"unknown method {request['method']}")
+            params = request.get("params") or {}
+            try:
+                result = method(*params) if isinstance(params, list) else method(**params)
+            except (TypeError, ValueError, KeyError) as e:
+                raise RpcError(INVALID_PARAMS, f"invalid params: {e}")
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RpcError as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": SERVER_ERROR, "message": str(e)}}
+        if isinstance(request, dict) and "id" not in request:
+            return None  # Notification
+        return response
+
+    def handle_rpc(self, body):
+        """Return the JSON-RPC response for a request body (a single call or a batch), or None."""
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": "parse error"}}
+        if isinstance(request, list):
+            if not request:
+                return {"jsonrpc": "2.0", "id": None, "error": {"code": INVALID_REQUEST, "message": "empty batch"}}
+            responses = [response for response in map(self._call, request) if response is not None]
+            return responses or None
+        return self._call(request)
+
+    # HTTP
+
+    async def _respond(self, writer, status, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return await self._respond(writer, "400 Bad Request")
+            method, path = request_line[0], request_line[1].split("?")[0]
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY:
+                return await self._respond(writer, "413 Payload Too Large")
+            body = await reader.readexactly(length) if length else b""
+            if method == "POST" and path == "/rpc":
+                response = await asyncio.get_running_loop().run_in_executor(None, self.handle_rpc, body)
+                if response is None:
+                    return await self._respond(writer, "204 No Content")
+                return await self._respond(writer, "200 OK", response)
+            if method == "GET" and path == "/events":
+                return await self._stream_events(writer)
+            if method == "GET" and path == "/health":
+                health = {"ok": True, "time": time.time(), "targets": self.defaults["targets"]}
+                return await self._respond(writer, "200 OK", health)
+            await self._respond(writer, "404 Not Found")
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_events(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        queue = self.bus.subscribe()
+        try:
+            while True:
+                try:
+                    event_id, kind, data = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                    writer.write(f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n".encode())
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                await writer.drain()
+        finally:
+            self.bus.unsubscribe(queue)
+
+    async def _progress(self):
+        """Publish the packet counters once a second while anyone is listening and they change."""
+        last = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if not self.bus.subscribers:
+                continue
+            packets, sent = _total(udp_metrics.PACKETS_SENT), _total(udp_metrics.BYTES_SENT)
+            if packets != last:
+                last = packets
+                self.bus.publish("progress", packets_sent=packets, bytes_sent=sent)
+
+    def _serve(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bus.loop = self.loop
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            started.error = e
+            started.set()
+            self.loop.close()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]  # The real port when 0 was asked for
+        self.loop.create_task(self._progress())
+        started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)  # The progress task and open event streams
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def start(self):
+        """Start serving on a background thread; returns False (after printing why) if the port is busy."""
+        started = threading.Event()
+        started.error = None
+        self.thread = threading.Thread(target=self._serve, args=(started,), name="control-api", daemon=True)
+        self.thread.start()
+        started.wait()
+        if started.error is not None:
+            print(f"Control API disabled: {started.error}")
+            return False
+        return True
+
+    def stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
+
+def start_control(job_queue, send_file, defaults, port=DEFAULT_CONTROL_PORT, limits=None,
+                  max_workers=udp_suite.DEFAULT_MAX_WORKERS, log=print, host="127.0.0.1"):
+    """Start the control API and a scheduler that runs what it queues; returns (server, scheduler).
+
+    server is None when the port is busy; the scheduler runs either way.
+    send_file must accept a log keyword (see udp_queue.Scheduler) when the
+    server runs.
+    """
+    server = ControlServer(job_queue, defaults, port, host)
+    if not server.start():
+        server = None
+
+    def log_both(text):
+        log(text)
+        if server is not None:
+            server.log(text)
+
+    scheduler = udp_queue.Scheduler(job_queue, send_file, limits, max_workers, log_both,
+                                    server.job_changed if server is not None else None,
+                                    server.run_log if server is not None else None)
+    scheduler.start()
+    return server, scheduler
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless control API: runs submitted over HTTP go through the job queue.")
+    parser.add_argument("--port", type=int, default=DEFAULT_CONTROL_PORT)
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (0.0.0.0 for a lab agent)")
+    parser.add_argument("--db", default=udp_queue.QUEUE_DB, help="queue database")
+    args = parser.parse_args()
+
+    import UDP_sender_v7 as sender  # The send engine and the CLI's saved settings
+    sender.ascii_header = ""
+    config = sender.load_config() or {}
+    metrics_port = config.get("metrics_port", udp_metrics.DEFAULT_METRICS_PORT)
+    if metrics_port:
+        udp_metrics.start_metrics_server(int(metrics_port))
+    targets = sender.load_targets(config["udp_ip"], config["udp_port"]) if config.get("udp_ip") else []
+    defaults = {"targets": [f"{ip}:{port}" for ip, port in targets], "delay": sender.load_delay()}
+    if not targets:
+        print("No saved target: every submission must name its targets")
+    job_queue = udp_queue.JobQueue(args.db)
+    server, scheduler = start_control(job_queue, sender.send_queued_job, defaults, args.port,
+                                      config.get("queue_limits"), sender.load_max_workers(), host=args.host)
+    if server is None:
+        scheduler.stop()
+        return
+    print(f"Control API on http://{args.host}:{server.port}/rpc (events: /events); Ctrl+C stops")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        print("Stopping: waiting for running jobs to finish (queued jobs stay queued)")
+    scheduler.stop()
+    server.stop()
+    job_queue.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import re
+import sys
+import json
+import random
+import signal
+import asyncio
+import argparse
+
+import udp_capture
+import udp_checksum
+import udp_expect
+import udp_seq
+
+# Scriptable stand-in DUT: the receiver grown into a simulated device server.
+# One asyncio process serves any number of virtual devices, one UDP port
+# each, replying to payload patterns with canned or computed replies and
+# injecting latency, jitter, drops and reordering.
+#
+#   python udp_dut_sim.py dut_sim.json
+#   python udp_dut_sim.py --port 30206 --devices 1000 --latency 2 --jitter 1 --drop 0.01
+#
+# Config (all keys optional; command line options override them):
+#   {
+#     "host": "127.0.0.1", "port": 30206, "devices": 4,
+#     "latency_ms": 0, "jitter_ms": 0, "drop": 0.0, "reorder": 0.0, "seed": null,
+#     "record": "captures/dut.pcap",
+#     "rules": [
+#       {"match": "AABB*", "reply": "06 {device:2} {crc16}"},
+#       {"match": "DEADBEEF", "reply": null},
+#       {"match": "*", "reply": "{echo}"}
+#     ]
+#   }
+#
+# Patterns are hex with "??" for any byte and "*" for any run of bytes; the
+# first matching rule wins. Replies are hex with placeholders: {echo} (the
+# request), {device:N} (device index), {count:N} (packets this device has
+# received) and any checksum field from udp_checksum.py. A null reply
+# swallows the request.
+
+DEFAULT_RULES = [{"match": "*", "reply": "{echo}"}]
+_REPLY_TOKEN_RE = re.compile(r"\{(echo|device|count)(?::(\d+))?\}")
+
+def compile_rules(rules):
+    """Return [(regex, reply template or None, static reply bytes or None)] for a list of rule dicts."""
+    compiled = []
+    for rule in rules:
+        reply = rule.get("reply")
+        static = None
+        if reply is not None:
+            render_reply(reply, b"", 0, 0)  # Validate the template up front
+            if "{" not in reply:
+                static = bytes.fromhex(reply)
+        compiled.append((udp_expect.compile_pattern(rule["match"]), reply, static))
+    return compiled
+
+def render_reply(template, request, device, count):
+    """Build a reply payload from a hex template for one request."""
+    def substitute(match):
+        name, size = match.group(1), match.group(2)
+        if name == "echo":
+            return request.hex()
+        value = device if name == "device" else count
+        size = int(size or 2)
+        return (value % (1 << (8 * size))).to_bytes(size, "big").hex()
+
+    return udp_checksum.encode_line(_REPLY_TOKEN_RE.sub(substitute, template))
+
+class VirtualDevice(asyncio.DatagramProtocol):
+    """One simulated board listening on its own UDP port."""
+
+    def __init__(self, sim, index):
+        self.sim = sim
+        self.index = index
+        self.transport = None
+        self.received = 0
+        self.replied = 0
+        self.dropped = 0
+        self.streams = udp_seq.StreamTracker()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        sim = self.sim
+        if sim.recorder:
+            sim.recorder.write(data, addr, dst=self.transport.get_extra_info("sockname"))
+        if data[:2] == udp_seq.MAGIC or data[-udp_seq.STAMP_SIZE:-udp_seq.STAMP_SIZE + 2] == udp_seq.MAGIC:
+            data = self.streams.add(data, addr)  # Match rules against the unstamped payload
+        for pattern, reply, static in sim.rules:
+            if pattern.fullmatch(data):
+                break
+        else:
+            return
+        if reply is None:
+            return
+        if sim.random.random() < sim.drop:
+            self.dropped += 1
+            return
+        if static is not None:
+            payload = static
+        elif reply == "{echo}":
+            payload = data
+        else:
+            payload = render_reply(reply, data, self.index, self.received)
+        delay = sim.latency + sim.random.uniform(-sim.jitter, sim.jitter)
+        if sim.random.random() < sim.reorder:
+            delay += sim.latency + 2 * sim.jitter + 0.001  # Hold back so later replies overtake it
+        self.replied += 1
+        if delay <= 0:
+            self.transport.sendto(payload, addr)
+        else:
+            sim.loop.call_later(delay, self.transport.sendto, payload, addr)
+
+class DutSimulator:
+    """Runs a set of virtual devices on consecutive ports in one event loop."""
+
+    def __init__(self, host="127.0.0.1", port=30206, devices=1, latency_ms=0.0, jitter_ms=0.0,
+                 drop=0.0, reorder=0.0, seed=None, rules=None, record=None):
+        self.host = host
+        self.port = port
+        self.device_count = devices
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.drop = drop
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.rules = compile_rules(rules or DEFAULT_RULES)
+        self.recorder = udp_capture.CaptureWriter(record) if record else None
+        self.devices = []
+        self.loop = None
+
+    async def start(self):
+        """Open one UDP endpoint per virtual device."""
+        self.loop = asyncio.get_running_loop()
+        for index in range(self.device_count):
+            device = VirtualDevice(self, index)
+            await self.loop.create_datagram_endpoint(lambda device=device: device, local_addr=(self.host, self.port + index))
+            self.devices.append(device)
+
+    def stop(self):
+        for device in self.devices:
+            if device.transport:
+                device.transport.close()
+        if self.recorder:
+            self.recorder.close()
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "received": sum(d.received for d in self.devices),
+            "replied": sum(d.replied for d in self.devices),
+            "dropped": sum(d.dropped for d in self.devices),
+        }
+
+    def loss_report(self):
+        """Return per-device loss reports for every sequence-stamped stream."""
+        return {str(self.port + d.index): d.streams.report() for d in self.devices if d.streams.streams}
+
+def load_sim_config(path):
+    """Load simulator settings from a JSON file."""
+    with open(path, "r") as file:
+        return json.load(file)
+
+async def serve(config):
+    sim = DutSimulator(**config)
+    await sim.start()
+    print(f"Simulating {sim.device_count} devices on {sim.host}:{sim.port}-{sim.port + sim.device_count - 1}")
+    stop_event = asyncio.Event()
+    try:
+        sim.loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+    except (NotImplementedError, AttributeError):
+        pass  # No asyncio signal handlers on Windows; Ctrl+C still works
+    try:
+        await stop_event.wait()
+    finally:
+        sim.stop()
+        print(f"Simulator stats: {sim.stats()}")
+        loss = sim.loss_report()
+        if loss:
+            print(f"Sequence loss report: {json.dumps(loss, indent=4)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated UDP devices for load and correctness testing.")
+    parser.add_argument("config", nargs="?", help="JSON config file")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, help="first device port")
+    parser.add_argument("--devices", type=int, help="number of virtual devices")
+    parser.add_argument("--latency", type=float, dest="latency_ms", help="reply latency in ms")
+    parser.add_argument("--jitter", type=float, dest="jitter_ms", help="+/- jitter in ms")
+    parser.add_argument("--drop", type=float, help="reply drop probability")
+    parser.add_argument("--reorder", type=float, help="reply reorder probability")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--record", help="append received traffic to this pcap")
+    args = parser.parse_args()
+
+    config = load_sim_config(args.config) if args.config else {}
+    for key, value in vars(args).items():
+        if key != "config" and value is not None:
+            config[key] = value
+    try:
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Simulator error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
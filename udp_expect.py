@@ -0,0 +1,136 @@
+import re
+import time
+import select
+from collections import deque
+
+# Event-driven waits for command files, in place of fixed sleeps:
+#
+#   #EXPECT 06 ?? 00 * TIMEOUT 200ms          wait for a matching reply
+#   #WAIT_QUIET 50ms [TIMEOUT 5s]              wait until nothing arrives for 50 ms
+#
+# Patterns are hex with "??" for any byte and "*" for any run of bytes (the
+# same syntax as the simulator rules), compiled once into a bytes regex.
+# Replies are read from the send socket without blocking the sender: at an
+# #EXPECT every datagram that arrived since the previous wait is examined
+# first, then the socket is polled until the deadline.
+
+DEFAULT_EXPECT_TIMEOUT = 1.0  # Seconds
+DEFAULT_QUIET_TIMEOUT = 10.0  # Longest #WAIT_QUIET before giving up
+_DURATION_RE = re.compile(r"^([0-9]*\.?[0-9]+)\s*(us|ms|s)?$", re.IGNORECASE)
+_UNITS = {"us": 1e-6, "ms": 1e-3, "s": 1.0, None: 1.0}
+
+def compile_pattern(pattern):
+    """Compile a hex pattern with ?? and * wildcards into a bytes regex."""
+    parts = []
+    text = pattern.replace(" ", "")
+    i = 0
+    while i < len(text):
+        if text[i] == "*":
+            parts.append(b".*")
+            i += 1
+        elif text[i:i + 2] == "??":
+            parts.append(b".")
+            i += 2
+        else:
+            parts.append(re.escape(bytes.fromhex(text[i:i + 2])))
+            i += 2
+    return re.compile(b"".join(parts), re.DOTALL)
+
+def parse_duration(text):
+    """Parse "200ms", "50us", "1.5s" or a bare number of seconds."""
+    match = _DURATION_RE.match(text.strip())
+    if not match:
+        raise ValueError(f"bad duration {text!r}")
+    return float(match.group(1)) * _UNITS[match.group(2).lower() if match.group(2) else None]
+
+def _split_timeout(parts, default):
+    if len(parts) >= 2 and parts[-2].upper() == "TIMEOUT":
+        return parts[:-2], parse_duration(parts[-1])
+    return parts, default
+
+def parse_expect(line):
+    """Parse "#EXPECT <hex pattern> [TIMEOUT <duration>]" into a dict with a compiled pattern."""
+    parts, timeout = _split_timeout(line.split()[1:], DEFAULT_EXPECT_TIMEOUT)
+    text = " ".join(parts)
+    if not text:
+        raise ValueError("missing reply pattern")
+    return {"text": text, "pattern": compile_pattern(text), "timeout": timeout}
+
+def parse_wait_quiet(line):
+    """Parse "#WAIT_QUIET <duration> [TIMEOUT <duration>]"."""
+    parts, timeout = _split_timeout(line.split()[1:], DEFAULT_QUIET_TIMEOUT)
+    if len(parts) != 1:
+        raise ValueError("expected one quiet duration")
+    return {"quiet": parse_duration(parts[0]), "timeout": timeout}
+
+class Receiver:
+    """Non-blocking reader of replies on the send socket.
+
+    inbox holds datagrams that other readers of the same socket (the
+    adaptive pacer) already took off it, so waits still see them.
+    """
+
+    def __init__(self, sock, inbox=None):
+        self.sock = sock
+        self.inbox = inbox if inbox is not None else deque(maxlen=4096)
+
+    def _poll(self, timeout):
+        """Move every datagram that arrives within timeout seconds into the inbox; return True if any did."""
+        readable, _, _ = select.select([self.sock], [], [], max(0.0, timeout))
+        if not readable:
+            return False
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(65535)  # Only called once select() reported data
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return True  # ICMP errors from an earlier send; nothing to read
+            self.inbox.append(data)
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return True
+
+    def expect(self, pattern, timeout):
+        """Wait for a datagram matching pattern; return (matched data or None, seconds waited, datagrams skipped)."""
+        start = time.perf_counter()
+        deadline = start + timeout
+        skipped = 0
+        self._poll(0)
+        while True:
+            while self.inbox:
+                data = self.inbox.popleft()
+                if pattern.fullmatch(data):
+                    return data, time.perf_counter() - start, skipped
+                skipped += 1
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None, time.perf_counter() - start, skipped
+            self._poll(remaining)
+
+    def wait_quiet(self, quiet, timeout):
+        """Wait until no datagram arrived for quiet seconds; return (True if it went quiet, seconds waited, datagrams seen)."""
+        start = time.perf_counter()
+        deadline = start + timeout
+        seen = 0
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return False, now - start, seen
+            window = min(quiet, deadline - now)
+            arrived = self._poll(window)
+            seen += len(self.inbox)
+            self.inbox.clear()  # Traffic during a quiet wait is not waited for later
+            if not arrived and window >= quiet:
+                return True, time.perf_counter() - start, seen
+
+def describe(op, arg, result):
+    """Return a run log line for a finished #EXPECT or #WAIT_QUIET."""
+    ok, elapsed, count = result
+    if op == "expect":
+        if ok is not None:
+            return f"EXPECT {arg['text']}: PASS in {elapsed * 1000:.1f} ms ({ok.hex().upper()})"
+        return f"EXPECT {arg['text']}: FAIL after {arg['timeout'] * 1000:.0f} ms timeout ({count} other datagrams)"
+    if ok:
+        return f"WAIT_QUIET {arg['quiet'] * 1000:g} ms: quiet after {elapsed * 1000:.1f} ms ({count} datagrams)"
+    return f"WAIT_QUIET {arg['quiet'] * 1000:g} ms: FAIL, still busy after {arg['timeout']:g} s ({count} datagrams)"
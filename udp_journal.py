@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import socket
+import hashlib
+
+# Run journals, so an interrupted run can be resumed instead of restarted.
+#
+# While a run sends, its position (see udp_plan.LoopRunner.position) and a
+# few counters are written to <log name>_journal.dat in the results folder.
+# The file holds two fixed-size slots written alternately, each a
+# sequence-numbered JSON record, so a crash in the middle of a write still
+# leaves the previous record intact. Records are written to the OS on every
+# update but fsync'ed only every SYNC_EVERY records or SYNC_SECONDS, which
+# keeps the cost per command to one small write.
+#
+# A run that completes deletes its journal; one that crashed, was killed
+# or was stopped leaves it behind, and the next run of the same script is
+# offered to resume from it into the same log and scopeshot folder. Each
+# record names its owner (owner_id()); a run that closes its journal clears
+# the owner, and a journal whose owner is still alive belongs to a run in
+# progress and is never offered.
+
+JOURNAL_SUFFIX = "_journal.dat"
+SLOT_SIZE = 4096
+SYNC_EVERY = 256  # Records between fsyncs...
+SYNC_SECONDS = 2.0  # ...or seconds, whichever comes first
+
+def owner_id():
+    """Return "host:pid" of this process, recorded with work it has claimed."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        import ctypes  # os.kill() would terminate the process on Windows
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # Access denied: it exists
+        code = ctypes.c_ulong()
+        try:
+            return not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) or code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def owner_alive(owner):
+    """Return True or False for an owner_id() of this machine, None if it belongs to another one (or is unknown)."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    return _pid_alive(int(pid))
+
+def plan_fingerprint(plan):
+    """Return a digest of the files a plan was built from (paths and modification times)."""
+    items = sorted((path, mtime) for path, mtime in plan["deps"].items())
+    return hashlib.sha256(json.dumps(items).encode()).hexdigest()
+
+def journal_path(log_filename):
+    return log_filename.rsplit(".", 1)[0] + JOURNAL_SUFFIX
+
+def scopeshot_folder(log_filename):
+    """Return the scopeshot folder of the run logging to log_filename (created on its first capture)."""
+    return log_filename.rsplit(".", 1)[0]
+
+class RunJournal:
+    """The journal of one running script; header fields are repeated in every record."""
+
+    def __init__(self, path, header, seq=0):
+        self.path = path
+        self.header = dict(header, owner=owner_id())
+        self.last = None  # (position, counters) of the newest record
+        self.seq = seq
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+
+    def record(self, position, **state):
+        """Store the current position (and counters); cheap enough to call before every command."""
+        self.last = (position, state)
+        self.seq += 1
+        record = dict(self.header, seq=self.seq, pos=position, time=time.time(), **state)
+        data = json.dumps(record).encode()
+        if len(data) >= SLOT_SIZE:
+            raise ValueError(f"journal record of {len(data)} bytes does not fit a {SLOT_SIZE}-byte slot")
+        self.file.seek((self.seq % 2) * SLOT_SIZE)
+        self.file.write(data.ljust(SLOT_SIZE - 1) + b"\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= SYNC_EVERY or time.monotonic() - self.synced_at >= SYNC_SECONDS:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        """Release the journal (clearing its owner), flush it to disk and keep it for a later resume."""
+        if not self.file.closed:
+            if self.last is not None:
+                self.header["owner"] = None
+                self.record(self.last[0], **self.last[1])
+            self.sync()
+            self.file.close()
+
+    def finish(self):
+        """The run completed: there is nothing to resume, so remove the journal."""
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def load(path):
+    """Return the newest intact record of a journal file, or None."""
+    try:
+        with open(path, "rb") as file:
+            data = file.read(2 * SLOT_SIZE)
+    except OSError:
+        return None
+    best = None
+    for offset in (0, SLOT_SIZE):
+        try:
+            record = json.loads(data[offset:offset + SLOT_SIZE])
+        except ValueError:
+            continue  # Empty, or torn by a crash during its write
+        if best is None or record["seq"] > best["seq"]:
+            best = record
+    if best is not None:
+        best["journal"] = path
+    return best
+
+def find_interrupted(results_dir, script):
+    """Return the records of interrupted runs of script, newest first; runs still in progress are left out."""
+    if not os.path.isdir(results_dir):
+        return []
+    target = os.path.realpath(script)
+    records = []
+    for name in os.listdir(results_dir):
+        if not name.endswith(JOURNAL_SUFFIX):
+            continue
+        record = load(os.path.join(results_dir, name))
+        if record is None or owner_alive(record.get("owner")):
+            continue
+        if os.path.realpath(record.get("script", "")) == target:
+            records.append(record)
+    return sorted(records, key=lambda r: r["time"], reverse=True)
+
+def resume_journal(record):
+    """Reopen the journal of an interrupted run to continue writing it."""
+    header = {key: record[key] for key in ("script", "fingerprint", "log", "scopeshots") if key in record}
+    if not header.get("scopeshots"):
+        header["scopeshots"] = scopeshot_folder(record["log"])  # Journals written before the CLI recorded one
+    return RunJournal(record["journal"], header, record["seq"])
+
+def discard(record):
+    """Forget an interrupted run (its log and scopeshots stay)."""
+    if os.path.exists(record["journal"]):
+        os.remove(record["journal"])
+
+def describe(record):
+    """Return a one-line description of where an interrupted run stopped."""
+    where = " > ".join(f"op {index + 1}" if level == 0 else f"iteration {iteration + 1}, op {index + 1}"
+                       for level, (iteration, index) in enumerate(record["pos"]))
+    stopped = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"]))
+    return f"{os.path.basename(record['script'])} stopped at {where} ({record.get('packets', 0)} packets sent) on {stopped}"
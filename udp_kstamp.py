@@ -0,0 +1,167 @@
+import sys
+import time
+import socket
+import struct
+
+# Kernel timestamps for sent and received datagrams (Linux only).
+#
+# Timestamps taken in Python around sendto()/recvfrom() include interpreter
+# and GIL noise. With SO_TIMESTAMPING the kernel stamps every datagram as it
+# leaves for the driver and as it arrives: transmit stamps come back on the
+# socket's error queue (MSG_ERRQUEUE, numbered with SOF_TIMESTAMPING_OPT_ID
+# so each is matched to its sendto()), receive stamps arrive as ancillary
+# data of recvmsg(). Where SO_TIMESTAMPING is refused, SO_TIMESTAMPNS still
+# gives receive stamps. Software stamps need no special hardware.
+#
+# StampedSocket wraps the run's send socket, so the sender, the #EXPECT
+# receiver, the adaptive pacer, templates and replays all go through it
+# unchanged. It records per run (RunMetrics "kernel_timestamps"):
+#   send_delay_seconds  sendto() call to kernel transmit stamp
+#   ipdv_seconds        change between consecutive transmit intervals (jitter)
+#   rtt_seconds         transmit stamp of the latest datagram to the receive
+#                       stamp of the next reply
+# and writes one run log line per stamp.
+
+# Not all of these are exported by the socket module; values from the Linux UAPI headers
+SO_TIMESTAMPNS = 35
+SO_TIMESTAMPING = 37
+IP_RECVERR = 11
+IPV6_RECVERR = 25
+SO_EE_ORIGIN_TIMESTAMPING = 4
+SOF_TIMESTAMPING_TX_SOFTWARE = 1 << 1
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_OPT_ID = 1 << 7
+SOF_TIMESTAMPING_OPT_TSONLY = 1 << 11  # Do not loop the payload back with each transmit stamp
+TIMESTAMPING_FLAGS = (SOF_TIMESTAMPING_TX_SOFTWARE | SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE
+                      | SOF_TIMESTAMPING_OPT_ID | SOF_TIMESTAMPING_OPT_TSONLY)
+
+TIMESPEC = struct.Struct("@ll")  # struct timespec; the first of scm_timestamping's three is the software stamp
+EXTENDED_ERR = struct.Struct("=IBBBBII")  # struct sock_extended_err: errno, origin, type, code, pad, info, data
+ANCILLARY_SIZE = 512
+PENDING_LIMIT = 4096  # Sends awaiting their transmit stamp
+
+def format_ns(ns):
+    """Return a nanosecond timestamp as "seconds.nanoseconds"."""
+    return f"{ns // 1_000_000_000}.{ns % 1_000_000_000:09d}"
+
+def _parse(ancdata):
+    """Return (timestamp ns or None, OPT_ID or None) from recvmsg() ancillary data."""
+    stamp = stamp_id = None
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind in (SO_TIMESTAMPING, SO_TIMESTAMPNS) and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            stamp = seconds * 1_000_000_000 + nanoseconds
+        elif (level, kind) in ((socket.IPPROTO_IP, IP_RECVERR), (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+            fields = EXTENDED_ERR.unpack_from(data)
+            if fields[1] == SO_EE_ORIGIN_TIMESTAMPING:
+                stamp_id = fields[6]
+    return stamp, stamp_id
+
+def enable(sock):
+    """Turn on kernel timestamps; returns "tx+rx", or "rx" when only receive stamps are available.
+
+    Raises OSError where the kernel offers neither.
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError("kernel timestamps need Linux")
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, TIMESTAMPING_FLAGS)
+        return "tx+rx"
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        return "rx"
+
+class StampedSocket:
+    """A UDP socket that records kernel send and receive times; everything else goes to the wrapped socket.
+
+    log is called with a run log line per timestamp; offset (seconds) is
+    added to the logged times, e.g. a reference clock offset (udp_clock.py).
+    """
+
+    def __init__(self, sock, metrics=None, log=None, offset=0.0):
+        self.sock = sock
+        self.mode = enable(sock)
+        self.metrics = metrics
+        self.log = log
+        self.offset_ns = round(offset * 1e9)
+        self.next_id = 0
+        self.pending = {}  # OPT_ID -> time.time_ns() just before sendto()
+        self.last_tx = None
+        self.last_interval = None
+        self.tx_stamps = 0
+        self.rx_stamps = 0
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def fileno(self):
+        return self.sock.fileno()  # For select(), which does not go through __getattr__
+
+    def sendto(self, data, address):
+        before = time.time_ns()
+        sent = self.sock.sendto(data, address)
+        if self.mode == "tx+rx":
+            self.pending[self.next_id] = before
+            self.next_id += 1
+            if len(self.pending) > PENDING_LIMIT:
+                del self.pending[next(iter(self.pending))]  # Its stamp never came
+            self.collect()
+        else:
+            self.last_tx = before  # No transmit stamps: RTTs start at the sendto() call
+        return sent
+
+    def recvfrom(self, bufsize, flags=0):
+        """Receive one datagram and its kernel receive time; never blocks.
+
+        Queued transmit stamps also make the socket look readable, so they
+        are collected first and BlockingIOError means there was no datagram.
+        """
+        if self.mode == "tx+rx":
+            self.collect()
+        data, ancdata, _, address = self.sock.recvmsg(bufsize, ANCILLARY_SIZE, flags | socket.MSG_DONTWAIT)
+        stamp = _parse(ancdata)[0]
+        if stamp is not None:
+            self._received(stamp)
+        return data, address
+
+    def collect(self):
+        """Read the transmit stamps the kernel has queued so far."""
+        while True:
+            try:
+                _, ancdata, _, _ = self.sock.recvmsg(1, ANCILLARY_SIZE, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # Nothing usable on the error queue
+            stamp, stamp_id = _parse(ancdata)
+            if stamp is not None:
+                self._sent(stamp, self.pending.pop(stamp_id, None))
+
+    def _sent(self, stamp, before):
+        self.tx_stamps += 1
+        delay = (stamp - before) / 1e9 if before is not None else None
+        ipdv = None
+        if self.last_tx is not None:
+            interval = stamp - self.last_tx
+            if self.last_interval is not None:
+                ipdv = abs(interval - self.last_interval) / 1e9
+            self.last_interval = interval
+        self.last_tx = stamp
+        if self.metrics is not None:
+            self.metrics.record_wire_send(delay, ipdv)
+        if self.log is not None:
+            after = f" ({delay * 1e6:.1f} us after sendto)" if delay is not None else ""
+            self.log(f"{format_ns(stamp + self.offset_ns)} Wire TX{after}")
+
+    def _received(self, stamp):
+        self.rx_stamps += 1
+        rtt = (stamp - self.last_tx) / 1e9 if self.last_tx is not None else None
+        if self.metrics is not None and rtt is not None:
+            self.metrics.record_wire_rtt(rtt)
+        if self.log is not None:
+            after = f" (RTT {rtt * 1e6:.1f} us)" if rtt is not None else ""
+            self.log(f"{format_ns(stamp + self.offset_ns)} Wire RX{after}")
+
+    def describe(self):
+        return f"Kernel timestamps: {self.tx_stamps} transmit, {self.rx_stamps} receive ({self.mode})"
@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import udp_plan
+
+# Ahead-of-time checks for command files: hex syntax, odd digit counts,
+# payloads over the MTU, unknown #DIRECTIVES, unbalanced #REPEAT/#END
+# blocks and missing CMD_ references.
+# Results are cached per file content hash, so unchanged files are accepted
+# instantly and only edited files are re-read (in parallel worker processes).
+#
+#   python udp_lint.py [commands]
+
+LINT_CACHE = "udp_lint_cache.json"
+LINT_VERSION = 3  # Bump when the checks change so cached results are redone
+DEFAULT_MTU = 1472  # Largest UDP payload in one 1500-byte Ethernet frame over IPv4
+MAX_PROBLEMS = 50  # Per file; a generated file with a systematic error would otherwise flood the report
+
+_DIRECTIVE_RE = re.compile(r"^#([A-Z][A-Z_]*)\b")
+# Leading words of the known directives; other #WORDS (#NOTE, #TODO) are comments
+_DIRECTIVE_WORDS = tuple(directive[1:].split()[0] for directive in udp_plan.DIRECTIVES)
+MIN_DIRECTIVE_PREFIX = 3  # "#REP" is a truncated #REPEAT, "#RE" may be anything
+_cache_lock = threading.Lock()
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _misspelt_directive(stripped):
+    """Return True for an upper-case #WORD that looks like a known directive but is not one (#SCOPE, #WAIT, #REPEATS)."""
+    match = _DIRECTIVE_RE.match(stripped)
+    if not match or stripped.upper().startswith(udp_plan.DIRECTIVES):
+        return False
+    word = match.group(1)
+    return any(word.startswith(known) or (len(word) >= MIN_DIRECTIVE_PREFIX and known.startswith(word)) for known in _DIRECTIVE_WORDS)
+
+def check_line(line, file_path, line_no, mtu=DEFAULT_MTU):
+    """Return the problem with one command file line, or None if it is fine."""
+    where = f"{os.path.basename(file_path)}:{line_no}"
+    stripped = line.strip()
+    if _misspelt_directive(stripped):
+        return f"{where}: unknown directive {stripped.split()[0]}"
+    try:
+        op = udp_plan.parse_line(line, file_path, line_no)
+    except ValueError as e:
+        return str(e)
+    if op is None:
+        return None
+    kind, arg = op[0], op[1]
+    if kind == "template" and arg.length > mtu:
+        return f"{where}: template payload of {arg.length} bytes exceeds the {mtu}-byte MTU"
+    if kind != "send":
+        return None
+    digits = re.sub(r"\s+", "", arg)
+    bad = re.search(r"[^0-9A-Fa-f]", digits)
+    if bad:
+        return f"{where}: non-hexadecimal character {bad.group()!r}"
+    if len(digits) % 2:
+        return f"{where}: odd number of hex digits ({len(digits)})"
+    try:
+        bytes.fromhex(arg)
+    except ValueError:
+        return f"{where}: hex bytes must not be split by spaces"
+    if len(digits) // 2 > mtu:
+        return f"{where}: payload of {len(digits) // 2} bytes exceeds the {mtu}-byte MTU"
+    return None
+
+def _check_block(blocks, line, file_path, line_no):
+    """Track #REPEAT/#FOREVER ... #END nesting; line None checks that every block was closed."""
+    try:
+        if line is None:
+            blocks.close()
+            return None
+        stripped = line.strip().upper()
+        if stripped.startswith(("#REPEAT", "#FOREVER")):
+            blocks.add(("repeat", {}, file_path, line_no))
+        elif stripped == "#END":
+            blocks.add(("end", None, file_path, line_no))
+        elif blocks.open and stripped and (not stripped.startswith("#") or stripped.startswith(udp_plan.DIRECTIVES)):
+            blocks.add(("body", None, file_path, line_no))
+    except ValueError as e:
+        return str(e)
+    return None
+
+def lint_plain_file(file_path, mtu=DEFAULT_MTU):
+    """Return the problems in a plain command file (at most MAX_PROBLEMS)."""
+    problems = []
+    blocks = udp_plan.BlockBuilder(file_path)
+    try:
+        with open(file_path, "r") as file:
+            for line_no, line in enumerate(file, 1):
+                problem = check_line(line, file_path, line_no, mtu)
+                if not problem:
+                    problem = _check_block(blocks, line, file_path, line_no)
+                if problem:
+                    problems.append(problem)
+                    if len(problems) >= MAX_PROBLEMS:
+                        problems.append(f"{os.path.basename(file_path)}: stopped after {MAX_PROBLEMS} problems")
+                        break
+            else:
+                problem = _check_block(blocks, None, file_path, 0)
+                if problem:
+                    problems.append(problem)
+    except (OSError, UnicodeDecodeError) as e:
+        problems.append(f"{os.path.basename(file_path)}: cannot read: {e}")
+    return problems
+
+def _lint_job(args):
+    return lint_plain_file(*args)
+
+def lint_cmd_list(file_path, commands_folder):
+    """Return missing references and cycles in a CMD_ list."""
+    try:
+        udp_plan.resolve_files(file_path, commands_folder)
+    except udp_plan.PlanError as e:
+        return [f"{os.path.basename(file_path)}: {problem}" for problem in e.problems]
+    except OSError as e:
+        return [f"{os.path.basename(file_path)}: cannot read: {e}"]
+    return []
+
+def load_cache(path=LINT_CACHE):
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as file:
+                cache = json.load(file)
+            if cache.get("version") == LINT_VERSION:
+                return cache
+        except (OSError, ValueError):
+            pass
+    return {"version": LINT_VERSION, "files": {}}
+
+def save_cache(cache, path=LINT_CACHE):
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as file:
+            json.dump(cache, file)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not save lint cache: {e}")
+
+def lint_folder(commands_folder, names=None, mtu=DEFAULT_MTU, cache_path=LINT_CACHE, max_workers=None):
+    """Lint command files; return {name: [problems]} for every file checked.
+
+    Plain files whose size and mtime, or else content hash, match the cache
+    reuse the cached result; the rest are linted in parallel worker processes.
+    """
+    if names is None:
+        names = sorted(n for n in os.listdir(commands_folder) if os.path.isfile(os.path.join(commands_folder, n)) and not n.startswith("."))
+    with _cache_lock:
+        cache = load_cache(cache_path)
+        entries = cache["files"]
+        results = {}
+        todo = []
+        for name in names:
+            path = os.path.join(commands_folder, name)
+            if udp_plan.is_cmd_list(path):
+                results[name] = lint_cmd_list(path, commands_folder)
+                continue
+            key = f"{os.path.realpath(path)}|{mtu}"
+            try:
+                info = os.stat(path)
+            except OSError as e:
+                results[name] = [f"{name}: cannot read: {e}"]
+                continue
+            entry = entries.get(key)
+            if entry and entry["size"] == info.st_size and entry["mtime_ns"] == info.st_mtime_ns:
+                results[name] = entry["problems"]  # Unchanged since it was hashed
+                continue
+            todo.append((name, path, key, info, entry))
+
+        changed = []
+        for name, path, key, info, entry in todo:
+            try:
+                digest = _hash_file(path)
+            except OSError as e:
+                results[name] = [f"{name}: cannot read: {e}"]
+                continue
+            if entry and entry["sha256"] == digest:
+                results[name] = entry["problems"]  # Touched but not changed
+                entry.update(size=info.st_size, mtime_ns=info.st_mtime_ns)
+            else:
+                changed.append((name, path, key, info, digest))
+
+        if changed:
+            jobs = [(path, mtu) for name, path, key, info, digest in changed]
+            if len(jobs) == 1:
+                outcomes = [lint_plain_file(*jobs[0])]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    outcomes = list(pool.map(_lint_job, jobs))
+            for (name, path, key, info, digest), problems in zip(changed, outcomes):
+                entries[key] = {"size": info.st_size, "mtime_ns": info.st_mtime_ns, "sha256": digest, "problems": problems}
+                results[name] = problems
+        if todo:
+            save_cache(cache, cache_path)
+    return results
+
+def lint_file(file_path, commands_folder=udp_plan.COMMANDS_FOLDER, mtu=DEFAULT_MTU, cache_path=LINT_CACHE):
+    """Lint one command file and, for a CMD_ list, every file it sends; return all problems."""
+    try:
+        leaves, deps = udp_plan.resolve_files(file_path, commands_folder)
+    except udp_plan.PlanError as e:
+        return list(e.problems)
+    problems = []
+    by_folder = {}
+    for path, size in leaves:
+        by_folder.setdefault(os.path.dirname(path) or ".", []).append(os.path.basename(path))
+    for folder, names in by_folder.items():
+        for name, file_problems in lint_folder(folder, sorted(set(names)), mtu, cache_path).items():
+            problems.extend(file_problems)
+    return problems
+
+def main():
+    commands_folder = sys.argv[1] if len(sys.argv) > 1 else udp_plan.COMMANDS_FOLDER
+    if not os.path.isdir(commands_folder):
+        print(f"Commands folder not found: {commands_folder}")
+        sys.exit(1)
+    results = lint_folder(commands_folder)
+    failed = 0
+    for name, problems in results.items():
+        if problems:
+            failed += 1
+            for problem in problems:
+                print(problem)
+    print(f"{len(results)} files checked, {failed} with problems")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
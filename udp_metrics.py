@@ -0,0 +1,311 @@
+import json
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Run telemetry for the send engine: counters, gauges and histograms that are
+# exported in Prometheus text format on http://127.0.0.1:<port>/metrics, plus
+# a per-run summary JSON written next to each run log.
+
+DEFAULT_METRICS_PORT = 9108
+LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3, 1e-2, 0.1, 1.0)
+PACING_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.5)
+ITERATION_BUCKETS = (1e-3, 1e-2, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+WIRE_BUCKETS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 0.1, 1.0)
+CAPTURE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+def _escape_label(value):
+    """Escape a label value for the Prometheus text format (backslash, quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+class Counter:
+    """A monotonically increasing value, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items()) or [((), 0)]
+        return [f"{self.name}{_label_text(key)} {value}" for key, value in items]
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = value
+
+class Histogram:
+    """Cumulative bucketed observations, Prometheus style."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it.
+
+        Returns (value, overflow): when the quantile falls past the last bucket
+        the value is the last finite bound and overflow is True, so the result
+        stays a valid JSON number. The value is None with no observations.
+        """
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None, False
+        target = q * total
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            if running >= target:
+                return bound, False
+        return self.buckets[-1], True
+
+    def summary(self):
+        """snapshot() plus p50/p99, with overflow set if either lies past the last bucket."""
+        p50, p50_overflow = self.quantile(0.5)
+        p99, p99_overflow = self.quantile(0.99)
+        return dict(self.snapshot(), p50=p50, p99=p99, overflow=p50_overflow or p99_overflow)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)},
+            }
+
+    def render(self):
+        with self.lock:
+            counts, total, value_sum = list(self.counts), self.count, self.sum
+        lines = []
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {running}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{self.name}_sum {value_sum}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+class Registry:
+    """A named collection of metrics that renders the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+RUNS = REGISTRY.register(Counter("udp_sender_runs_total", "Command runs started."))
+PACKETS_SENT = REGISTRY.register(Counter("udp_sender_packets_sent_total", "Datagrams sent."))
+BYTES_SENT = REGISTRY.register(Counter("udp_sender_bytes_sent_total", "Payload bytes sent."))
+ERRORS = REGISTRY.register(Counter("udp_sender_errors_total", "Errors by kind."))
+LOG_QUEUE_DEPTH = REGISTRY.register(Gauge("udp_sender_log_queue_depth", "Log records emitted but not yet shown."))
+SEND_SECONDS = REGISTRY.register(Histogram("udp_sender_send_seconds", "sendto() call latency.", LATENCY_BUCKETS))
+PACING_ERROR_SECONDS = REGISTRY.register(Histogram("udp_sender_pacing_error_seconds", "Lateness against the scheduled send time.", PACING_BUCKETS))
+EXPECTATIONS = REGISTRY.register(Counter("udp_sender_expectations_total", "#EXPECT and #WAIT_QUIET results."))
+LOOP_ITERATIONS = REGISTRY.register(Counter("udp_sender_loop_iterations_total", "#REPEAT / #FOREVER iterations completed."))
+WIRE_SEND_DELAY_SECONDS = REGISTRY.register(Histogram("udp_sender_wire_send_delay_seconds", "sendto() call to kernel transmit timestamp.", WIRE_BUCKETS))
+WIRE_RTT_SECONDS = REGISTRY.register(Histogram("udp_sender_wire_rtt_seconds", "Kernel transmit to kernel receive timestamp of the next reply.", WIRE_BUCKETS))
+CAPTURE_SECONDS = REGISTRY.register(Histogram("udp_sender_capture_seconds", "Scope capture duration.", CAPTURE_BUCKETS))
+
+class RunMetrics:
+    """Telemetry for one run: feeds the process-wide registry and keeps a per-run summary."""
+
+    def __init__(self, name, job=None):
+        self.name = name
+        self.job = job  # Id of the queue job the run belongs to (udp_queue.py), or None
+        self.cancelled = False  # Stopped before it sent anything
+        self.started = time.time()
+        self.finished = None
+        self.packets = 0
+        self.bytes = 0
+        self.errors = {}
+        self.max_log_queue_depth = 0
+        self.expectations = {"passed": 0, "failed": 0}
+        self.loops = {}  # "file:line" -> Histogram of iteration seconds
+        self.clock = None  # Reference clock details of a synchronized run (udp_clock.SyncedClock.summary)
+        self.wire = None  # Kernel timestamp histograms, created by the first one recorded (udp_kstamp.py)
+        self.send_seconds = Histogram("send_seconds", "", LATENCY_BUCKETS)
+        self.pacing_error = Histogram("pacing_error_seconds", "", PACING_BUCKETS)
+        self.capture_seconds = Histogram("capture_seconds", "", CAPTURE_BUCKETS)
+        RUNS.inc()
+
+    def record_send(self, nbytes, latency=None):
+        """Count one datagram; latency is the sendto() duration when it was measured."""
+        self.packets += 1
+        self.bytes += nbytes
+        PACKETS_SENT.inc()
+        BYTES_SENT.inc(nbytes)
+        if latency is not None:
+            self.send_seconds.observe(latency)
+            SEND_SECONDS.observe(latency)
+
+    def record_batch(self, packets, nbytes):
+        """Count a batch of datagrams sent without per-packet timing."""
+        self.packets += packets
+        self.bytes += nbytes
+        PACKETS_SENT.inc(packets)
+        BYTES_SENT.inc(nbytes)
+
+    def record_pacing(self, lateness):
+        lateness = max(0.0, lateness)
+        self.pacing_error.observe(lateness)
+        PACING_ERROR_SECONDS.observe(lateness)
+
+    def record_capture(self, duration):
+        self.capture_seconds.observe(duration)
+        CAPTURE_SECONDS.observe(duration)
+
+    def record_expect(self, passed):
+        """Count one #EXPECT / #WAIT_QUIET result."""
+        result = "passed" if passed else "failed"
+        self.expectations[result] += 1
+        EXPECTATIONS.inc(result=result)
+
+    def record_iteration(self, loop, duration):
+        """Time one iteration of the #REPEAT / #FOREVER block at loop ("file:line")."""
+        histogram = self.loops.get(loop)
+        if histogram is None:
+            histogram = self.loops[loop] = Histogram("iteration_seconds", "", ITERATION_BUCKETS)
+        histogram.observe(duration)
+        LOOP_ITERATIONS.inc()
+
+    def _wire(self):
+        if self.wire is None:
+            self.wire = {name: Histogram(name, "", WIRE_BUCKETS) for name in ("send_delay_seconds", "ipdv_seconds", "rtt_seconds")}
+        return self.wire
+
+    def record_wire_send(self, delay=None, ipdv=None):
+        """Record a kernel transmit stamp: its delay after sendto() and the change from the previous send interval."""
+        wire = self._wire()
+        if delay is not None:
+            wire["send_delay_seconds"].observe(delay)
+            WIRE_SEND_DELAY_SECONDS.observe(delay)
+        if ipdv is not None:
+            wire["ipdv_seconds"].observe(ipdv)
+
+    def record_wire_rtt(self, rtt):
+        self._wire()["rtt_seconds"].observe(rtt)
+        WIRE_RTT_SECONDS.observe(rtt)
+
+    def record_error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        ERRORS.inc(kind=kind)
+
+    def set_log_queue_depth(self, depth):
+        self.max_log_queue_depth = max(self.max_log_queue_depth, depth)
+        LOG_QUEUE_DEPTH.set(depth)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self):
+        """Return the per-run summary as a JSON-ready dict."""
+        finished = self.finished or time.time()
+        duration = finished - self.started
+        return {
+            "run": self.name,
+            "job": self.job,
+            "cancelled": self.cancelled,
+            "started": self.started,
+            "finished": finished,
+            "duration": round(duration, 6),
+            "packets_sent": self.packets,
+            "bytes_sent": self.bytes,
+            "packets_per_second": round(self.packets / duration, 3) if duration > 0 else None,
+            "errors": self.errors,
+            "max_log_queue_depth": self.max_log_queue_depth,
+            "expectations": self.expectations,
+            "send_seconds": self.send_seconds.summary(),
+            "pacing_error_seconds": self.pacing_error.summary(),
+            "capture_seconds": self.capture_seconds.summary(),
+            "loop_iteration_seconds": {loop: h.summary() for loop, h in self.loops.items()},
+            "clock": self.clock,
+            "kernel_timestamps": {name: h.summary() for name, h in self.wire.items()} if self.wire is not None else None,
+        }
+
+    def write_summary(self, log_filename):
+        """Write the summary as <log name>_summary.json next to the run log and return its path."""
+        if self.finished is None:
+            self.finish()
+        summary_path = log_filename.rsplit(".", 1)[0] + "_summary.json"
+        with open(summary_path, "w") as file:
+            json.dump(self.summary(), file, indent=4, allow_nan=False)
+        return summary_path
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the console
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+    """Serve /metrics from a background thread; returns the server, or None if the port is busy."""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint disabled: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,497 @@
+import os
+import time
+import queue
+import threading
+import udp_capture
+import udp_checksum
+import udp_expect
+import udp_template
+
+# Resolves a command file (including nested CMD_ lists) into one flattened
+# execution plan before anything is sent. Plans are cached and rebuilt only
+# when one of the files they were built from changes. Scripts too large to
+# hold in memory are streamed instead (see open_plan).
+
+COMMANDS_FOLDER = "commands"
+DIRECTIVES = ("#SCOPE CAPTURE", "#TEMPLATE", "#REPLAY", "#EXPECT", "#WAIT_QUIET", "#REPEAT", "#FOREVER", "#END")  # Everything else starting with # is a comment
+STREAM_THRESHOLD = 32 * 1024 * 1024  # Bytes of command files above which plans are streamed
+STREAM_BATCH = 1024  # Ops handed to the sender per queue item
+STREAM_READ_AHEAD = 64  # Batches parsed ahead of the sender
+ESTIMATE_SAMPLE = 1024 * 1024  # Bytes of each streamed file read to estimate its line count
+
+class PlanError(Exception):
+    """Raised when a command file cannot be resolved into a plan."""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+_plan_cache = {}
+_plan_cache_lock = threading.Lock()
+
+def is_cmd_list(file_path):
+    """Return True if the file is a CMD_* list of other command files."""
+    return os.path.basename(file_path).startswith("CMD_")
+
+def read_cmd_list(file_path):
+    """Return the command file names listed in a CMD_* file."""
+    with open(file_path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+
+def parse_line(line, file_path, line_no):
+    """Parse one command file line into an (op, arg, source, line_no) tuple, or None to skip it.
+
+    Raises ValueError with a "file:line: ..." message for lines that cannot
+    be sent.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.upper().startswith("#SCOPE CAPTURE"):
+        return ("capture", line, file_path, line_no)
+    if line.upper().startswith("#TEMPLATE"):
+        try:
+            return ("template", udp_template.parse_template(line), file_path, line_no)
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad #TEMPLATE: {e}")
+    if line.upper().startswith("#REPLAY"):
+        try:
+            return ("replay", parse_replay(line, file_path), file_path, line_no)
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad #REPLAY: {e}")
+    if line.upper().startswith("#EXPECT"):
+        try:
+            return ("expect", udp_expect.parse_expect(line), file_path, line_no)
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad #EXPECT: {e}")
+    if line.upper().startswith("#WAIT_QUIET"):
+        try:
+            return ("wait_quiet", udp_expect.parse_wait_quiet(line), file_path, line_no)
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad #WAIT_QUIET: {e}")
+    if line.upper().startswith(("#REPEAT", "#FOREVER")):
+        try:
+            return ("repeat", parse_repeat(line), file_path, line_no)
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad {line.split()[0].upper()}: {e}")
+    if line.upper() == "#END":
+        return ("end", None, file_path, line_no)
+    if line.startswith('#'):
+        return None
+    line = line.split('#')[0].strip()  # Remove inline comments
+    if not line:
+        return None
+    if "{" in line:
+        try:
+            udp_checksum.encode_line(line)  # Checksums are filled when sending, in the front end's wire format
+        except ValueError as e:
+            raise ValueError(f"{os.path.basename(file_path)}:{line_no}: bad checksum field: {e}")
+    return ("send", line, file_path, line_no)
+
+def parse_command_file(file_path):
+    """Parse a plain command file into (op, arg, source, line_no) tuples.
+
+    "send" ops carry the hex line, "capture" ops the directive,
+    "template" ops a compiled udp_template.PacketTemplate, "replay" ops
+    a {"path", "speed"} dict for a recorded capture, "expect" /
+    "wait_quiet" ops the parsed wait (see udp_expect.py) and "loop" ops a
+    #REPEAT / #FOREVER block with its body ops under "ops".
+    """
+    ops = []
+    problems = []
+    blocks = BlockBuilder(file_path)
+    with open(file_path, 'r') as file:
+        for line_no, line in enumerate(file, 1):
+            try:
+                op = parse_line(line, file_path, line_no)
+                if op is not None:
+                    op = blocks.add(op)
+            except ValueError as e:
+                problems.append(str(e))
+                continue
+            if op is not None:
+                ops.append(op)
+    try:
+        blocks.close()
+    except ValueError as e:
+        problems.append(str(e))
+    if problems:
+        raise PlanError(problems)
+    return ops
+
+def parse_replay(line, file_path):
+    """Parse "#REPLAY <capture> [SPEED <x>|FAST]"; relative paths are tried next to the command file first."""
+    parts = line.split()[1:]
+    if not parts:
+        raise ValueError("missing capture file")
+    speed = 1.0
+    if len(parts) >= 3 and parts[-2].upper() == "SPEED":
+        speed = udp_capture.parse_speed(parts[-1])
+        parts = parts[:-2]
+    elif len(parts) >= 2 and parts[-1].upper() == "FAST":
+        speed = None
+        parts = parts[:-1]
+    path = " ".join(parts)
+    if not os.path.isabs(path):
+        beside = os.path.join(os.path.dirname(file_path), path)
+        if os.path.exists(beside):
+            path = beside
+    if not os.path.exists(path):
+        raise ValueError(f"capture {path} not found")
+    return {"path": path, "speed": speed}
+
+def parse_repeat(line):
+    """Parse "#REPEAT <n> [UNTIL FAIL]" or "#FOREVER [FOR <duration>] [UNTIL FAIL]".
+
+    #FOREVER needs a stop condition: a time limit, a failed #EXPECT, or both.
+    """
+    parts = line.split()
+    words = [part.upper() for part in parts]
+    until_fail = words[-2:] == ["UNTIL", "FAIL"]
+    if until_fail:
+        parts, words = parts[:-2], words[:-2]
+    if words[0] == "#REPEAT":
+        if len(parts) != 2 or not parts[1].isdigit() or int(parts[1]) < 1:
+            raise ValueError("expected a repeat count of at least 1")
+        return {"count": int(parts[1]), "limit": None, "until_fail": until_fail}
+    if words[0] != "#FOREVER":
+        raise ValueError("expected #REPEAT or #FOREVER")
+    limit = None
+    if len(parts) == 3 and words[1] == "FOR":
+        limit = udp_expect.parse_duration(parts[2])
+    elif len(parts) != 1:
+        raise ValueError("expected FOR <duration> and/or UNTIL FAIL")
+    if limit is None and not until_fail:
+        raise ValueError("needs a stop condition (FOR <duration> or UNTIL FAIL)")
+    return {"count": None, "limit": limit, "until_fail": until_fail}
+
+class BlockBuilder:
+    """Folds the ops of #REPEAT/#FOREVER ... #END blocks into "loop" ops while a file is parsed.
+
+    Only the body is held, once, whatever the iteration count; blocks nest
+    but must close in the file that opened them.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.open = []  # [(repeat op, body ops)], innermost last
+
+    def add(self, op):
+        """Take the next parsed op; return it (or a finished top-level loop), or None while inside a block."""
+        if op[0] == "repeat":
+            self.open.append((op, []))
+            return None
+        if op[0] == "end":
+            if not self.open:
+                raise ValueError(f"{os.path.basename(self.file_path)}:{op[3]}: #END without #REPEAT or #FOREVER")
+            head, body = self.open.pop()
+            if not body:
+                raise ValueError(f"{os.path.basename(self.file_path)}:{head[3]}: empty loop")
+            op = ("loop", dict(head[1], ops=body), head[2], head[3])
+        if self.open:
+            self.open[-1][1].append(op)
+            return None
+        return op
+
+    def close(self):
+        """Raise ValueError if a block is still open at the end of the file."""
+        if self.open:
+            head = self.open[-1][0]
+            self.open = []
+            raise ValueError(f"{os.path.basename(self.file_path)}:{head[3]}: loop is missing its #END")
+
+class LoopRunner:
+    """Runs "loop" ops by yielding the same body ops again for every iteration.
+
+    Iterating a plan through iterate() gives the flat sequence of ops to
+    send, so memory does not grow with the iteration count. Each finished
+    iteration is timed into metrics.record_iteration(); the sender reports
+    failed #EXPECTs through expectation_failed() so UNTIL FAIL loops can
+    stop. Time limits are checked between iterations (and restart when a
+    run is resumed).
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.frames = []  # [iteration, op index] per level, top level first
+        self.failures = 0
+        self.on_done = None  # Called with (loop key, iterations, seconds) when a loop ends
+
+    @property
+    def depth(self):
+        """Loops currently running."""
+        return max(0, len(self.frames) - 1)
+
+    def position(self):
+        """Return where the op last yielded sits: [[iteration, index], ...] from the top level inwards."""
+        return [list(frame) for frame in self.frames]
+
+    def expectation_failed(self):
+        self.failures += 1
+
+    def iterate(self, ops, resume=None):
+        """Yield the ops to send; resume is a position() from an earlier run of the same plan to start at."""
+        self.frames = []
+        yield from self._iterate(ops, 0, resume or [])
+
+    def _iterate(self, ops, iteration, resume):
+        start = resume[0][1] if resume else 0
+        frame = [iteration, 0]
+        self.frames.append(frame)
+        try:
+            for index, op in enumerate(ops):
+                if index < start:
+                    continue  # Streamed plans are read up to the resume point, not sent
+                frame[1] = index
+                if op[0] == "loop":
+                    yield from self._run(op, resume[1:] if index == start else [])
+                else:
+                    yield op
+        finally:
+            self.frames.pop()
+
+    def _run(self, op, resume):
+        loop = op[1]
+        key = f"{os.path.basename(op[2])}:{op[3]}"
+        start = time.perf_counter()
+        deadline = None if loop["limit"] is None else start + loop["limit"]
+        iterations = resume[0][0] if resume else 0
+        while loop["count"] is None or iterations < loop["count"]:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            failures = self.failures
+            iteration_start = time.perf_counter()
+            yield from self._iterate(loop["ops"], iterations, resume)
+            resume = []
+            iterations += 1
+            if self.metrics is not None:
+                self.metrics.record_iteration(key, time.perf_counter() - iteration_start)
+            if loop["until_fail"] and self.failures > failures:
+                break
+        if self.on_done is not None:
+            self.on_done(key, iterations, time.perf_counter() - start)
+
+WAIT_OPS = ("expect", "wait_quiet")
+
+def count_packets(plan):
+    """Return how many datagrams a plan sends, counting every template and #REPEAT repetition.
+
+    #FOREVER loops are counted for one pass.
+    """
+    return _count_ops(plan["ops"])
+
+def _count_ops(ops):
+    total = 0
+    for op, arg, source, line_no in ops:
+        if op == "send":
+            total += 1
+        elif op == "template":
+            total += arg.count
+        elif op == "loop":
+            total += _count_ops(arg["ops"]) * (arg["count"] or 1)
+    return total
+
+def _replay_deps(ops, deps):
+    for op, arg, source, line_no in ops:
+        if op == "replay":
+            deps[os.path.realpath(arg["path"])] = os.stat(arg["path"]).st_mtime_ns
+        elif op == "loop":
+            _replay_deps(arg["ops"], deps)
+
+def _resolve(file_path, commands_folder, stack, deps, ops, problems):
+    """Depth-first expansion of one file into ops, recording every file touched."""
+    real_path = os.path.realpath(file_path)
+    if real_path in stack:
+        chain = " -> ".join(os.path.basename(p) for p in stack + [real_path])
+        problems.append(f"CMD_ cycle: {chain}")
+        return
+    try:
+        deps[real_path] = os.stat(real_path).st_mtime_ns
+    except OSError:
+        parent = os.path.basename(stack[-1]) if stack else "(top level)"
+        problems.append(f"Command file {os.path.basename(file_path)} not found (listed in {parent})")
+        return
+
+    if not is_cmd_list(file_path):
+        try:
+            file_ops = parse_command_file(file_path)
+        except PlanError as e:
+            problems.extend(e.problems)
+            return
+        _replay_deps(file_ops, deps)
+        ops.extend(file_ops)
+        return
+
+    stack.append(real_path)
+    for name in read_cmd_list(file_path):
+        _resolve(os.path.join(commands_folder, name), commands_folder, stack, deps, ops, problems)
+    stack.pop()
+
+def build_plan(file_path, commands_folder=COMMANDS_FOLDER):
+    """Resolve a command file into a flattened plan, raising PlanError on cycles or missing files."""
+    deps = {}
+    ops = []
+    problems = []
+    _resolve(file_path, commands_folder, [], deps, ops, problems)
+    if problems:
+        raise PlanError(problems)
+    return {"root": file_path, "ops": ops, "deps": deps}
+
+def plan_is_current(plan):
+    """Return True if none of the files a plan was built from changed since."""
+    for path, mtime in plan["deps"].items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+def load_plan(file_path, commands_folder=COMMANDS_FOLDER):
+    """Return the cached plan for a command file, rebuilding it if any included file changed."""
+    key = (os.path.realpath(file_path), os.path.realpath(commands_folder))
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+    if plan is not None and plan_is_current(plan):
+        return plan
+    plan = build_plan(file_path, commands_folder)
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+    return plan
+
+def clear_plan_cache():
+    """Drop all cached plans."""
+    with _plan_cache_lock:
+        _plan_cache.clear()
+
+def _walk(file_path, commands_folder, stack, deps, leaves, problems):
+    """Expand CMD_ lists into the ordered plain files they send, without parsing those files."""
+    real_path = os.path.realpath(file_path)
+    if real_path in stack:
+        chain = " -> ".join(os.path.basename(p) for p in stack + [real_path])
+        problems.append(f"CMD_ cycle: {chain}")
+        return
+    try:
+        info = os.stat(real_path)
+    except OSError:
+        parent = os.path.basename(stack[-1]) if stack else "(top level)"
+        problems.append(f"Command file {os.path.basename(file_path)} not found (listed in {parent})")
+        return
+    deps[real_path] = info.st_mtime_ns
+    if not is_cmd_list(file_path):
+        leaves.append((file_path, info.st_size))
+        return
+    stack.append(real_path)
+    for name in read_cmd_list(file_path):
+        _walk(os.path.join(commands_folder, name), commands_folder, stack, deps, leaves, problems)
+    stack.pop()
+
+def resolve_files(file_path, commands_folder=COMMANDS_FOLDER):
+    """Return ([(plain file, size)], deps) for a command file, raising PlanError on cycles or missing files."""
+    deps = {}
+    leaves = []
+    problems = []
+    _walk(file_path, commands_folder, [], deps, leaves, problems)
+    if problems:
+        raise PlanError(problems)
+    return leaves, deps
+
+class PlanStream:
+    """Ops of one or more command files, parsed on a helper thread into a bounded queue.
+
+    Iterating starts the reader; at most STREAM_READ_AHEAD batches are held
+    in memory whatever the script size. A bad line stops the stream with a
+    PlanError at the point it was reached, since nothing after it was read
+    before sending started.
+    """
+
+    def __init__(self, files, batch=STREAM_BATCH, read_ahead=STREAM_READ_AHEAD):
+        self.files = files
+        self.batch = batch
+        self.read_ahead = read_ahead
+        self.ops_read = 0
+
+    def _read(self, out, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        batch = []
+        try:
+            for file_path in self.files:
+                blocks = BlockBuilder(file_path)
+                with open(file_path, 'r') as file:
+                    for line_no, line in enumerate(file, 1):
+                        op = parse_line(line, file_path, line_no)
+                        if op is None:
+                            continue
+                        op = blocks.add(op)  # Loop bodies are held until their #END
+                        if op is None:
+                            continue
+                        batch.append(op)
+                        if len(batch) >= self.batch:
+                            if not put(batch):
+                                return
+                            batch = []
+                blocks.close()
+            if batch and not put(batch):
+                return
+            put(None)
+        except (OSError, ValueError) as e:
+            if batch and not put(batch):
+                return
+            put(PlanError([str(e)]))
+
+    def __iter__(self):
+        out = queue.Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read, args=(out, stop), name="plan-reader", daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = out.get()
+                if item is None:
+                    return
+                if isinstance(item, PlanError):
+                    raise item
+                self.ops_read += len(item)
+                yield from item
+        finally:
+            stop.set()  # Also runs when the sender stops early
+            reader.join()
+
+def open_plan(file_path, commands_folder=COMMANDS_FOLDER, stream_threshold=STREAM_THRESHOLD):
+    """Return a plan for sending a command file, streaming it when its files exceed stream_threshold bytes.
+
+    Small scripts get the cached, fully validated plan from load_plan. For
+    large ones, plan["ops"] is a PlanStream and plan["streaming"] is True;
+    the CMD_ structure is still checked before anything is sent.
+    """
+    leaves, deps = resolve_files(file_path, commands_folder)
+    total = sum(size for path, size in leaves)
+    if total < stream_threshold:
+        return load_plan(file_path, commands_folder)
+    return {"root": file_path, "ops": PlanStream([path for path, size in leaves]), "deps": deps,
+            "streaming": True, "bytes": total}
+
+def estimate_packets(plan):
+    """Return the datagram count of a plan; streamed plans are estimated from their size and line density.
+
+    Only the first ESTIMATE_SAMPLE bytes of each streamed file are read, so
+    estimating a multi-gigabyte script costs a few reads, not a full pass.
+    """
+    if not plan.get("streaming"):
+        return count_packets(plan)
+    lines = 0
+    for path in plan["ops"].files:
+        size = os.path.getsize(path)
+        with open(path, "rb") as file:
+            sample = file.read(ESTIMATE_SAMPLE)
+        if sample:
+            lines += round(sample.count(b"\n") * size / len(sample))
+    return lines
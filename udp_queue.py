@@ -0,0 +1,423 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import udp_journal
+import udp_metrics
+import udp_suite
+
+# Durable run queue for unattended batches. Jobs (a script, a target and
+# a delay) live in a SQLite database, so a queue loaded in the evening
+# survives crashes and restarts. A background Scheduler starts the
+# highest-priority job that is due and whose target (and instrument, if it
+# needs one) still has a free slot, until the queue is drained:
+#
+#   python udp_queue.py add commands/*.txt --target 192.168.0.11:5005 --priority 5 --at 22:00 --retries 2
+#   python udp_queue.py list
+#   python udp_queue.py run
+#
+# Each board takes one script at a time unless the "queue_limits" config
+# entry says otherwise, e.g. {"192.168.0.11:5005": 2, "scope": 1}.
+#
+# Several processes may share the queue file (the GUI, udp_control.py, the
+# CLI). A claimed job records its owner ("host:pid") and the owner's
+# scheduler refreshes a heartbeat on it; a job left running is only queued
+# again once its owner has exited or its heartbeat is STALE_AFTER old.
+
+QUEUE_DB = "udp_queue.sqlite"
+DEFAULT_LIMIT = 1  # Concurrent jobs per target or instrument without a configured limit
+RETRY_BACKOFF = 30.0  # Seconds before a failed job is tried again, times the attempt number
+POLL_INTERVAL = 1.0  # Longest wait between scheduling rounds
+HEARTBEAT_INTERVAL = 10.0  # Seconds between heartbeats on claimed jobs (and checks for abandoned ones)
+STALE_AFTER = 60.0  # A claim without a heartbeat for this long is abandoned
+STATES = ("queued", "running", "done", "failed", "cancelled")
+QUEUE_BUCKETS = (1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 4 * 3600.0, 12 * 3600.0)
+
+QUEUE_WAIT_SECONDS = udp_metrics.REGISTRY.register(udp_metrics.Histogram(
+    "udp_sender_queue_wait_seconds", "Time queued jobs waited past their start time.", QUEUE_BUCKETS))
+JOB_SECONDS = udp_metrics.REGISTRY.register(udp_metrics.Histogram(
+    "udp_sender_job_seconds", "Queued job run time.", QUEUE_BUCKETS))
+JOBS_FINISHED = udp_metrics.REGISTRY.register(udp_metrics.Counter("udp_sender_jobs_total", "Queued jobs finished by outcome."))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    script TEXT NOT NULL,
+    target TEXT NOT NULL,
+    delay REAL NOT NULL,
+    instrument TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    options TEXT,
+    origin TEXT,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, priority DESC, not_before, id);
+"""
+
+def parse_start(text, now=None):
+    """Parse a start time: "HH:MM" (the next such time) or an ISO date and time; returns epoch seconds."""
+    now = now or datetime.now()
+    try:
+        clock = datetime.strptime(text, "%H:%M")
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+    start = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    if start <= now:
+        start += timedelta(days=1)
+    return start.timestamp()
+
+class JobQueue:
+    """The SQLite-backed job table; safe to share between threads.
+
+    origin scopes the queue: jobs submitted through it are tagged with it
+    and claim() only takes jobs with the same origin (None is the shared
+    batch queue of udp_queue.py).
+    """
+
+    def __init__(self, path=QUEUE_DB, origin=None):
+        self.path = path
+        self.origin = origin
+        self.owner = udp_journal.owner_id()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")  # Other processes can read (and add jobs) while it runs
+        self.db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("options", "TEXT"), ("origin", "TEXT"), ("owner", "TEXT"), ("heartbeat", "REAL")):
+            if column not in columns:  # Queues created by earlier versions
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def close(self):
+        self.db.close()
+
+    def submit(self, script, target, delay, priority=0, not_before=None, max_attempts=1, instrument=None, options=None):
+        """Queue a job; target is "ip:port", options extra keyword arguments for send_file. Returns the job id."""
+        udp_suite.parse_target(target)  # Reject malformed targets now rather than at 3 a.m.
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (script, target, delay, instrument, priority, not_before, max_attempts, submitted, options, origin) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (script, target, delay, instrument, priority, not_before or now, max(1, max_attempts), now,
+                 json.dumps(options) if options else None, self.origin))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        """Return one job, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def recover(self):
+        """Requeue jobs left running by a scheduler that died; returns how many.
+
+        Jobs whose owner is still alive and heartbeating are left alone, even
+        when that owner is another process.
+        """
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute("SELECT id, owner, heartbeat FROM jobs WHERE state = 'running'").fetchall()
+            abandoned = [row["id"] for row in rows
+                         if udp_journal.owner_alive(row["owner"]) is False
+                         or row["heartbeat"] is None or now - row["heartbeat"] > STALE_AFTER]
+            for job_id in abandoned:
+                self.db.execute("UPDATE jobs SET state = 'queued', started = NULL, owner = NULL, heartbeat = NULL "
+                                "WHERE id = ? AND state = 'running'", (job_id,))
+            return len(abandoned)
+
+    def heartbeat(self):
+        """Mark the jobs this process is running as still alive."""
+        with self.lock:
+            self.db.execute("UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND owner = ?", (time.time(), self.owner))
+
+    def claim(self, busy, limits):
+        """Mark the best job that is due and fits the free slots as running and return it, or None.
+
+        busy maps targets and instruments to their running job count.
+        """
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' AND not_before <= ? AND origin IS ? "
+                "ORDER BY priority DESC, not_before, id", (now, self.origin)).fetchall()
+            for row in rows:
+                if busy.get(row["target"], 0) >= limits.get(row["target"], DEFAULT_LIMIT):
+                    continue
+                if row["instrument"] and busy.get(row["instrument"], 0) >= limits.get(row["instrument"], DEFAULT_LIMIT):
+                    continue
+                claimed = self.db.execute(
+                    "UPDATE jobs SET state = 'running', started = ?, attempts = attempts + 1, owner = ?, heartbeat = ? "
+                    "WHERE id = ? AND state = 'queued'", (now, self.owner, now, row["id"])).rowcount
+                if claimed:
+                    return dict(row, state="running", started=now, attempts=row["attempts"] + 1, owner=self.owner, heartbeat=now)
+        return None
+
+    def complete(self, job, ok, error=None):
+        """Record a finished attempt; failed jobs with attempts left are queued again after a backoff."""
+        now = time.time()
+        with self.lock:
+            if ok:
+                self.db.execute("UPDATE jobs SET state = 'done', finished = ?, error = NULL WHERE id = ?", (now, job["id"]))
+                return "done"
+            if job["attempts"] < job["max_attempts"]:
+                self.db.execute("UPDATE jobs SET state = 'queued', not_before = ?, error = ? WHERE id = ?",
+                                (now + RETRY_BACKOFF * job["attempts"], error, job["id"]))
+                return "retry"
+            self.db.execute("UPDATE jobs SET state = 'failed', finished = ?, error = ? WHERE id = ?", (now, error, job["id"]))
+            return "failed"
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started; returns True if it was still queued."""
+        with self.lock:
+            return self.db.execute("UPDATE jobs SET state = 'cancelled' WHERE id = ? AND state = 'queued'", (job_id,)).rowcount > 0
+
+    def jobs(self, states=None):
+        """Return jobs (optionally only those in states) in queue order."""
+        query = "SELECT * FROM jobs"
+        args = ()
+        if states:
+            query += f" WHERE state IN ({', '.join('?' * len(states))})"
+            args = tuple(states)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(query + " ORDER BY priority DESC, not_before, id", args)]
+
+    def next_due(self):
+        """Return the earliest start time of a queued job of this origin, or None if nothing is queued."""
+        with self.lock:
+            return self.db.execute("SELECT MIN(not_before) FROM jobs WHERE state = 'queued' AND origin IS ?",
+                                   (self.origin,)).fetchone()[0]
+
+    def stats(self):
+        """Return job counts by state and queue wait / run time figures of finished jobs."""
+        with self.lock:
+            counts = dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            wait, wait_max, run, run_max = self.db.execute(
+                "SELECT AVG(started - MAX(submitted, not_before)), MAX(started - MAX(submitted, not_before)), "
+                "AVG(finished - started), MAX(finished - started) FROM jobs WHERE state IN ('done', 'failed')").fetchone()
+        return {
+            "counts": {state: counts.get(state, 0) for state in STATES},
+            "mean_wait_seconds": wait, "max_wait_seconds": wait_max,
+            "mean_run_seconds": run, "max_run_seconds": run_max,
+        }
+
+class Scheduler:
+    """Drains a JobQueue through a worker pool on a background thread.
+
+    send_file(script, ip, port, delay, job=<job id>, **options) runs one job
+    and returns True on success (False or an exception counts as a failed
+    attempt); the job id ends up in the run summary, so the run can be told
+    apart from other runs of the script.
+    With run_log, send_file is also given log=<callable>, through which the
+    run reports its own log lines; they reach run_log(job, text).
+    """
+
+    def __init__(self, queue, send_file, limits=None, max_workers=udp_suite.DEFAULT_MAX_WORKERS, log=print, on_change=None,
+                 run_log=None):
+        self.queue = queue
+        self.send_file = send_file
+        self.limits = dict(limits or {})
+        self.max_workers = max(1, max_workers)
+        self.log = log
+        self.on_change = on_change  # Called with (job, "started" / "done" / "retry" / "failed", seconds)
+        self.run_log = run_log
+        self.busy = {}
+        self.running = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self._recover()
+        self.thread = threading.Thread(target=self._loop, name="queue-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self, wait=True):
+        """Stop starting jobs; with wait, also let the running ones finish."""
+        self.stop_event.set()
+        self.wake.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+    def _recover(self):
+        recovered = self.queue.recover()
+        if recovered:
+            self.log(f"Requeued {recovered} jobs whose scheduler stopped while running them")
+
+    def idle(self):
+        """Return True if nothing runs and nothing is queued."""
+        with self.lock:  # Not between a claim and its _take, when the job is neither queued nor counted
+            return self.running == 0 and self.queue.next_due() is None
+
+    def _take(self, job):
+        """Count a claimed job as running; the caller holds self.lock."""
+        self.running += 1
+        for key in (job["target"], job["instrument"]):
+            if key:
+                self.busy[key] = self.busy.get(key, 0) + 1
+
+    def _release(self, job):
+        with self.lock:
+            self.running -= 1
+            for key in (job["target"], job["instrument"]):
+                if key:
+                    self.busy[key] -= 1
+        self.wake.set()
+
+    def _loop(self):
+        beat = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="queue-job") as pool:
+            while not self.stop_event.is_set():
+                self.wake.clear()
+                if time.monotonic() - beat >= HEARTBEAT_INTERVAL:
+                    beat = time.monotonic()
+                    self._heartbeat(recover=True)
+                while True:
+                    with self.lock:
+                        if self.running >= self.max_workers:
+                            break
+                        job = self.queue.claim(self.busy, self.limits)
+                        if job is None:
+                            break
+                        self._take(job)
+                    pool.submit(self._run, job)
+                due = self.queue.next_due()
+                timeout = POLL_INTERVAL if due is None else min(POLL_INTERVAL, max(0.0, due - time.time()))
+                self.wake.wait(timeout)
+            while self.running:  # Stopping: running jobs keep their claim until they finish
+                if time.monotonic() - beat >= HEARTBEAT_INTERVAL:
+                    beat = time.monotonic()
+                    self._heartbeat()
+                self.wake.wait(POLL_INTERVAL)
+                self.wake.clear()
+
+    def _heartbeat(self, recover=False):
+        try:
+            self.queue.heartbeat()
+            if recover:
+                self._recover()  # Jobs of schedulers in other processes that died since
+        except sqlite3.Error as e:
+            self.log(f"Queue heartbeat failed: {e}")
+
+    def _run(self, job):
+        waited = job["started"] - max(job["submitted"], job["not_before"])
+        QUEUE_WAIT_SECONDS.observe(waited)
+        ip, port = udp_suite.parse_target(job["target"])
+        self.log(f"Job {job['id']}: {os.path.basename(job['script'])} on {job['target']} "
+                 f"(attempt {job['attempts']}/{job['max_attempts']}, waited {waited:.1f}s)")
+        if self.on_change is not None:
+            self.on_change(job, "started", 0.0)
+        options = json.loads(job["options"]) if job.get("options") else {}
+        options["job"] = job["id"]
+        if self.run_log is not None:
+            options["log"] = lambda text: self.run_log(job, text)
+        start = time.perf_counter()
+        try:
+            ok, error = bool(self.send_file(job["script"], ip, port, job["delay"], **options)), None
+            if not ok:
+                error = "run reported errors"
+        except Exception as e:
+            ok, error = False, str(e)
+        duration = time.perf_counter() - start
+        JOB_SECONDS.observe(duration)
+        try:
+            outcome = self.queue.complete(job, ok, error)
+        except sqlite3.Error as e:
+            outcome = f"not recorded ({e})"
+        JOBS_FINISHED.inc(outcome=outcome)
+        self.log(f"Job {job['id']}: {outcome} in {duration:.1f}s" + (f": {error}" if error else ""))
+        if self.on_change is not None:
+            self.on_change(dict(job, error=error), outcome, duration)
+        self._release(job)
+
+def format_job(job):
+    start = datetime.fromtimestamp(job["not_before"]).strftime("%Y-%m-%d %H:%M")
+    line = (f"{job['id']:>5}  {job['state']:<9}  p{job['priority']:<3}  {start}  {job['target']:<21}  "
+            f"{os.path.basename(job['script'])}  ({job['attempts']}/{job['max_attempts']} attempts)")
+    return line + (f"  {job['error']}" if job["error"] else "")
+
+def format_stats(stats):
+    counts = ", ".join(f"{count} {state}" for state, count in stats["counts"].items() if count)
+    line = f"Queue: {counts or 'empty'}"
+    if stats["mean_run_seconds"] is not None:
+        line += (f"; wait mean {stats['mean_wait_seconds']:.1f}s / max {stats['max_wait_seconds']:.1f}s"
+                 f", run mean {stats['mean_run_seconds']:.1f}s / max {stats['max_run_seconds']:.1f}s")
+    return line
+
+def run_until_drained(queue, send_file, limits=None, max_workers=udp_suite.DEFAULT_MAX_WORKERS, log=print):
+    """Run the scheduler until no job is queued or running (or Ctrl+C); returns the queue stats."""
+    scheduler = Scheduler(queue, send_file, limits, max_workers, log)
+    scheduler.start()
+    try:
+        while not scheduler.idle():
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        log("Stopping: waiting for running jobs to finish (queued jobs stay queued)")
+    scheduler.stop()
+    return queue.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent run queue for unattended batches.")
+    parser.add_argument("--db", default=QUEUE_DB, help="queue database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="queue command files")
+    add.add_argument("scripts", nargs="+")
+    add.add_argument("--target", action="append", help="ip:port (repeat to queue each script on several boards)")
+    add.add_argument("--delay", type=float, help="seconds between commands")
+    add.add_argument("--priority", type=int, default=0, help="higher runs first")
+    add.add_argument("--at", help='start time, "HH:MM" or "YYYY-MM-DD HH:MM"')
+    add.add_argument("--retries", type=int, default=0, help="extra attempts after a failure")
+    add.add_argument("--instrument", help='shared instrument the job needs, e.g. "scope"')
+    add.add_argument("--pacing", choices=("fixed", "adaptive"), help="override the saved pacing mode")
+    sub.add_parser("list", help="show the queue")
+    cancel = sub.add_parser("cancel", help="cancel queued jobs")
+    cancel.add_argument("ids", nargs="+", type=int)
+    sub.add_parser("run", help="run queued jobs until the queue is drained")
+    args = parser.parse_args()
+
+    import UDP_sender_v7 as sender  # The send engine and the CLI's saved settings
+    config = sender.load_config() or {}
+    queue = JobQueue(args.db)
+    if args.command == "add":
+        targets = args.target or ([f"{config['udp_ip']}:{config['udp_port']}"] if config.get("udp_ip") else None)
+        if not targets:
+            print("No --target given and no saved target in the config file")
+            sys.exit(1)
+        delay = args.delay if args.delay is not None else sender.load_delay()
+        not_before = parse_start(args.at) if args.at else None
+        for script in args.scripts:
+            for target in targets:
+                job_id = queue.submit(script, target, delay, args.priority, not_before, args.retries + 1, args.instrument,
+                                      {"pacing": args.pacing} if args.pacing else None)
+                print(f"Queued job {job_id}: {script} on {target}")
+    elif args.command == "list":
+        for job in queue.jobs():
+            print(format_job(job))
+        print(format_stats(queue.stats()))
+    elif args.command == "cancel":
+        for job_id in args.ids:
+            print(f"Job {job_id}: {'cancelled' if queue.cancel(job_id) else 'not queued'}")
+    elif args.command == "run":
+        sender.ascii_header = ""
+        stats = run_until_drained(queue, sender.send_queued_job, config.get("queue_limits"), sender.load_max_workers())
+        print(format_stats(stats))
+    queue.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import json
+import time
+import select
+from collections import deque
+
+# Closed-loop pacing driven by DUT replies. Every command is expected to get
+# one reply. Replies raise the send rate additively; replies that do not
+# arrive within the timeout count as loss and cut the rate multiplicatively
+# (AIMD, at most once per timeout period), so a run goes as fast as the board
+# keeps up with and slows down as soon as it stops answering.
+#
+# Replies are matched to commands in order, so the round-trip time in the
+# summary is approximate once replies go missing. A board that does not
+# answer at all would otherwise be driven at the slowest rate: after
+# fallback_after commands without a single reply the pacer falls back to the
+# run's fixed delay, and returns to adaptive pacing when a reply arrives.
+# CLI config (the GUI's PACING setting takes the same keys):
+#   "pacing": {"mode": "adaptive", "min_delay": 0.001, "max_delay": 2,
+#              "reply_timeout": 0.2, "increase": 1, "decrease": 0.5,
+#              "fallback_after": 8}   (0: never fall back)
+
+DEFAULT_REPLY_TIMEOUT = 0.2  # Seconds before an unanswered command counts as lost
+DEFAULT_INCREASE = 1.0  # Packets/s added per reply
+DEFAULT_DECREASE = 0.5  # Rate multiplier on loss
+DEFAULT_FALLBACK_AFTER = 8  # Unanswered commands, with no reply yet, before falling back to the fixed delay
+LOG_CHANGE = 0.10  # Report the rate when it moved this much since the last report
+HISTORY_LIMIT = 1000  # Rate changes kept for the summary
+
+class AimdPacer:
+    """Additive-increase / multiplicative-decrease pacer fed by replies on the send socket."""
+
+    def __init__(self, min_rate, max_rate, start_rate=None, reply_timeout=DEFAULT_REPLY_TIMEOUT,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE, on_change=None,
+                 fallback_delay=None, fallback_after=DEFAULT_FALLBACK_AFTER):
+        if min_rate <= 0 or max_rate < min_rate:
+            raise ValueError("adaptive pacing needs 0 < min_rate <= max_rate")
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max_rate, max(min_rate, start_rate or max_rate))
+        self.reply_timeout = reply_timeout
+        self.increase = increase
+        self.decrease = decrease
+        self.on_change = on_change
+        self.fallback_delay = fallback_delay  # The run's fixed delay, used while the board gives no replies (None: never)
+        self.fallback_after = fallback_after
+        self.fallen_back = False
+        self.fallbacks = 0
+        self.outstanding = deque()
+        self.replies = 0
+        self.losses = 0
+        self.rtt_sum = 0.0
+        self.started = time.perf_counter()
+        self.last_decrease = 0.0
+        self.logged_rate = None
+        self.history = deque(maxlen=HISTORY_LIMIT)  # Bounded for multi-day runs
+        self.inbox = None  # Set to a deque to keep the replies for #EXPECT
+        self._record("start")
+
+    @property
+    def delay(self):
+        return self.fallback_delay if self.fallen_back else 1.0 / self.rate
+
+    @property
+    def current_rate(self):
+        """Packets/s actually paced at, the fixed delay's while fallen back."""
+        return 1.0 / self.delay if self.delay > 0 else float(self.max_rate)
+
+    def _record(self, reason):
+        elapsed = round(time.perf_counter() - self.started, 6)
+        rate = self.current_rate
+        self.history.append((elapsed, round(rate, 3), reason))
+        if self.logged_rate is None or reason in ("loss", "no replies", "replies") or abs(rate - self.logged_rate) >= LOG_CHANGE * self.logged_rate:
+            self.logged_rate = rate
+            if self.on_change is not None:
+                self.on_change(elapsed, rate, reason)
+
+    def _reply(self, now):
+        if not self.outstanding:
+            return  # Unsolicited reply
+        sent_at = self.outstanding.popleft()
+        self.replies += 1
+        if self.fallen_back:
+            self.fallen_back = False
+            self._record("replies")  # The board answers after all: back to adaptive pacing
+        self.rtt_sum += now - sent_at
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._record("reply")
+
+    def _expire(self, now):
+        lost = 0
+        while self.outstanding and now - self.outstanding[0] > self.reply_timeout:
+            self.outstanding.popleft()
+            lost += 1
+        if lost:
+            self.losses += lost
+            if self.fallen_back:
+                return  # Nothing to adapt to until the board answers
+            if not self.replies and self.fallback_delay is not None and self.fallback_after and self.losses >= self.fallback_after:
+                self.fallen_back = True
+                self.fallbacks += 1
+                self._record("no replies")
+                return
+            if now - self.last_decrease > self.reply_timeout:
+                self.last_decrease = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._record("loss")
+
+    def _drain(self, sock, timeout):
+        """Read every reply that arrives within timeout seconds."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = max(0.0, deadline - time.perf_counter())
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                return
+            try:
+                data, _ = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                return  # e.g. ICMP port unreachable on some platforms; treat as no reply
+            self._reply(time.perf_counter())
+            if self.inbox is not None:
+                self.inbox.append(data)
+            if remaining <= 0:
+                deadline = time.perf_counter()  # Drain what is queued, then return
+
+    def after_send(self, sock, sent_at):
+        """Account for a datagram sent at sent_at and wait until the next send is due."""
+        self.outstanding.append(sent_at)
+        while True:
+            now = time.perf_counter()
+            self._expire(now)
+            due = sent_at + self.delay
+            if now >= due:
+                self._drain(sock, 0)
+                return
+            self._drain(sock, due - now)
+
+    def finish(self, sock):
+        """Wait for replies still in flight so the last commands are judged too."""
+        if self.outstanding:
+            self._drain(sock, self.reply_timeout)
+            self._expire(time.perf_counter() + self.reply_timeout + 1e-6)
+
+    def summary(self):
+        return {
+            "final_rate_pps": round(self.current_rate, 3),
+            "replies": self.replies,
+            "losses": self.losses,
+            "fixed_delay_fallbacks": self.fallbacks,
+            "mean_rtt_ms": round(self.rtt_sum / self.replies * 1000.0, 3) if self.replies else None,
+            "rate_history": list(self.history),
+        }
+
+def pacer_from_config(config, max_delay, on_change=None):
+    """Build an AimdPacer from a config dict ({"min_delay", "max_delay", "reply_timeout", ...}).
+
+    max_delay is the run's fixed delay: the slowest rate unless the config
+    says otherwise, and the delay used while the board gives no replies.
+    """
+    slowest = float(config.get("max_delay", max_delay) or 1.0)
+    fastest = float(config.get("min_delay", 0.001))
+    return AimdPacer(
+        min_rate=1.0 / slowest,
+        max_rate=1.0 / fastest,
+        start_rate=config.get("start_rate"),
+        reply_timeout=float(config.get("reply_timeout", DEFAULT_REPLY_TIMEOUT)),
+        increase=float(config.get("increase", DEFAULT_INCREASE)),
+        decrease=float(config.get("decrease", DEFAULT_DECREASE)),
+        on_change=on_change,
+        fallback_delay=max_delay,
+        fallback_after=int(config.get("fallback_after", DEFAULT_FALLBACK_AFTER)),
+    )
+
+def write_report(summary, path):
+    """Write a pacer summary (with its rate history) as JSON and return its path."""
+    with open(path, "w") as file:
+        json.dump(summary, file, indent=4)
+    return path
@@ -0,0 +1,338 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import argparse
+from datetime import datetime, timedelta
+
+import udp_blobs
+import udp_journal
+
+# Retention for the results directory. A run is everything sharing one
+# "<yyyyMMdd_HHmmss_zzz>_<script>" key: the run log, its _summary/_trace/...
+# side files and the scopeshot folder. Runs that fall outside the policy are
+# packed into one zip per month under results/archive/ and removed from the
+# live tree; list_runs() and read_run_file() browse live and archived runs
+# alike.
+#
+# Policy (udp_config.json "retention", or command line options):
+#   {"max_age_days": 90, "keep_per_script": 50, "max_total_mb": 2048}
+#
+#   python udp_retention.py [results] [--max-age-days N] [--keep N] [--max-mb N] [--dry-run]
+#
+# Runs with a journal are never archived: either they are still running
+# (a soak in another process, a queue job) or they were interrupted and
+# can be resumed. Sizes count scopeshots linked from the blob store only
+# where nothing else links to them, since archiving one run does not free
+# a shared blob.
+#
+# Archives are zip rather than tar.zst: zip is in the standard library and
+# allows reading one member without unpacking the rest, which browsing needs.
+# Scopeshots are stored uncompressed (PNG already is) and identical images
+# are stored once per archive, with a per-run .links.json pointing at them.
+
+ARCHIVE_DIR = "archive"
+LINKS_FILE = ".links.json"
+RUN_RE = re.compile(r"^(\d{8}_\d{6}_\d{3})_(.+)$")
+SEGMENT_RE = re.compile(r"\.\d{4,}$")  # Rotated soak log segments, <key>.0001.txt.gz (udp_soak.py)
+# Every side file the tools write next to a run log. A side file with no run
+# in front of its suffix (<stamp>_suite_timing.json) is a run of its own.
+SIDE_SUFFIXES = ("_summary", "_trace", "_profile", "_loss", "_rate", "_journal", "_soak", "_suite_timing")
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".pcap", ".zip", ".gz")
+
+_archive_cache = {}
+
+def run_key(name):
+    """Return the run key for a results entry name, or None if it is not part of a run."""
+    if name.endswith(".gz"):
+        name = name[:-len(".gz")]
+    base = name if "." not in name else name.rsplit(".", 1)[0]
+    base = SEGMENT_RE.sub("", base)
+    for suffix in SIDE_SUFFIXES:
+        if base.endswith(suffix) and RUN_RE.match(base[:-len(suffix)]):
+            base = base[:-len(suffix)]
+            break
+    return base if RUN_RE.match(base) else None
+
+def _parse_key(key):
+    stamp, script = RUN_RE.match(key).groups()
+    return datetime.strptime(stamp[:15], "%Y%m%d_%H%M%S"), script
+
+def _file_size(path):
+    info = os.stat(path)
+    return info.st_size if info.st_nlink == 1 else 0  # A blob store link: freed only with its last link
+
+def _entry_size(path):
+    if os.path.isdir(path):
+        total = 0
+        for folder, _, files in os.walk(path):
+            for name in files:
+                total += _file_size(os.path.join(folder, name))
+        return total
+    return _file_size(path)
+
+def scan_runs(results_dir):
+    """Return the live runs in results_dir as dicts, oldest first."""
+    runs = {}
+    if not os.path.isdir(results_dir):
+        return []
+    for name in os.listdir(results_dir):
+        if name.startswith("."):
+            continue
+        key = run_key(name)
+        if key is None:
+            continue
+        path = os.path.join(results_dir, name)
+        run = runs.get(key)
+        if run is None:
+            started, script = _parse_key(key)
+            run = runs[key] = {"key": key, "script": script, "started": started, "paths": [], "size": 0, "archive": None,
+                               "journal": None}
+        if name.endswith(udp_journal.JOURNAL_SUFFIX):
+            run["journal"] = path
+        run["paths"].append(path)
+        run["size"] += _entry_size(path)
+    return sorted(runs.values(), key=lambda run: run["key"])
+
+def _archive_index(archive_path):
+    """Return {key: [member names]} for an archive, cached by file mtime."""
+    mtime = os.path.getmtime(archive_path)
+    cached = _archive_cache.get(archive_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    index = {}
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.namelist():
+            key = run_key(member.split("/", 1)[0])
+            if key is not None:
+                index.setdefault(key, []).append(member)
+    _archive_cache[archive_path] = (mtime, index)
+    return index
+
+def archived_runs(results_dir):
+    """Return the runs packed into results_dir/archive as dicts, oldest first."""
+    archive_dir = os.path.join(results_dir, ARCHIVE_DIR)
+    runs = []
+    if not os.path.isdir(archive_dir):
+        return runs
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith(".zip"):
+            continue
+        archive_path = os.path.join(archive_dir, name)
+        try:
+            index = _archive_index(archive_path)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Skipping unreadable archive {archive_path}: {e}")
+            continue
+        for key, members in index.items():
+            started, script = _parse_key(key)
+            runs.append({"key": key, "script": script, "started": started, "paths": members, "size": None, "archive": archive_path})
+    return sorted(runs, key=lambda run: run["key"])
+
+def list_runs(results_dir, search=""):
+    """Return live and archived runs whose key contains search (case-insensitive), oldest first."""
+    search = search.lower()
+    runs = scan_runs(results_dir) + archived_runs(results_dir)
+    return sorted((run for run in runs if search in run["key"].lower()), key=lambda run: run["key"])
+
+def run_files(run):
+    """Return the display names of a run's files: top-level side files and folder contents."""
+    names = []
+    if run["archive"]:
+        for member in run["paths"]:
+            if member.endswith("/") or member.endswith(LINKS_FILE):
+                continue
+            names.append(member.split("/", 1)[1] if "/" in member else member)
+        with zipfile.ZipFile(run["archive"]) as archive:
+            for links in (m for m in run["paths"] if m.endswith(LINKS_FILE)):
+                names.extend(name.split("/", 1)[1] for name in json.loads(archive.read(links)))
+        return sorted(names)
+    for path in run["paths"]:
+        if os.path.isdir(path):
+            names.extend(name for name in os.listdir(path) if name != udp_blobs.CATALOG_FILE)
+            try:
+                names.extend(udp_blobs.load_catalog(path))
+            except (OSError, ValueError):
+                pass
+        else:
+            names.append(os.path.basename(path))
+    return sorted(set(names))
+
+def read_run_file(results_dir, run, name):
+    """Return the bytes of one file of a live or archived run."""
+    key = run["key"]
+    if run["archive"]:
+        with zipfile.ZipFile(run["archive"]) as archive:
+            members = set(run["paths"])
+            member = name if name in members else f"{key}/{name}"
+            if member not in members:
+                links_member = f"{key}/{LINKS_FILE}"
+                links = json.loads(archive.read(links_member)) if links_member in members else {}
+                member = links.get(member, member)
+            return archive.read(member)
+    folder = os.path.join(results_dir, key)
+    path = os.path.join(results_dir, name)
+    if not os.path.exists(path) or run_key(name) != key:
+        path = udp_blobs.resolve(results_dir, folder, name)
+    with open(path, "rb") as file:
+        return file.read()
+
+def _in_progress(run):
+    """Return True if the run's journal belongs to a process that is still running it."""
+    record = udp_journal.load(run["journal"])
+    return record is not None and bool(udp_journal.owner_alive(record.get("owner")))
+
+def select_expired(runs, policy, now=None):
+    """Return the runs that fall outside the policy, each with the reason; runs with a journal are kept."""
+    now = now or datetime.now()
+    expired = {}
+    kept = {run["key"] for run in runs if run.get("journal")}
+    max_age = policy.get("max_age_days")
+    if max_age is not None:
+        cutoff = now - timedelta(days=float(max_age))
+        for run in runs:
+            if run["started"] < cutoff and run["key"] not in kept:
+                expired.setdefault(run["key"], (run, "age"))
+    keep = policy.get("keep_per_script")
+    if keep is not None:
+        by_script = {}
+        for run in runs:
+            by_script.setdefault(run["script"], []).append(run)
+        for script_runs in by_script.values():
+            for run in script_runs[:max(0, len(script_runs) - int(keep))]:
+                if run["key"] not in kept:
+                    expired.setdefault(run["key"], (run, "count"))
+    max_mb = policy.get("max_total_mb")
+    if max_mb is not None:
+        remaining = sum(run["size"] for run in runs if run["key"] not in expired)
+        for run in runs:  # Oldest first
+            if remaining <= float(max_mb) * 1e6:
+                break
+            if run["key"] not in expired and run["key"] not in kept:
+                expired[run["key"]] = (run, "size")
+                remaining -= run["size"]
+    return [expired[run["key"]] for run in runs if run["key"] in expired]
+
+def _load_digests(archive_path):
+    path = archive_path + ".digests.json"
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+def _save_digests(archive_path, digests):
+    with open(archive_path + ".digests.json", "w") as file:
+        json.dump(digests, file)
+
+def archive_run(results_dir, run):
+    """Append a live run to its month's archive; returns the archive path. Originals are left in place."""
+    archive_dir = os.path.join(results_dir, ARCHIVE_DIR)
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, run["started"].strftime("%Y%m") + ".zip")
+    digests = _load_digests(archive_path)
+    links = {}
+    with zipfile.ZipFile(archive_path, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+        existing = set(archive.namelist())
+        files = []
+        for path in run["paths"]:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if name != udp_blobs.CATALOG_FILE:
+                        files.append((os.path.join(path, name), f"{run['key']}/{name}"))
+                try:
+                    for name in udp_blobs.load_catalog(path):
+                        files.append((udp_blobs.resolve(results_dir, path, name), f"{run['key']}/{name}"))
+                except (OSError, ValueError):
+                    pass
+            else:
+                files.append((path, os.path.basename(path)))
+        for path, member in files:
+            if member in existing or not os.path.isfile(path):
+                continue
+            with open(path, "rb") as file:
+                data = file.read()
+            stored = member.lower().endswith(STORED_EXTENSIONS)
+            if stored:
+                digest = hashlib.sha256(data).hexdigest()
+                if digest in digests and digests[digest] in existing:
+                    links[member] = digests[digest]
+                    continue
+                digests[digest] = member
+            archive.writestr(member, data, compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+            existing.add(member)
+        if links:
+            archive.writestr(f"{run['key']}/{LINKS_FILE}", json.dumps(links))
+    _save_digests(archive_path, digests)
+    return archive_path
+
+def remove_run(run):
+    for path in run["paths"]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def apply_retention(results_dir, policy, dry_run=False, log=print):
+    """Archive and remove every run outside the policy; return a summary dict."""
+    runs = scan_runs(results_dir)
+    expired = select_expired(runs, policy)
+    summary = {"runs": len(runs), "archived": 0, "bytes_freed": 0, "errors": 0, "archives": []}
+    if dry_run:
+        for run in runs:
+            if run["journal"]:
+                log(f"Keeping {run['key']} ({'in progress' if _in_progress(run) else 'interrupted; resume or discard it first'})")
+    for run, reason in expired:
+        if dry_run:
+            log(f"Would archive {run['key']} ({reason}, {run['size'] / 1e6:.1f} MB)")
+            continue
+        try:
+            archive_path = archive_run(results_dir, run)
+            remove_run(run)
+        except (OSError, zipfile.BadZipFile) as e:
+            summary["errors"] += 1
+            log(f"Could not archive {run['key']}: {e}")
+            continue
+        summary["archived"] += 1
+        summary["bytes_freed"] += run["size"]
+        if archive_path not in summary["archives"]:
+            summary["archives"].append(archive_path)
+    if summary["archived"]:
+        udp_blobs.BlobStore(results_dir).remove_orphans()  # Free scopeshots no live run links any more
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old runs out of the results directory.")
+    parser.add_argument("results", nargs="?", default="results", help="results directory")
+    parser.add_argument("--config", default="udp_config.json", help="config file with a \"retention\" policy")
+    parser.add_argument("--max-age-days", type=float)
+    parser.add_argument("--keep", type=int, dest="keep_per_script", help="runs to keep per script")
+    parser.add_argument("--max-mb", type=float, dest="max_total_mb", help="total size of live runs")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be archived")
+    args = parser.parse_args()
+
+    policy = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as file:
+            policy = json.load(file).get("retention") or {}
+    for key in ("max_age_days", "keep_per_script", "max_total_mb"):
+        if getattr(args, key) is not None:
+            policy[key] = getattr(args, key)
+    if not policy:
+        print("No retention policy given; nothing to do.")
+        sys.exit(1)
+    summary = apply_retention(args.results, policy, args.dry_run)
+    if not args.dry_run:
+        print(f"Archived {summary['archived']} of {summary['runs']} runs, freed {summary['bytes_freed'] / 1e6:.1f} MB")
+        for archive_path in summary["archives"]:
+            print(f"  {archive_path}")
+    if summary["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import json
+import time
+import struct
+
+# Opt-in sequence stamping. The sender adds a 14-byte stamp to every datagram
+# (as a header before the payload or a trailer after it):
+#
+#   5E 51 | sequence (u32, big-endian) | send time (u64 ns since the epoch)
+#
+# The receiving side recognises the magic, tracks gaps, reordering,
+# duplicates and one-way delay in a sliding bitmap window, and produces a loss
+# report. Both positions are detected automatically on receive.
+
+MAGIC = b"\x5e\x51"
+STAMP = struct.Struct(">2sIQ")
+STAMP_SIZE = STAMP.size
+POSITIONS = ("header", "trailer")
+DEFAULT_WINDOW = 4096  # Sequence numbers remembered for reorder/duplicate detection
+
+class SequenceStamper:
+    """Stamps outgoing datagrams with a sequence number and send timestamp."""
+
+    def __init__(self, position="trailer", start=0):
+        if position not in POSITIONS:
+            raise ValueError(f"sequence position must be one of {POSITIONS}")
+        self.position = position
+        self.first = start
+        self.next = start
+        self.started = time.time()
+
+    def stamp(self, payload):
+        """Return payload with the next sequence stamp attached."""
+        stamp = STAMP.pack(MAGIC, self.next & 0xFFFFFFFF, time.time_ns())
+        self.next += 1
+        return stamp + bytes(payload) if self.position == "header" else bytes(payload) + stamp
+
+    def report(self):
+        """Return the sender-side half of the loss report."""
+        duration = time.time() - self.started
+        sent = self.next - self.first
+        return {
+            "side": "sender",
+            "position": self.position,
+            "first_seq": self.first,
+            "last_seq": self.next - 1 if sent else None,
+            "packets_sent": sent,
+            "duration": round(duration, 6),
+            "rate_pps": round(sent / duration, 3) if duration > 0 else None,
+        }
+
+def split_stamp(data):
+    """Return (payload, seq, send_ns) for a stamped datagram, or (data, None, None) if unstamped."""
+    if len(data) >= STAMP_SIZE:
+        if data[:2] == MAGIC:
+            _, seq, send_ns = STAMP.unpack_from(data, 0)
+            return data[STAMP_SIZE:], seq, send_ns
+        if data[-STAMP_SIZE:-STAMP_SIZE + 2] == MAGIC:
+            _, seq, send_ns = STAMP.unpack_from(data, len(data) - STAMP_SIZE)
+            return data[:-STAMP_SIZE], seq, send_ns
+    return data, None, None
+
+class LossTracker:
+    """Tracks gaps, reorders, duplicates and one-way delay for one stamped stream.
+
+    Bit i of the window is set when sequence (highest - i) has arrived, so
+    each datagram costs a shift and a mask regardless of the run length.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.bitmap = 0
+        self.first = None
+        self.highest = None
+        self.received = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.too_late = 0
+        self.gap_events = 0
+        self.delay_min = None
+        self.delay_max = None
+        self.delay_sum = 0
+
+    def add(self, seq, send_ns=None, recv_ns=None):
+        """Account for one received sequence number."""
+        self.received += 1
+        if send_ns is not None:
+            delay = (recv_ns if recv_ns is not None else time.time_ns()) - send_ns
+            self.delay_sum += delay
+            self.delay_min = delay if self.delay_min is None else min(self.delay_min, delay)
+            self.delay_max = delay if self.delay_max is None else max(self.delay_max, delay)
+
+        if self.highest is None:
+            self.first = self.highest = seq
+            self.bitmap = 1
+            self.unique = 1
+            return
+        if seq > self.highest:
+            shift = seq - self.highest
+            if shift > 1:
+                self.gap_events += 1
+            self.bitmap = ((self.bitmap << shift) | 1) & self.mask if shift < self.window else 1
+            self.highest = seq
+            self.unique += 1
+            return
+        offset = self.highest - seq
+        if offset >= self.window or seq < self.first:
+            self.too_late += 1  # Outside the window: cannot tell late from duplicate
+            return
+        bit = 1 << offset
+        if self.bitmap & bit:
+            self.duplicates += 1
+        else:
+            self.bitmap |= bit
+            self.reordered += 1
+            self.unique += 1
+
+    def report(self):
+        """Return the receiver-side half of the loss report."""
+        expected = (self.highest - self.first + 1) if self.highest is not None else 0
+        lost = max(0, expected - self.unique)
+        timed = self.received
+        return {
+            "side": "receiver",
+            "first_seq": self.first,
+            "last_seq": self.highest,
+            "expected": expected,
+            "received": self.received,
+            "unique": self.unique,
+            "lost": lost,
+            "loss_ratio": round(lost / expected, 6) if expected else 0.0,
+            "gap_events": self.gap_events,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "outside_window": self.too_late,
+            "one_way_delay_us": {
+                "min": self.delay_min / 1000.0 if self.delay_min is not None else None,
+                "mean": self.delay_sum / timed / 1000.0 if timed and self.delay_min is not None else None,
+                "max": self.delay_max / 1000.0 if self.delay_max is not None else None,
+            },
+        }
+
+class StreamTracker:
+    """Keeps one LossTracker per sender address."""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.streams = {}
+
+    def add(self, data, addr, recv_ns=None):
+        """Track a received datagram; returns the payload with any stamp removed."""
+        payload, seq, send_ns = split_stamp(data)
+        if seq is not None:
+            tracker = self.streams.get(addr)
+            if tracker is None:
+                tracker = self.streams[addr] = LossTracker(self.window)
+            tracker.add(seq, send_ns, recv_ns)
+        return payload
+
+    def report(self):
+        return {f"{addr[0]}:{addr[1]}": tracker.report() for addr, tracker in self.streams.items()}
+
+def write_report(report, path):
+    """Write a loss report as JSON and return its path."""
+    with open(path, "w") as file:
+        json.dump(report, file, indent=4)
+    return path
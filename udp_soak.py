@@ -0,0 +1,163 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import threading
+from collections import deque
+
+import udp_blobs
+
+# Soak mode: loop a script (or CMD_ suite) until stopped, for runs lasting
+# days. Everything a run accumulates is bounded:
+#   - the run log rolls over by size or age into numbered .gz segments, of
+#     which only the newest keep_logs are kept
+#   - only the newest max_captures scopeshots stay in the run folder
+#   - statistics live in the run's histograms and counters (RunMetrics),
+#     never in per-packet lists
+#   - counters are checkpointed to <log name>_soak.json every
+#     checkpoint_seconds, so a crashed run still leaves its numbers behind
+
+DEFAULT_POLICY = {
+    "max_log_bytes": 16 * 1024 * 1024,  # Roll the run log over at this size...
+    "rotate_seconds": 24 * 3600,  # ...or at this age, whichever comes first
+    "keep_logs": 14,  # Compressed segments kept
+    "max_captures": 200,  # Scopeshots kept in the run folder
+    "checkpoint_seconds": 60.0,
+}
+PASS_LOOP = "soak pass"  # Loop name the per-pass durations are recorded under
+
+def soak_policy(overrides=None):
+    """Return DEFAULT_POLICY updated with overrides (e.g. the "soak" entry of a config file)."""
+    policy = dict(DEFAULT_POLICY)
+    policy.update(overrides or {})
+    return policy
+
+class RotatingLog:
+    """A text log file that rolls over into gzip-compressed segments.
+
+    Writes go to path; on rollover the file becomes <name>.<n>.txt.gz
+    (compressed on a helper thread so the sender is not held up) and a new
+    path is started. Drop-in for the file object run logs are written to.
+    With append, a resumed run continues the log and its segment numbering.
+    """
+
+    def __init__(self, path, max_bytes, rotate_seconds, keep, append=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.keep = keep
+        self.segment = 0
+        self.segments = deque()
+        self._compressing = None
+        if append:
+            self._find_segments()
+        self._open("a" if append else "w")
+
+    def _find_segments(self):
+        folder, base = os.path.split(self.path.rsplit(".", 1)[0])
+        pattern = re.compile(re.escape(base) + r"\.(\d{4,})\.txt\.gz$")
+        found = sorted((int(m.group(1)), name) for name in os.listdir(folder or ".") for m in [pattern.match(name)] if m)
+        self.segments.extend(os.path.join(folder, name) for number, name in found)
+        self.segment = found[-1][0] if found else 0
+
+    def _open(self, mode="w"):
+        self.file = open(self.path, mode)
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+
+    def write(self, text):
+        self.file.write(text)
+        self.size += len(text)
+        if self.size >= self.max_bytes or time.monotonic() - self.opened >= self.rotate_seconds:
+            self.rotate()
+
+    def flush(self):
+        self.file.flush()
+
+    def rotate(self):
+        """Close the current file, compress it in the background and start a new one."""
+        self.file.close()
+        self.segment += 1
+        base = self.path.rsplit(".", 1)[0]
+        raw = f"{base}.{self.segment:04d}.txt"
+        os.replace(self.path, raw)
+        self._open()
+        if self._compressing is not None:
+            self._compressing.join()  # At most one segment is compressed at a time
+        self.segments.append(raw + ".gz")
+        expired = []
+        while len(self.segments) > self.keep:
+            expired.append(self.segments.popleft())
+        self._compressing = threading.Thread(target=self._compress, args=(raw, expired), name="log-compress", daemon=True)
+        self._compressing.start()
+
+    @staticmethod
+    def _compress(raw, expired):
+        try:
+            with open(raw, "rb") as src, gzip.open(raw + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(raw)
+            for path in expired:
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError:
+            pass  # The uncompressed segment stays; nothing is lost
+
+    def close(self):
+        self.file.close()
+        if self._compressing is not None:
+            self._compressing.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CaptureWindow:
+    """Keeps only the newest max_captures scopeshots of a run folder."""
+
+    def __init__(self, results_dir, max_captures):
+        self.store = udp_blobs.BlobStore(results_dir)
+        self.max_captures = max_captures
+        self.paths = deque()
+        self.dropped = 0
+
+    def add(self, path):
+        """Register a capture just stored at path; remove the oldest ones beyond the window."""
+        self.paths.append(path)
+        while len(self.paths) > self.max_captures:
+            try:
+                self.store.remove(self.paths.popleft())
+                self.dropped += 1
+            except OSError:
+                pass
+
+class Checkpoint:
+    """Writes a soak run's counters to disk at most every interval seconds."""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.written = 0.0
+
+    def due(self):
+        return time.monotonic() - self.written >= self.interval
+
+    def write(self, state):
+        """Atomically replace the checkpoint file with state."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(state, file, indent=4)
+        os.replace(tmp, self.path)
+        self.written = time.monotonic()
+        return self.path
+
+def checkpoint_state(script, passes, metrics, captures=None):
+    """Return the JSON-ready counters of a soak run after passes completed passes."""
+    state = {"script": script, "passes": passes, "updated": time.time(), "metrics": metrics.summary()}
+    if captures is not None:
+        state["captures_dropped"] = captures.dropped
+    return state
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import udp_plan
+
+# Suite scheduler for "Send all files": runs independent command files in
+# parallel lanes (one lane per target) while keeping CMD_ lists in order.
+
+COMMANDS_FOLDER = "commands"
+RESULTS_DIR = "results"
+DEFAULT_MAX_WORKERS = 4
+
+def parse_target(target, default_port=None):
+    """Parse an "ip:port" string (or [ip, port] pair) into an (ip, port) tuple."""
+    if isinstance(target, (list, tuple)):
+        return target[0], int(target[1])
+    host, _, port = str(target).rpartition(":")
+    if not host:
+        if default_port is None:
+            raise ValueError(f"Target {target!r} has no port")
+        return str(target), int(default_port)
+    return host, int(port)
+
+def estimate_duration(file_path, delay, commands_folder=COMMANDS_FOLDER):
+    """Estimate how long a command file takes to send (one delay per command)."""
+    try:
+        plan = udp_plan.open_plan(file_path, commands_folder)
+        return udp_plan.estimate_packets(plan) * delay
+    except (udp_plan.PlanError, OSError):
+        return 0.0
+
+def build_jobs(files, commands_folder=COMMANDS_FOLDER):
+    """Group command files into jobs that must each run strictly in order.
+
+    Every CMD_ list becomes one ordered job. Files that a CMD_ list references,
+    directly or through nested lists, only run as part of that list; every
+    other file is an independent job. Returns (jobs, problems) so broken
+    lists are reported before anything is sent.
+    """
+    jobs = []
+    problems = []
+    referenced = set()
+    for name in files:
+        if not name.startswith("CMD_"):
+            continue
+        file_path = os.path.join(commands_folder, name)
+        try:
+            plan = udp_plan.open_plan(file_path, commands_folder)
+        except udp_plan.PlanError as e:
+            problems.extend(f"{name}: {problem}" for problem in e.problems)
+            continue
+        referenced.update(os.path.basename(path) for path in plan["deps"])
+        jobs.append({"name": name, "files": udp_plan.read_cmd_list(file_path)})
+    for name in files:
+        if not name.startswith("CMD_") and name not in referenced:
+            jobs.append({"name": name, "files": [name]})
+    return jobs, problems
+
+def assign_lanes(jobs, targets, delay, commands_folder=COMMANDS_FOLDER):
+    """Spread jobs over targets, longest first onto the least loaded target."""
+    lanes = [{"target": target, "jobs": [], "estimate": 0.0} for target in targets]
+    for job in jobs:
+        job["estimate"] = sum(estimate_duration(os.path.join(commands_folder, f), delay, commands_folder) for f in job["files"])
+    for job in sorted(jobs, key=lambda j: j["estimate"], reverse=True):
+        lane = min(lanes, key=lambda l: l["estimate"])
+        lane["jobs"].append(job)
+        lane["estimate"] += job["estimate"]
+    return [lane for lane in lanes if lane["jobs"]]
+
+def run_lane(lane, delay, send_file, commands_folder=COMMANDS_FOLDER, stop_event=None):
+    """Run all jobs of one lane back to back against the lane's target and time every file.
+
+    send_file returns True if the file was sent completely; a False return
+    or an exception marks the file "failed" and the lane carries on.
+    """
+    udp_ip, udp_port = lane["target"]
+    results = []
+    for job in lane["jobs"]:
+        job_start = time.perf_counter()
+        file_results = []
+        for name in job["files"]:
+            if stop_event is not None and stop_event.is_set():
+                break
+            file_path = os.path.join(commands_folder, name)
+            start = time.perf_counter()
+            error = None
+            if os.path.exists(file_path):
+                try:
+                    status = "sent" if send_file(file_path, udp_ip, udp_port, delay) else "failed"
+                except Exception as e:
+                    print(f"Error sending {name}: {e}")
+                    status, error = "failed", str(e)
+            else:
+                print(f"Warning: Command file {name} not found.")
+                status = "missing"
+            file_results.append({
+                "file": name,
+                "status": status,
+                "start": round(start - lane["t0"], 6),
+                "duration": round(time.perf_counter() - start, 6),
+            })
+            if error is not None:
+                file_results[-1]["error"] = error
+        results.append({
+            "job": job["name"],
+            "target": f"{udp_ip}:{udp_port}",
+            "files": file_results,
+            "duration": round(time.perf_counter() - job_start, 6),
+        })
+    return results
+
+def write_timing_report(report, results_dir=RESULTS_DIR):
+    """Write the suite timing report as JSON into the results folder and return its path."""
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    report_path = os.path.join(results_dir, f"{stamp}_suite_timing.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=4)
+    return report_path
+
+def run_suite(files, targets, delay, send_file, max_workers=DEFAULT_MAX_WORKERS,
+              commands_folder=COMMANDS_FOLDER, results_dir=RESULTS_DIR, stop_event=None):
+    """Run a whole command suite through a bounded pool of per-target lanes.
+
+    Each target gets at most one script at a time, so wall-clock time is
+    roughly the longest lane instead of the sum of all scripts.
+    """
+    jobs, problems = build_jobs(files, commands_folder)
+    for problem in problems:
+        print(f"Skipping broken CMD_ list: {problem}")
+    lanes = assign_lanes(jobs, targets, delay, commands_folder)
+    t0 = time.perf_counter()
+    for lane in lanes:
+        lane["t0"] = t0
+
+    job_results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(run_lane, lane, delay, send_file, commands_folder, stop_event) for lane in lanes]
+        for future in futures:
+            try:
+                lane_results = future.result()
+            except Exception as e:
+                print(f"Error running suite lane: {e}")
+                continue
+            job_results.extend(lane_results)
+
+    wall = time.perf_counter() - t0
+    serial = sum(f["duration"] for job in job_results for f in job["files"])
+    report = {
+        "targets": [f"{ip}:{port}" for ip, port in targets],
+        "max_workers": max_workers,
+        "delay": delay,
+        "jobs": job_results,
+        "problems": problems,
+        "wall_time": round(wall, 6),
+        "serial_time": round(serial, 6),
+        "speedup": round(serial / wall, 3) if wall > 0 else None,
+    }
+    report["report_path"] = write_timing_report(report, results_dir)
+    return report
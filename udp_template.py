@@ -0,0 +1,221 @@
+import re
+import time
+import numpy as np
+import udp_checksum
+import udp_seq
+import udp_trace
+
+# Parametrized packet templates. A command file line such as
+#
+#   #TEMPLATE 1000000 DELAY 0 A5 01 {counter:4:0x1000:1} {range:1:0x10:0x1F} {random:2} {crc16}
+#
+# describes COUNT payloads made of fixed hex bytes and variable fields. All
+# payloads are generated with vectorized NumPy operations into one contiguous
+# buffer and sent straight from it, without per-packet Python formatting.
+#
+# Fields ({kind:args}, sizes in bytes, big-endian unless the size ends in "le"):
+#   {counter:SIZE[:START[:STEP]]}   START + STEP * n, wrapping at the field width
+#   {range:SIZE:LO:HI}              cycles LO..HI inclusive
+#   {random:SIZE[:SEED]}            uniform random bytes
+#   {crc16} / {crc32le:2} / ...     checksum over the bytes before the field,
+#                                   optionally from START (see udp_checksum.py)
+#
+# Packets are sent as binary, or with text as ASCII hex (two digits per
+# byte, the command line sender's wire format); checksums cover the bytes
+# actually sent either way.
+
+DEFAULT_CHUNK = 65536  # Packets generated per vectorized pass
+_HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+SAMPLE_EVERY = 64  # Time one send in this many when collecting metrics
+
+_TOKEN_RE = re.compile(r"\{[^}]*\}|[^\s{}]+")
+
+class PacketTemplate:
+    """A compiled #TEMPLATE directive."""
+
+    def __init__(self, fields, count, delay=None, text=""):
+        self.fields = fields
+        self.count = count
+        self.delay = delay
+        self.text = text
+        self.length = sum(field["size"] for field in fields)
+
+    def __repr__(self):
+        return f"PacketTemplate({self.count} x {self.length} bytes)"
+
+    def generate(self, start=0, stop=None, text=False):
+        """Generate packets start..stop-1 as a C-contiguous (rows, length) uint8 array.
+
+        With text, rows are ASCII hex, (rows, 2 * length).
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        rows = max(0, stop - start)
+        buf = np.zeros((rows, self.length), dtype=np.uint8)
+        index = np.arange(start, stop, dtype=np.uint64)
+        offset = 0
+        for field in self.fields:
+            size = field["size"]
+            kind = field["kind"]
+            if kind == "hex":
+                buf[:, offset:offset + size] = field["data"]
+            elif kind == "random":
+                rng = np.random.default_rng(None if field["seed"] is None else field["seed"] + start)
+                buf[:, offset:offset + size] = rng.integers(0, 256, size=(rows, size), dtype=np.uint8)
+            elif kind in ("counter", "range"):
+                if kind == "counter":
+                    values = np.uint64(field["start"]) + np.uint64(field["step"]) * index
+                else:
+                    span = np.uint64(field["hi"] - field["lo"] + 1)
+                    values = np.uint64(field["lo"]) + index % span
+                _write_int_column(buf, offset, size, values, field["little"])
+            else:
+                _write_checksum_column(buf, offset, field, text)
+            offset += size
+        return _hexlify(buf) if text else buf
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK, text=False):
+        """Yield (array, first_index) chunks covering the whole template."""
+        for start in range(0, self.count, chunk_size):
+            yield self.generate(start, start + chunk_size, text), start
+
+def _hexlify(buf):
+    """Return the ASCII hex form of a (rows, length) uint8 array, (rows, 2 * length)."""
+    out = np.empty((buf.shape[0], 2 * buf.shape[1]), dtype=np.uint8)
+    out[:, 0::2] = _HEX_DIGITS[buf >> 4]
+    out[:, 1::2] = _HEX_DIGITS[buf & 0x0F]
+    return out
+
+def _write_int_column(buf, offset, size, values, little):
+    """Write integer values into a SIZE-byte column, one vectorized pass per byte."""
+    for i in range(size):
+        shift = np.uint64(8 * (i if little else size - 1 - i))
+        buf[:, offset + i] = ((values >> shift) & np.uint64(0xFF)).astype(np.uint8)
+
+def _write_checksum_column(buf, offset, field, text=False):
+    """Fill a checksum field for every packet from the bytes that precede it (their hex text with text)."""
+    covered = buf[:, field["start"]:offset]
+    values = udp_checksum.checksum_rows(field["algorithm"], _hexlify(covered) if text else covered)
+    _write_int_column(buf, offset, field["size"], values, field["little"])
+
+def _parse_int(text):
+    return int(text, 0)
+
+def _parse_size(text):
+    little = text.lower().endswith("le")
+    size = int(text[:-2] if little else text)
+    if not 1 <= size <= 8:
+        raise ValueError(f"field size {size} must be 1..8 bytes")
+    return size, little
+
+def parse_field(token):
+    """Parse one template token (hex bytes or {kind:args}) into a field dict."""
+    if not token.startswith("{"):
+        data = bytes.fromhex(token)
+        return {"kind": "hex", "size": len(data), "data": np.frombuffer(data, dtype=np.uint8)}
+
+    parts = token[1:-1].split(":")
+    kind, args = parts[0].strip().lower(), [p.strip() for p in parts[1:]]
+    checksum_field = udp_checksum.parse_checksum_field(token[1:-1])
+    if checksum_field is not None:
+        return checksum_field
+    if kind == "counter":
+        if not 1 <= len(args) <= 3:
+            raise ValueError("counter takes SIZE[:START[:STEP]]")
+        size, little = _parse_size(args[0])
+        start = _parse_int(args[1]) if len(args) > 1 else 0
+        step = _parse_int(args[2]) if len(args) > 2 else 1
+        mask = (1 << 64) - 1
+        return {"kind": kind, "size": size, "little": little, "start": start & mask, "step": step & mask}
+    if kind == "range":
+        if len(args) != 3:
+            raise ValueError("range takes SIZE:LO:HI")
+        size, little = _parse_size(args[0])
+        lo, hi = _parse_int(args[1]), _parse_int(args[2])
+        if hi < lo:
+            raise ValueError("range HI must not be below LO")
+        return {"kind": kind, "size": size, "little": little, "lo": lo, "hi": hi}
+    if kind == "random":
+        if not 1 <= len(args) <= 2:
+            raise ValueError("random takes SIZE[:SEED]")
+        size, _ = _parse_size(args[0])
+        seed = _parse_int(args[1]) if len(args) > 1 else None
+        return {"kind": kind, "size": size, "seed": seed}
+    raise ValueError(f"unknown template field {{{kind}}}")
+
+def parse_template(text):
+    """Parse a "#TEMPLATE <count> [DELAY <seconds>] <tokens...>" line into a PacketTemplate."""
+    body = text.strip()
+    if body.upper().startswith("#TEMPLATE"):
+        body = body[len("#TEMPLATE"):]
+    tokens = _TOKEN_RE.findall(body)
+    if not tokens:
+        raise ValueError("#TEMPLATE needs a repeat count")
+    count = _parse_int(tokens.pop(0))
+    if count < 0:
+        raise ValueError("#TEMPLATE count must not be negative")
+    delay = None
+    if len(tokens) >= 2 and tokens[0].upper() == "DELAY":
+        delay = float(tokens[1])
+        tokens = tokens[2:]
+    fields = [parse_field(token) for token in tokens]
+    if not fields:
+        raise ValueError("#TEMPLATE has no payload fields")
+    offset = 0
+    for field in fields:
+        if field["kind"] == "checksum" and field["start"] > offset:
+            raise ValueError(f"checksum start {field['start']} is past the end of the data")
+        offset += field["size"]
+    return PacketTemplate(fields, count, delay, text.strip())
+
+def send_template(sock, address, template, delay, stop_event=None, chunk_size=DEFAULT_CHUNK, metrics=None,
+                  tracer=udp_trace.NULL_TRACER, stamper=None, pacer=None, text=False):
+    """Send every packet of a template straight from the generated buffers; return the count sent.
+
+    Packets are paced against absolute deadlines (one every DELAY seconds)
+    so sleep overshoot does not accumulate. With metrics (a
+    udp_metrics.RunMetrics), one send in SAMPLE_EVERY is timed. The tracer
+    records one generate and one send span per chunk. With a
+    udp_seq.SequenceStamper, every packet is copied and stamped. A
+    udp_rate.AimdPacer sets the pace from DUT replies instead, unless the
+    template has its own DELAY. With text, packets go out as ASCII hex.
+    """
+    delay = template.delay if template.delay is not None else delay
+    if template.delay is not None:
+        pacer = None
+    length = template.length * 2 if text else template.length
+    sent = 0
+    untimed = 0
+    start = time.perf_counter()
+    try:
+        for first in range(0, template.count, chunk_size):
+            with tracer.span("template.generate", "parse", first=first):
+                chunk = template.generate(first, first + chunk_size, text)
+            view = memoryview(chunk).cast("B")
+            with tracer.span("template.send", "send", packets=chunk.shape[0]):
+                for row in range(chunk.shape[0]):
+                    if stop_event is not None and stop_event.is_set():
+                        return sent
+                    packet = view[row * length:(row + 1) * length]
+                    if stamper is not None:
+                        packet = stamper.stamp(packet)
+                    if metrics is not None and sent % SAMPLE_EVERY == 0:
+                        sent_at = time.perf_counter()
+                        sock.sendto(packet, address)
+                        metrics.record_send(len(packet), time.perf_counter() - sent_at)
+                    else:
+                        sock.sendto(packet, address)
+                        untimed += 1
+                    sent += 1
+                    if pacer is not None:
+                        pacer.after_send(sock, time.perf_counter())
+                    elif delay:
+                        deadline = start + sent * delay
+                        remaining = deadline - time.perf_counter()
+                        if remaining > 0:
+                            time.sleep(remaining)
+                        if metrics is not None:
+                            metrics.record_pacing(time.perf_counter() - deadline)
+    finally:
+        if metrics is not None and untimed:
+            metrics.record_batch(untimed, untimed * (length + (udp_seq.STAMP_SIZE if stamper else 0)))
+    return sent
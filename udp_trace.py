@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter, deque
+
+# Opt-in span tracing for a run. Spans (parse, send, log, capture, write, ...)
+# are written in Chrome trace-event JSON, which chrome://tracing and
+# ui.perfetto.dev open directly. An optional sampling profiler records which
+# functions the run threads were in, for a text summary next to the trace.
+# Only the newest MAX_EVENTS events are kept, so tracing a long run does not
+# grow without bound; span totals still count every span, and the trace
+# says how many events were dropped.
+
+DEFAULT_SAMPLE_INTERVAL = 0.005  # Seconds between profiler samples
+MAX_EVENTS = 500_000  # Events held for the trace file (a few hundred bytes each)
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.add_complete(self.name, self.cat, self.start, end - self.start, self.args)
+        return False
+
+class Tracer:
+    """Collects trace spans for one run; a disabled tracer costs one call per span."""
+
+    def __init__(self, enabled=True, sample_interval=None, max_events=MAX_EVENTS):
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.events = deque(maxlen=max_events)  # Oldest events fall out first
+        self.recorded = 0
+        self.totals = {}  # {span name: [count, total ns]} over every span, kept or dropped
+        self._lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.thread_names = {}
+        self.samples = Counter()
+        self.stacks = Counter()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    def span(self, name, cat="run", **args):
+        """Return a context manager that records a complete span around its body."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def add_complete(self, name, cat, start_ns, duration_ns, args=None):
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+            "ts": (start_ns - self.origin) / 1000.0, "dur": duration_ns / 1000.0,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self.recorded += 1
+            total = self.totals.setdefault(name, [0, 0])
+            total[0] += 1
+            total[1] += duration_ns
+
+    def instant(self, name, cat="run", **args):
+        """Record a zero-length marker."""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        event = {"name": name, "cat": cat, "ph": "i", "s": "t", "pid": os.getpid(), "tid": thread.ident,
+                 "ts": (time.perf_counter_ns() - self.origin) / 1000.0}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self.recorded += 1
+
+    @property
+    def dropped(self):
+        """Events recorded but no longer held for the trace file."""
+        return self.recorded - len(self.events)
+
+    def start_sampling(self, threads=None):
+        """Start the sampling profiler for the given thread idents (all threads if None)."""
+        if not self.enabled or not self.sample_interval or self._sampler:
+            return
+        watched = set(threads) if threads else None
+
+        def sample():
+            own = threading.get_ident()
+            while not self._stop_sampling.wait(self.sample_interval):
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (watched is not None and ident not in watched):
+                        continue
+                    code = frame.f_code
+                    self.samples[f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"] += 1
+                    stack = []
+                    while frame is not None and len(stack) < 12:
+                        stack.append(frame.f_code.co_name)
+                        frame = frame.f_back
+                    self.stacks[";".join(reversed(stack))] += 1
+
+        self._sampler = threading.Thread(target=sample, name="trace-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop_sampling(self):
+        if self._sampler:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def span_totals(self):
+        """Return {name: (count, total_ms)} over all recorded spans, including dropped ones."""
+        with self._lock:
+            return {name: (count, total / 1e6) for name, (count, total) in self.totals.items()}
+
+    def write(self, path):
+        """Write the trace as Chrome trace-event JSON and return its path."""
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": ident, "args": {"name": name}}
+            for ident, name in self.thread_names.items()
+        ]
+        with self._lock:
+            events = list(self.events)
+            dropped = self.recorded - len(events)
+        trace = {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                 "otherData": {"recorded_events": len(events) + dropped, "dropped_events": dropped}}
+        with open(path, "w") as file:
+            json.dump(trace, file)
+        return path
+
+    def write_profile_summary(self, path, top=25):
+        """Write span totals and the hottest sampled functions/stacks as text and return the path."""
+        lines = []
+        if self.dropped:
+            lines.append(f"Trace holds the newest {len(self.events)} events; {self.dropped} older ones were dropped.")
+            lines.append("")
+        lines.append("Span totals (count, total ms, mean us):")
+        for name, (count, total) in sorted(self.span_totals().items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name:28s} {count:10d} {total:12.3f} {total * 1000.0 / count:10.2f}")
+        total_samples = sum(self.samples.values())
+        if total_samples:
+            lines.append("")
+            lines.append(f"Sampled functions ({total_samples} samples every {self.sample_interval * 1000:g} ms):")
+            for name, count in self.samples.most_common(top):
+                lines.append(f"  {count / total_samples:6.1%}  {name}")
+            lines.append("")
+            lines.append("Sampled stacks:")
+            for stack, count in self.stacks.most_common(top):
+                lines.append(f"  {count / total_samples:6.1%}  {stack}")
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+    def save(self, log_filename):
+        """Write <log>_trace.json (and <log>_profile.txt) next to a run log; return the trace path."""
+        self.stop_sampling()
+        base = log_filename.rsplit(".", 1)[0]
+        trace_path = self.write(base + "_trace.json")
+        self.write_profile_summary(base + "_profile.txt")
+        return trace_path
+
+NULL_TRACER = Tracer(enabled=False)
@@ -0,0 +1,269 @@
+import gc
+import os
+import json
+import time
+import errno
+import socket
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+import udp_capture
+import udp_checksum
+import udp_rate
+import udp_seq
+import udp_template
+
+# Transmission in a separate process, so Qt painting, log appends, pixmap
+# decoding and garbage collection in the GUI process cannot delay packets.
+#
+# The GUI compiles a plan into a program in shared memory:
+#   header:  magic "UTXP" | u32 record count
+#   records: u8 op | u32 length | data
+# (SEND: the decoded payload, CAPTURE: empty, TEMPLATE: the #TEMPLATE line,
+# REPLAY: {"path", "speed"} JSON). The transmit process runs it and reports
+# back through a single-producer/single-consumer ring of fixed 32-byte
+# events in shared memory; each side only ever writes its own index, so no
+# lock is needed. At a scope capture the transmit process posts an event and
+# waits until the GUI bumps the resume counter in the control block.
+# Status records (sent, paced, rate) never wait for ring space: when the GUI
+# falls behind they are dropped and counted in the summary. Error messages
+# go over the result pipe ahead of their EV_ERROR event, which carries only
+# the errno.
+
+PROGRAM_MAGIC = b"UTXP"
+OP_SEND, OP_CAPTURE, OP_TEMPLATE, OP_REPLAY = 1, 2, 3, 4
+EV_SENT, EV_PACED, EV_CAPTURE, EV_TEMPLATE, EV_REPLAY, EV_ERROR, EV_RATE, EV_DONE = 1, 2, 3, 4, 5, 6, 7, 8
+
+_RECORD = struct.Struct("<BI")
+_EVENT = struct.Struct("<BxxxIqqq")  # kind, op index, a, b, c
+_INDEX = struct.Struct("<Q")
+RING_SLOTS = 65536
+RING_HEADER = 64  # Write index at 0, read index at 32: separate cache lines
+_CONTROL = struct.Struct("<qq")  # stop flag, resume counter
+_COUNTER = struct.Struct("<q")
+SPIN_SLEEP = 0.0005  # Seconds between polls while the ring is full or a capture is pending
+
+def compile_program(ops):
+    """Encode plan ops as a transmit program; returns bytes."""
+    parts = [PROGRAM_MAGIC, struct.pack("<I", len(ops))]
+    for op, arg, source, line_no in ops:
+        if op == "send":
+            data, code = udp_checksum.encode_line(arg), OP_SEND
+        elif op == "capture":
+            data, code = b"", OP_CAPTURE
+        elif op == "template":
+            data, code = arg.text.encode(), OP_TEMPLATE
+        elif op == "replay":
+            data, code = json.dumps(arg).encode(), OP_REPLAY
+        else:
+            raise ValueError(f"op {op!r} cannot run in the transmit process")
+        parts.append(_RECORD.pack(code, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def _read_program(buf):
+    if bytes(buf[:4]) != PROGRAM_MAGIC:
+        raise ValueError("not a transmit program")
+    (count,) = struct.unpack_from("<I", buf, 4)
+    pos = 8
+    for _ in range(count):
+        code, length = _RECORD.unpack_from(buf, pos)
+        pos += _RECORD.size
+        yield code, bytes(buf[pos:pos + length])  # A copy, so no view outlives the shared memory
+        pos += length
+
+class StatusRing:
+    """Fixed-size event ring in shared memory with one writer and one reader."""
+
+    def __init__(self, shm):
+        self.buf = shm.buf
+        self.slots = (len(self.buf) - RING_HEADER) // _EVENT.size
+
+    @staticmethod
+    def size(slots=RING_SLOTS):
+        return RING_HEADER + slots * _EVENT.size
+
+    def _index(self, offset):
+        return _INDEX.unpack_from(self.buf, offset)[0]
+
+    def put(self, kind, index, a=0, b=0, c=0, wait=True):
+        """Append an event; returns False if the ring is full and wait is False."""
+        write = self._index(0)
+        while write - self._index(32) >= self.slots:
+            if not wait:
+                return False
+            time.sleep(SPIN_SLEEP)
+        _EVENT.pack_into(self.buf, RING_HEADER + (write % self.slots) * _EVENT.size, kind, index, a, b, c)
+        _INDEX.pack_into(self.buf, 0, write + 1)  # Publish only after the event is written
+        return True
+
+    def drain(self):
+        """Return all events written since the last drain."""
+        read, write = self._index(32), self._index(0)
+        events = [_EVENT.unpack_from(self.buf, RING_HEADER + (i % self.slots) * _EVENT.size) for i in range(read, write)]
+        _INDEX.pack_into(self.buf, 32, write)
+        return events
+
+class _SharedFlag:
+    """Looks like a threading.Event to send_template/replay_capture; reads the stop flag."""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def is_set(self):
+        return _CONTROL.unpack_from(self.buf, 0)[0] != 0
+
+def _attach(name):
+    # The child shares the parent's resource tracker, so the parent's unlink() covers both
+    return shared_memory.SharedMemory(name=name)
+
+def _pin(cpu):
+    if cpu is None:
+        return None
+    if not hasattr(os, "sched_setaffinity"):
+        return "CPU pinning is not supported on this platform"
+    try:
+        os.sched_setaffinity(0, {int(cpu)})
+    except (OSError, ValueError) as e:
+        return f"Could not pin to CPU {cpu}: {e}"
+    return None
+
+def _transmit(program_name, ring_name, control_name, address, options, result):
+    """Transmit process entry point."""
+    program = _attach(program_name)
+    ring_shm = _attach(ring_name)
+    control = _attach(control_name)
+    ring = StatusRing(ring_shm)
+    stop = _SharedFlag(control.buf)
+    summary = {"pin_error": _pin(options.get("cpu")), "overflowed": 0}
+
+    def status(kind, index, a=0, b=0, c=0):
+        if not ring.put(kind, index, a, b, c, wait=False):
+            summary["overflowed"] += 1  # Never block the wire for a status record
+
+    delay = options.get("delay", 1.0)
+    stamper = udp_seq.SequenceStamper(options["sequence"]) if options.get("sequence") else None
+    pacer = None
+    if options.get("adaptive") is not None:
+        pacer = udp_rate.pacer_from_config(options["adaptive"], delay,
+                                           on_change=lambda elapsed, rate, reason: status(EV_RATE, 0, int(rate * 1000), int(elapsed * 1e9)))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    captures = 0
+    gc.collect()
+    gc.disable()  # No collector pauses between packets; the run allocates very little
+    try:
+        for index, (code, data) in enumerate(_read_program(program.buf)):
+            if stop.is_set():
+                break
+            try:
+                if code == OP_SEND:
+                    payload = stamper.stamp(data) if stamper else data
+                    sent_at = time.perf_counter()
+                    sock.sendto(payload, address)
+                    latency = time.perf_counter() - sent_at
+                    status(EV_SENT, index, len(payload), int(latency * 1e9), time.time_ns())
+                    if pacer is not None:
+                        pacer.after_send(sock, sent_at)
+                    else:
+                        time.sleep(max(0.0, sent_at + delay - time.perf_counter()))
+                        status(EV_PACED, index, int((time.perf_counter() - (sent_at + delay)) * 1e9))
+                elif code == OP_CAPTURE:
+                    if pacer is not None:
+                        pacer.finish(sock)
+                    captures += 1
+                    ring.put(EV_CAPTURE, index)
+                    while _CONTROL.unpack_from(control.buf, 0)[1] < captures and not stop.is_set():
+                        time.sleep(SPIN_SLEEP)
+                elif code == OP_TEMPLATE:
+                    template = udp_template.parse_template(data.decode())
+                    sent = udp_template.send_template(sock, address, template, delay, stop_event=stop, stamper=stamper, pacer=pacer)
+                    ring.put(EV_TEMPLATE, index, sent, sent * (template.length + (udp_seq.STAMP_SIZE if stamper else 0)))
+                elif code == OP_REPLAY:
+                    replay = json.loads(data.decode())
+                    sent = udp_capture.replay_capture(replay["path"], sock, address, replay["speed"], stop_event=stop)
+                    ring.put(EV_REPLAY, index, sent)
+            except (OSError, ValueError) as e:
+                result.send((index, str(e) or type(e).__name__))  # Ahead of the event, so the GUI finds it there
+                ring.put(EV_ERROR, index, getattr(e, "errno", None) or errno.EINVAL)
+        if pacer is not None:
+            pacer.finish(sock)
+            summary["rate"] = pacer.summary()
+        if stamper is not None:
+            summary["sequence"] = stamper.report()
+    finally:
+        gc.enable()
+        sock.close()
+        ring.put(EV_DONE, 0)
+        result.send(summary)
+        result.close()
+        del ring
+        program.close()
+        ring_shm.close()
+        control.close()
+
+class TransmitProcess:
+    """Runs a compiled program in a child process and exposes its status ring."""
+
+    def __init__(self, ops, address, delay=1.0, sequence=None, adaptive=None, cpu=None):
+        """adaptive: pacing settings for udp_rate.pacer_from_config, or None for the fixed delay."""
+        data = compile_program(ops)
+        self.program = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        self.program.buf[:len(data)] = data
+        self.ring_shm = shared_memory.SharedMemory(create=True, size=StatusRing.size())
+        self.ring_shm.buf[:RING_HEADER] = bytes(RING_HEADER)
+        self.ring = StatusRing(self.ring_shm)
+        self.control = shared_memory.SharedMemory(create=True, size=_CONTROL.size)
+        _CONTROL.pack_into(self.control.buf, 0, 0, 0)
+        self.resumed = 0
+        self.summary = None
+        self.errors = {}  # Op index -> error message, read from the result pipe
+        context = multiprocessing.get_context("spawn")  # A clean interpreter: no Qt, no inherited threads
+        self._result, child_end = context.Pipe(duplex=False)
+        options = {"delay": delay, "sequence": sequence, "adaptive": adaptive, "cpu": cpu}
+        self.process = context.Process(target=_transmit, name="udp-transmit", daemon=True,
+                                       args=(self.program.name, self.ring_shm.name, self.control.name, address, options, child_end))
+
+    def start(self):
+        self.process.start()
+
+    def events(self):
+        return self.ring.drain()
+
+    def resume(self):
+        """Let the transmit process continue after a capture."""
+        self.resumed += 1
+        _COUNTER.pack_into(self.control.buf, 8, self.resumed)
+
+    def stop(self):
+        _COUNTER.pack_into(self.control.buf, 0, 1)
+
+    def _receive(self, timeout=0.0):
+        """Read error messages from the result pipe until the summary arrives or nothing comes within timeout."""
+        while self.summary is None and self._result.poll(timeout):
+            try:
+                message = self._result.recv()
+            except EOFError:
+                break
+            if isinstance(message, dict):
+                self.summary = message
+            else:
+                index, text = message
+                self.errors[index] = text
+
+    def error_message(self, index):
+        """Return the message of the error reported for op index, or None."""
+        self._receive()
+        return self.errors.pop(index, None)
+
+    def finish(self, timeout=5.0):
+        """Collect the child's summary, wait for it to exit and free the shared memory."""
+        self._receive(timeout)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring = None
+        for shm in (self.program, self.ring_shm, self.control):
+            shm.close()
+            shm.unlink()
+        return self.summary